@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "pneuma"))
+from registration.registration import Registration
+
+
+def insert_row_by_row(registration: Registration, metadata_df: pd.DataFrame):
+    # The previous add_metadata path: one INSERT ... RETURNING id per row.
+    metadata_ids = []
+    for _, row in metadata_df.iterrows():
+        payload = json.dumps({"payload": row["value"].strip()})
+        if row["metadata_type"] == "context":
+            metadata_ids.append(
+                registration.connection.sql(
+                    f"""INSERT INTO table_contexts (table_id, context)
+                    VALUES ('{row["table_id"]}', '{payload}')
+                    RETURNING id"""
+                ).fetchone()[0]
+            )
+        else:
+            metadata_ids.append(
+                registration.connection.sql(
+                    f"""INSERT INTO table_summaries (table_id, summary, summary_type)
+                    VALUES ('{row["table_id"]}', '{payload}', 'SummaryType.USER_GENERATED')
+                    RETURNING id"""
+                ).fetchone()[0]
+            )
+    return metadata_ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--tables", type=int, default=1_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        registration = Registration(os.path.join(tmp_dir, "storage.db"))
+        registration.setup()
+
+        table_ids = [f"table_{idx}.csv" for idx in range(args.tables)]
+        status_df = pd.DataFrame(
+            {
+                "id": table_ids,
+                "table_name": table_ids,
+                "status": "TableStatus.REGISTERED",
+                "creator": "benchmark",
+                "hash": table_ids,
+            }
+        )
+        registration.connection.sql(
+            """INSERT INTO table_status (id, table_name, status, creator, hash)
+            SELECT * FROM status_df"""
+        )
+
+        metadata_df = pd.DataFrame(
+            {
+                "table_id": [table_ids[idx % args.tables] for idx in range(args.rows)],
+                "metadata_type": [
+                    "context" if idx % 4 else "summary" for idx in range(args.rows)
+                ],
+                "value": [
+                    f"Context number {idx} describing how the table was collected."
+                    for idx in range(args.rows)
+                ],
+            }
+        )
+        metadata_path = os.path.join(tmp_dir, "metadata.csv")
+        metadata_df.to_csv(metadata_path, index=False)
+
+        start = time.time()
+        insert_row_by_row(registration, metadata_df)
+        row_by_row_time = time.time() - start
+
+        start = time.time()
+        response = json.loads(registration.add_metadata(metadata_path))
+        bulk_time = time.time() - start
+        assert len(response["data"]["metadata_ids"]) == args.rows
+
+        print(
+            f"Row-by-row: {row_by_row_time:.2f} s "
+            f"({args.rows / row_by_row_time:.0f} rows/s)"
+        )
+        print(f"Bulk: {bulk_time:.2f} s ({args.rows / bulk_time:.0f} rows/s)")
+        print(f"Speedup: {row_by_row_time / bulk_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sentence_transformers import SentenceTransformer
+from torch import bfloat16
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "pneuma"))
+import summarizer.summarizer as summarizer_module
+from registration.registration import Registration
+from summarizer.summarizer import Summarizer
+from utils.pipeline_initializer import initialize_pipeline
+
+token_counts = {"prompts": 0, "prompt_tokens": 0, "generated_tokens": 0}
+
+
+def count_tokens(pipe, outputs: list[list[dict[str, str]]]):
+    for output in outputs:
+        if output[-1]["role"] != "assistant":
+            continue
+        token_counts["prompts"] += 1
+        token_counts["prompt_tokens"] += len(
+            pipe.tokenizer.apply_chat_template(
+                output[:-1], tokenize=True, add_generation_prompt=True
+            )
+        )
+        token_counts["generated_tokens"] += len(
+            pipe.tokenizer.encode(output[-1]["content"], add_special_tokens=False)
+        )
+
+
+def wrap_prompt_functions():
+    # Every generation of the Summarizer, including its batch-size probes, goes
+    # through these two functions, so wrapping them counts all processed tokens.
+    prompt_pipeline = summarizer_module.prompt_pipeline
+    prompt_pipeline_robust = summarizer_module.prompt_pipeline_robust
+
+    def counted_prompt_pipeline(pipe, conversations, *args, **kwargs):
+        outputs = prompt_pipeline(pipe, conversations, *args, **kwargs)
+        count_tokens(pipe, outputs)
+        return outputs
+
+    def counted_prompt_pipeline_robust(pipe, conversations, *args, **kwargs):
+        outputs, batch_size = prompt_pipeline_robust(
+            pipe, conversations, *args, **kwargs
+        )
+        count_tokens(pipe, outputs)
+        return outputs, batch_size
+
+    summarizer_module.prompt_pipeline = counted_prompt_pipeline
+    summarizer_module.prompt_pipeline_robust = counted_prompt_pipeline_robust
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_path",
+        default=str(Path(__file__).resolve().parents[2] / "data_src/sample_data/csv"),
+    )
+    parser.add_argument("--llm_path", default="Qwen/Qwen2.5-7B-Instruct")
+    parser.add_argument("--embed_path", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--max_llm_batch_size", type=int, default=50)
+    args = parser.parse_args()
+
+    llm = initialize_pipeline(args.llm_path, bfloat16)
+    embed_model = SentenceTransformer(args.embed_path)
+    wrap_prompt_functions()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for narration_mode in ["column", "table"]:
+            db_path = os.path.join(tmp_dir, f"{narration_mode}.db")
+            registration = Registration(db_path)
+            registration.setup()
+            response = json.loads(registration.add_tables(args.data_path, "benchmark"))
+            assert response["status"] == "SUCCESS", response["message"]
+
+            # The cache is disabled so that both modes generate every narration.
+            summarizer = Summarizer(
+                llm,
+                embed_model,
+                db_path,
+                max_llm_batch_size=args.max_llm_batch_size,
+                llm_cache_size=0,
+                narration_mode=narration_mode,
+            )
+            for key in token_counts:
+                token_counts[key] = 0
+
+            start = time.time()
+            response = json.loads(summarizer.summarize())
+            elapsed = time.time() - start
+            assert response["status"] == "SUCCESS", response["message"]
+            print(
+                f"Narration mode {narration_mode}: {elapsed:.1f} s, "
+                f"{token_counts['prompts']} prompts, "
+                f"{token_counts['prompt_tokens']} prompt tokens, "
+                f"{token_counts['generated_tokens']} generated tokens"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+import torch
+from sentence_transformers import SentenceTransformer
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "pneuma"))
+from registration.registration import Registration
+from summarizer.summarizer import Summarizer
+from utils.pipeline_initializer import initialize_pipeline
+
+
+def generate_tables(data_path: str, tables: int, rows: int):
+    # Tables of different schemas, large enough that reading their sample rows
+    # takes time next to generating their narrations.
+    for idx in range(tables):
+        duckdb.sql(
+            f"""COPY (
+                SELECT range AS order_id_{idx},
+                    'customer_' || (range % 997) AS customer_{idx},
+                    random() * 1000 AS amount_{idx % 7},
+                    DATE '2020-01-01' + (range % 1000)::INTEGER AS order_date
+                FROM range({rows})
+            ) TO '{os.path.join(data_path, f"orders_{idx}.csv")}'"""
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm_path", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--embed_path", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--tables", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--max_tables_in_flight", type=int, default=4)
+    parser.add_argument("--pipeline_queue_size", type=int, default=1)
+    args = parser.parse_args()
+
+    llm = initialize_pipeline(
+        args.llm_path, torch.float32, context_length=4096, device_map=args.device
+    )
+    embed_model = SentenceTransformer(args.embed_path)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = os.path.join(tmp_dir, "data")
+        os.makedirs(data_path)
+        generate_tables(data_path, args.tables, args.rows)
+
+        summaries = {}
+        for queue_size in [0, args.pipeline_queue_size]:
+            db_path = os.path.join(tmp_dir, f"queue_size_{queue_size}.db")
+            registration = Registration(db_path)
+            registration.setup()
+            response = json.loads(registration.add_tables(data_path, "benchmark"))
+            assert response["status"] == "SUCCESS", response["message"]
+            registration.connection.close()
+
+            # The cache is disabled so that both runs generate every narration.
+            summarizer = Summarizer(
+                llm,
+                embed_model,
+                db_path,
+                max_batch_tokens=16384,
+                llm_cache_size=0,
+                max_tables_in_flight=args.max_tables_in_flight,
+                pipeline_queue_size=queue_size,
+            )
+            start = time.time()
+            response = json.loads(summarizer.summarize())
+            elapsed = time.time() - start
+            assert response["status"] == "SUCCESS", response["message"]
+
+            pipeline_stats = response["data"]["pipeline"]
+            print(f"Queue size {queue_size}: {elapsed:.1f} s")
+            for name, stats in pipeline_stats["stages"].items():
+                print(
+                    f"  {name}: busy {stats['busy_seconds']:.1f} s "
+                    f"({100 * stats['utilization']:.0f}%), "
+                    f"idle {stats['idle_seconds']:.1f} s, "
+                    f"blocked {stats['blocked_seconds']:.1f} s"
+                )
+            print(f"  Bottleneck: {pipeline_stats['bottleneck']}")
+
+            summaries[queue_size] = summarizer.connection.sql(
+                "SELECT table_id, summary FROM table_summaries ORDER BY table_id, id"
+            ).fetchall()
+            summarizer.connection.close()
+
+        identical = summaries[0] == summaries[args.pipeline_queue_size]
+        print(f"Identical summaries: {identical}")
+
+
+if __name__ == "__main__":
+    main()
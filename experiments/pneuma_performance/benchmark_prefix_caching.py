@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+from sentence_transformers import SentenceTransformer
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "pneuma"))
+from registration.registration import Registration
+from summarizer.summarizer import Summarizer
+from utils.pipeline_initializer import initialize_pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_path",
+        default=str(Path(__file__).resolve().parents[2] / "data_src/sample_data/csv"),
+    )
+    parser.add_argument("--llm_path", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--embed_path", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--max_llm_batch_size", type=int, default=50)
+    parser.add_argument("--max_batch_tokens", type=int, default=16384)
+    args = parser.parse_args()
+
+    llm = initialize_pipeline(
+        args.llm_path, torch.float32, context_length=4096, device_map=args.device
+    )
+    embed_model = SentenceTransformer(args.embed_path)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summaries = {}
+        for prefix_caching in [False, True]:
+            db_path = os.path.join(tmp_dir, f"prefix_caching_{prefix_caching}.db")
+            registration = Registration(db_path)
+            registration.setup()
+            response = json.loads(registration.add_tables(args.data_path, "benchmark"))
+            assert response["status"] == "SUCCESS", response["message"]
+            registration.connection.close()
+
+            # Both runs batch the prompts with the same limits, and the cache is
+            # disabled so that both generate every narration.
+            summarizer = Summarizer(
+                llm,
+                embed_model,
+                db_path,
+                max_llm_batch_size=args.max_llm_batch_size,
+                max_batch_tokens=args.max_batch_tokens,
+                llm_cache_size=0,
+                prefix_caching=prefix_caching,
+            )
+            start = time.time()
+            response = json.loads(summarizer.summarize())
+            elapsed = time.time() - start
+            assert response["status"] == "SUCCESS", response["message"]
+            print(f"Prefix caching {prefix_caching}: {elapsed:.1f} s")
+
+            summaries[prefix_caching] = summarizer.connection.sql(
+                "SELECT table_id, summary FROM table_summaries ORDER BY table_id, id"
+            ).fetchall()
+            summarizer.connection.close()
+
+        # Greedy decoding from a cached prefix should give the same narrations, up
+        # to floating-point differences between the cached and uncached kernels.
+        matches = sum(
+            summary == cached_summary
+            for summary, cached_summary in zip(summaries[False], summaries[True])
+        )
+        print(f"Identical summaries: {matches}/{len(summaries[False])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "pneuma"))
+from utils.row_sample import sample_rows
+
+
+def generate_table(db_path: str, rows: int):
+    connection = duckdb.connect(db_path)
+    connection.sql(
+        f"""CREATE TABLE benchmark_table AS
+        SELECT range AS id,
+            'name_' || range AS name,
+            random() * 1000 AS amount,
+            DATE '2020-01-01' + (range % 1000)::INTEGER AS day
+        FROM range({rows})"""
+    )
+    connection.close()
+
+
+def run_mode(mode: str, db_path: str):
+    connection = duckdb.connect(db_path, read_only=True)
+    start = time.time()
+    if mode == "pandas":
+        # The previous Summarizer path: the whole table is read into pandas
+        # (once for its columns and once more for its rows) to sample 5 rows.
+        columns = connection.sql("SELECT * FROM benchmark_table").to_df().columns
+        df = connection.sql("SELECT * FROM benchmark_table").to_df()
+        df.sample(n=min(len(df), 5), random_state=0)
+    else:
+        columns = connection.sql("SELECT * FROM benchmark_table").columns
+        sample_rows(connection, "benchmark_table", 5)
+    elapsed = time.time() - start
+    # ru_maxrss is reported in kilobytes on Linux.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"mode": mode, "time": elapsed, "peak_rss_mb": peak_rss_mb}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--mode", choices=["pandas", "duckdb"], default=None)
+    parser.add_argument("--db_path", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args.mode, args.db_path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "storage.db")
+        generate_table(db_path, args.rows)
+        print(f"Generated {args.rows} rows")
+
+        # Every mode runs in a fresh process so that peak RSS is not shared.
+        results = {}
+        for mode in ["pandas", "duckdb"]:
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--db_path", db_path],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{mode}: {results[mode]['time']:.2f} s, "
+                f"peak RSS {results[mode]['peak_rss_mb']:.1f} MB"
+            )
+
+        print(
+            f"Speedup: {results['pandas']['time'] / results['duckdb']['time']:.2f}x, "
+            f"peak RSS reduction: "
+            f"{results['pandas']['peak_rss_mb'] - results['duckdb']['peak_rss_mb']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
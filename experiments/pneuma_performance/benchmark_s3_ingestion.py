@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "pneuma"))
+from registration.registration import Registration
+
+
+def start_moto_server(port: int):
+    # moto provides an in-process S3-compatible server, so no credentials or
+    # network access are needed.
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(port=port)
+    server.start()
+    return server, boto3
+
+
+def upload_tables(registration: Registration, prefix: str, objects: int, rows: int):
+    # httpfs can write to the bucket as well, so the benchmark needs no S3 client.
+    for idx in range(objects):
+        extension = "parquet" if idx % 2 else "csv"
+        registration.connection.sql(
+            f"""COPY (
+                SELECT range AS id, 'value_{idx}_' || range AS name, random() AS amount
+                FROM range({rows})
+            ) TO '{prefix}/part_{idx // 10}/table_{idx}.{extension}'"""
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--moto", action="store_true", help="Start a local moto server")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument(
+        "--endpoint", type=str, default=None, help="e.g., localhost:9000"
+    )
+    parser.add_argument("--bucket", type=str, default="pneuma-benchmark")
+    parser.add_argument("--access_key", type=str, default="testing")
+    parser.add_argument("--secret_key", type=str, default="testing")
+    parser.add_argument("--region", type=str, default="us-east-1")
+    parser.add_argument("--objects", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    server = None
+    if args.moto:
+        server, boto3 = start_moto_server(args.port)
+        args.endpoint = f"localhost:{args.port}"
+        boto3.client(
+            "s3",
+            endpoint_url=f"http://{args.endpoint}",
+            aws_access_key_id=args.access_key,
+            aws_secret_access_key=args.secret_key,
+            region_name=args.region,
+        ).create_bucket(Bucket=args.bucket)
+
+    prefix = f"s3://{args.bucket}/tables"
+    s3_options = {
+        "source": "s3",
+        "s3_region": args.region,
+        "s3_access_key": args.access_key,
+        "s3_secret_access_key": args.secret_key,
+        "s3_endpoint": args.endpoint,
+        "s3_use_ssl": False,
+    }
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for run_idx, workers in enumerate(args.workers):
+                registration = Registration(
+                    os.path.join(tmp_dir, f"run_{run_idx}", "storage.db")
+                )
+                registration.setup()
+                if run_idx == 0:
+                    # Registering an empty prefix creates the secret used by COPY.
+                    registration.add_tables(prefix, "benchmark", **s3_options)
+                    upload_tables(registration, prefix, args.objects, args.rows)
+
+                start = time.time()
+                response = json.loads(
+                    registration.add_tables(
+                        prefix, "benchmark", num_workers=workers, **s3_options
+                    )
+                )
+                elapsed = time.time() - start
+
+                registered_count = registration.connection.sql(
+                    "SELECT COUNT(*) FROM table_status"
+                ).fetchone()[0]
+                assert response["data"]["file_count"] == args.objects, response
+                assert registered_count == args.objects, registered_count
+                print(
+                    f"{workers} workers: {args.objects} objects in {elapsed:.2f} s "
+                    f"({args.objects / elapsed:.1f} objects/s)"
+                )
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
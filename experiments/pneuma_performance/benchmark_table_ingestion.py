@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "pneuma"))
+from utils.table_fingerprint import compute_table_fingerprint
+
+
+def generate_csv(path: str, rows: int):
+    connection = duckdb.connect()
+    connection.sql(
+        f"""COPY (
+            SELECT range AS id,
+                'name_' || range AS name,
+                random() * 1000 AS amount,
+                DATE '2020-01-01' + (range % 1000)::INTEGER AS day
+            FROM range({rows})
+        ) TO '{path}' (HEADER, DELIMITER ',')"""
+    )
+
+
+def ingest_two_scans(connection: duckdb.DuckDBPyConnection, path: str):
+    # The previous registration path: one scan to create the table and a
+    # second scan that builds a single string of the whole table to hash it.
+    table = connection.sql(
+        f"SELECT * FROM read_csv('{path}', auto_detect=True, header=True, ignore_errors=True)"
+    )
+    table_hash = connection.sql(
+        f"""SELECT md5(string_agg(tbl::text, ''))
+        FROM read_csv('{path}', auto_detect=True, header=True, ignore_errors=True) AS tbl"""
+    ).fetchone()[0]
+    table.create('"benchmark_table"')
+    return table_hash
+
+
+def ingest_single_pass(connection: duckdb.DuckDBPyConnection, path: str):
+    # The current registration path (table storage mode): one scan of the file
+    # to create the table, then the streaming fingerprint of the materialized
+    # table. The column profiles add_tables also computes are left out, so only
+    # the hashing is compared.
+    connection.sql(
+        f"SELECT * FROM read_csv('{path}', auto_detect=True, header=True, ignore_errors=True)"
+    ).create('"benchmark_table"')
+    return compute_table_fingerprint(connection, '"benchmark_table"')
+
+
+def run_mode(mode: str, path: str, db_path: str):
+    connection = duckdb.connect(db_path)
+    start = time.time()
+    if mode == "two_scans":
+        ingest_two_scans(connection, path)
+    else:
+        ingest_single_pass(connection, path)
+    elapsed = time.time() - start
+    # ru_maxrss is reported in kilobytes on Linux.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"mode": mode, "time": elapsed, "peak_rss_mb": peak_rss_mb}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--mode", choices=["two_scans", "single_pass"], default=None)
+    parser.add_argument("--path", type=str, default=None)
+    parser.add_argument("--db_path", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args.mode, args.path, args.db_path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "large_table.csv")
+        generate_csv(csv_path, args.rows)
+        size_mb = os.path.getsize(csv_path) / 1024 / 1024
+        print(f"Generated {args.rows} rows ({size_mb:.1f} MB)")
+
+        # Every mode runs in a fresh process so that peak RSS is not shared.
+        results = {}
+        for mode in ["two_scans", "single_pass"]:
+            db_path = os.path.join(tmp_dir, f"{mode}.db")
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--mode",
+                    mode,
+                    "--path",
+                    csv_path,
+                    "--db_path",
+                    db_path,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{mode}: {results[mode]['time']:.2f} s, "
+                f"peak RSS {results[mode]['peak_rss_mb']:.1f} MB"
+            )
+
+        print(
+            f"Speedup: {results['two_scans']['time'] / results['single_pass']['time']:.2f}x, "
+            f"peak RSS reduction: "
+            f"{results['two_scans']['peak_rss_mb'] - results['single_pass']['peak_rss_mb']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import argparse
+import inspect
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+import torch
+from transformers import AutoTokenizer
+
+REPOSITORY_PATH = Path(__file__).resolve().parents[2]
+# Modules of pneuma are imported where they are used, since run_summarizer puts
+# the baseline tree in front of this one.
+sys.path.append(str(REPOSITORY_PATH / "pneuma"))
+
+
+class StubLLM:
+    # Stands in for the text-generation pipeline, so that summarize spends its
+    # time reading the catalog and writing the summaries instead of generating.
+    # The tokenizer is real, since prompts are still truncated and packed.
+    def __init__(self, llm_path: str):
+        self.tokenizer = AutoTokenizer.from_pretrained(llm_path)
+        self.model = SimpleNamespace(
+            name_or_path=llm_path, device=torch.device("cpu"), dtype=torch.float32
+        )
+
+    def __call__(self, conversations: list[list[dict[str, str]]], **kwargs):
+        return [
+            [
+                {
+                    "generated_text": conversation
+                    + [{"role": "assistant", "content": "An identifier."}]
+                }
+            ]
+            for conversation in conversations
+        ]
+
+
+def generate_tables(data_path: str, tables: int):
+    for idx in range(tables):
+        pd.DataFrame(
+            {
+                "id": range(20),
+                f"name_{idx}": [f"name {row}" for row in range(20)],
+                "amount": [row * 1.5 for row in range(20)],
+            }
+        ).to_csv(os.path.join(data_path, f"table_{idx}.csv"), index=False)
+
+
+def export_pneuma(ref: str, output_path: str) -> str:
+    # The pneuma package as of ref, so the baseline runs its own write path.
+    archive = subprocess.run(
+        ["git", "-C", str(REPOSITORY_PATH), "archive", "--format=tar", ref, "pneuma"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(output_path)
+    return os.path.join(output_path, "pneuma")
+
+
+def run_summarizer(args):
+    # Runs in its own process, so the modules of the given tree are imported.
+    sys.path.insert(0, args.pneuma_path)
+    from registration.registration import Registration
+    from summarizer.summarizer import Summarizer
+
+    registration = Registration(args.db_path)
+    registration.setup()
+    response = json.loads(registration.add_tables(args.data_path, "benchmark"))
+    assert response["status"] == "SUCCESS", response["message"]
+    registration.connection.close()
+
+    # Later versions also take a token budget and cache LLM outputs; the cache
+    # is disabled so both trees write every summary.
+    options = {}
+    if "llm_cache_size" in inspect.signature(Summarizer).parameters:
+        options = {"max_batch_tokens": 65536, "llm_cache_size": 0}
+    embed_model = SimpleNamespace(
+        tokenizer=AutoTokenizer.from_pretrained(args.embed_path)
+    )
+    summarizer = Summarizer(
+        StubLLM(args.llm_path), embed_model, args.db_path, **options
+    )
+    start = time.time()
+    response = json.loads(summarizer.summarize())
+    elapsed = time.time() - start
+    assert response["status"] == "SUCCESS", response["message"]
+    summary_count = summarizer.connection.sql(
+        "SELECT count(*) FROM table_summaries"
+    ).fetchone()[0]
+    print(
+        json.dumps(
+            {
+                "time": elapsed,
+                "tables": len(response["data"]["table_ids"]),
+                "summaries": summary_count,
+            }
+        )
+    )
+
+
+def register_folder(db_path: str, folder_path: str, commit_batch_size: int) -> float:
+    from registration.registration import Registration
+
+    registration = Registration(db_path)
+    registration.setup()
+    registration.COMMIT_BATCH_SIZE = commit_batch_size
+
+    start = time.time()
+    response = json.loads(registration.add_tables(folder_path, "benchmark"))
+    elapsed = time.time() - start
+    assert response["status"] == "SUCCESS", response["message"]
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--baseline_ref",
+        required=True,
+        help="The commit whose Summarizer writes every statement in auto-commit",
+    )
+    parser.add_argument("--tables", type=int, default=1_000)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--commit_batch_size", type=int, default=100)
+    parser.add_argument("--llm_path", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--embed_path", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--pneuma_path", default=None)
+    parser.add_argument("--data_path", default=None)
+    parser.add_argument("--db_path", default=None)
+    args = parser.parse_args()
+
+    if args.pneuma_path is not None:
+        run_summarizer(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = os.path.join(tmp_dir, "summarizer_tables")
+        os.makedirs(data_path)
+        generate_tables(data_path, args.tables)
+
+        results = {}
+        for label, pneuma_path in [
+            (
+                f"Baseline ({args.baseline_ref})",
+                export_pneuma(args.baseline_ref, os.path.join(tmp_dir, "baseline")),
+            ),
+            ("Batched transactions", str(REPOSITORY_PATH / "pneuma")),
+        ]:
+            # Every tree runs in a fresh process; its storage.db is registered
+            # by its own Registration, and only summarize is timed.
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--baseline_ref",
+                    args.baseline_ref,
+                    "--llm_path",
+                    args.llm_path,
+                    "--embed_path",
+                    args.embed_path,
+                    "--pneuma_path",
+                    pneuma_path,
+                    "--data_path",
+                    data_path,
+                    "--db_path",
+                    os.path.join(tmp_dir, f"summaries_{len(results)}.db"),
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            results[label] = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"Summarizer, {label}: {results[label]['time']:.2f} s "
+                f"({results[label]['tables'] / results[label]['time']:.0f} tables/s, "
+                f"{results[label]['summaries']} summaries)"
+            )
+
+        folder_path = os.path.join(tmp_dir, "tables")
+        os.makedirs(folder_path)
+        for idx in range(args.files):
+            pd.DataFrame({"id": [idx, idx + 1], "value": ["a", str(idx)]}).to_csv(
+                os.path.join(folder_path, f"table_{idx}.csv"), index=False
+            )
+
+        for label, commit_batch_size in [
+            ("one table per commit", 1),
+            (f"batches of {args.commit_batch_size}", args.commit_batch_size),
+        ]:
+            elapsed = register_folder(
+                os.path.join(tmp_dir, f"registration_{commit_batch_size}.db"),
+                folder_path,
+                commit_batch_size,
+            )
+            print(
+                f"Registration, {label}: {elapsed:.2f} s "
+                f"({args.files / elapsed:.0f} tables/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,13 @@ import sys
 import json
 
 sys.path.append("../..")
+sys.path.append("../../pneuma")
 
 from sentence_transformers import SentenceTransformer
 from sentence_transformers.SentenceTransformer import SentenceTransformer
 from benchmark_generator.context.utils.jsonl import read_jsonl, write_jsonl
 from tqdm import tqdm
+from utils.chunk_packer import merge_pieces, pack_chunks
 
 embedding_model = SentenceTransformer(
     "../models/bge-base", local_files_only=True, device="cpu"
@@ -38,19 +40,9 @@ def split_schema_summaries(
         ]["summary"]
         column_summaries = schema_summary.split(" | ")
 
-        col_idx = 0
-        while col_idx < len(column_summaries):
-            processed_summary = column_summaries[col_idx]
-
-            while (col_idx + 1) < len(column_summaries):
-                temp = processed_summary + " | " + column_summaries[col_idx + 1]
-                if len(tokenizer.encode(temp)) < EMBEDDING_MAX_TOKENS:
-                    processed_summary = temp
-                    col_idx += 1
-                else:
-                    break
-
-            col_idx += 1
+        for processed_summary in merge_pieces(
+            tokenizer, column_summaries, " | ", EMBEDDING_MAX_TOKENS
+        ):
             processed_contents.append(
                 {
                     "source_ids": [f"{table}_SEP_contents_SEP_schema"],
@@ -71,26 +63,19 @@ def merge_row_summaries(rows: list[dict[str, str]], name: str, summary_type: str
     for table in tqdm(unique_tables):
         table_rows = [row for row in rows if row["table"] == table]
 
-        rows_idx = 0
-        while rows_idx < len(table_rows):
-            processed_summary = table_rows[rows_idx]["summary"]
-            source_ids = [table_rows[rows_idx]["id"]]
-
-            while (rows_idx + 1) < len(table_rows):
-                temp = processed_summary + " || " + table_rows[rows_idx + 1]["summary"]
-                if len(tokenizer.encode(temp)) < EMBEDDING_MAX_TOKENS:
-                    source_ids.append(table_rows[rows_idx + 1]["id"])
-                    processed_summary = temp
-                    rows_idx += 1
-                else:
-                    break
-
-            rows_idx += 1
+        for chunk in pack_chunks(
+            tokenizer,
+            [row["summary"] for row in table_rows],
+            " || ",
+            EMBEDDING_MAX_TOKENS,
+        ):
             processed_rows.append(
                 {
-                    "source_ids": source_ids,
+                    "source_ids": [table_rows[row_idx]["id"] for row_idx in chunk],
                     "table": table,
-                    "summary": processed_summary,
+                    "summary": " || ".join(
+                        table_rows[row_idx]["summary"] for row_idx in chunk
+                    ),
                 }
             )
 
@@ -108,29 +93,21 @@ def merge_context_summaries(contexts: list[dict[str, str]], name: str):
     for table in tqdm(unique_tables):
         table_contexts = [context for context in contexts if context["table"] == table]
 
-        context_idx = 0
-        while context_idx < len(table_contexts):
-            processed_context = table_contexts[context_idx]["context"]
-            source_ids = [table_contexts[context_idx]["id"]]
-            while (context_idx + 1) < len(table_contexts):
-                temp = (
-                    processed_context
-                    + " || "
-                    + table_contexts[context_idx + 1]["context"]
-                )
-                if len(tokenizer.encode(temp)) < EMBEDDING_MAX_TOKENS:
-                    source_ids.append(table_contexts[context_idx + 1]["id"])
-                    processed_context = temp
-                    context_idx += 1
-                else:
-                    break
-
-            context_idx += 1
+        for chunk in pack_chunks(
+            tokenizer,
+            [context["context"] for context in table_contexts],
+            " || ",
+            EMBEDDING_MAX_TOKENS,
+        ):
             processed_contexts.append(
                 {
-                    "source_ids": source_ids,
+                    "source_ids": [
+                        table_contexts[context_idx]["id"] for context_idx in chunk
+                    ],
                     "table": table,
-                    "context": processed_context,
+                    "context": " || ".join(
+                        table_contexts[context_idx]["context"] for context_idx in chunk
+                    ),
                 }
             )
     print(f"Num of context summaries (BEFORE): {len(contexts)}")
@@ -7,7 +7,6 @@ from pathlib import Path
 
 import bm25s
 import chromadb
-import duckdb
 import fire
 import pandas as pd
 import Stemmer
@@ -15,9 +14,12 @@ from chromadb.db.base import UniqueConstraintError
 from sentence_transformers import SentenceTransformer
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.catalog import Catalog
+from utils.chunk_packer import merge_pieces
 from utils.logging_config import configure_logging
 from utils.response import Response, ResponseStatus
 from utils.storage_config import get_storage_path
+from utils.storage_manager import ConnectionRole, StorageManager
 from utils.summary_types import SummaryType
 
 configure_logging()
@@ -32,7 +34,9 @@ class IndexGenerator:
         index_path: str = None,
     ):
         self.db_path = db_path
-        self.connection = duckdb.connect(db_path)
+        self.storage_manager = StorageManager.get(db_path)
+        self.connection = self.storage_manager.connect(ConnectionRole.WRITER)
+        self.catalog = Catalog(self.connection)
         self.embedding_model = embed_model
         self.stemmer = Stemmer.Stemmer("english")
 
@@ -48,12 +52,7 @@ class IndexGenerator:
     def generate_index(self, index_name: str, table_ids: list | tuple = None) -> str:
         if table_ids is None:
             logger.info("No table ids provided. Generating index for all tables...")
-            table_ids = [
-                entry[0]
-                for entry in self.connection.sql(
-                    "SELECT id FROM table_status"
-                ).fetchall()
-            ]
+            table_ids = self.catalog.get_table_ids()
         elif isinstance(table_ids, str):
             table_ids = (table_ids,)
 
@@ -104,6 +103,8 @@ class IndexGenerator:
 
         logger.info(keyword_insert_response.message)
 
+        # Let query processes see the new index.
+        self.storage_manager.publish_snapshot()
         return Response(
             status=ResponseStatus.SUCCESS,
             message=f"Vector and keyword index named {index_name} with id {vector_index_id}"
@@ -135,11 +136,7 @@ class IndexGenerator:
 
         # If we decide to use DuckDB's vector store, we don't need to store
         # this data.
-        index_id = self.connection.sql(
-            f"""INSERT INTO indexes (name, location)
-            VALUES ('{index_name}', '{self.vector_index_path}')
-            RETURNING id"""
-        ).fetchone()[0]
+        index_id = self.catalog.insert_index(index_name, self.vector_index_path)
 
         return Response(
             status=ResponseStatus.SUCCESS,
@@ -213,10 +210,7 @@ class IndexGenerator:
         )
 
         # So we know which tables are included in this index.
-        self.connection.sql(
-            """INSERT INTO index_table_mappings (index_id, table_id)
-            SELECT * FROM insert_df""",
-        )
+        self.catalog.insert_dataframe("index_table_mappings", insert_df)
 
         return Response(
             status=ResponseStatus.SUCCESS,
@@ -229,11 +223,7 @@ class IndexGenerator:
         retriever.index(corpus_tokens)
         retriever.save(os.path.join(self.keyword_index_path, index_name), corpus=[])
 
-        index_id = self.connection.sql(
-            f"""INSERT INTO indexes (name, location)
-            VALUES ('{index_name}', '{self.keyword_index_path}')
-            RETURNING id"""
-        ).fetchone()[0]
+        index_id = self.catalog.insert_index(index_name, self.keyword_index_path)
 
         return Response(
             status=ResponseStatus.SUCCESS,
@@ -247,9 +237,7 @@ class IndexGenerator:
     def __insert_tables_to_keyword_index(
         self, index_id: int, table_ids: list | tuple, retriever: bm25s.BM25
     ):
-        index_name = self.connection.sql(
-            f"SELECT name FROM indexes WHERE id = {index_id}"
-        ).fetchone()[0]
+        index_name = self.catalog.get_index_name(index_id)
 
         corpus_json = []
         for table_id in table_ids:
@@ -315,10 +303,7 @@ class IndexGenerator:
         )
 
         # So we know which tables are included in this index.
-        self.connection.sql(
-            """INSERT INTO index_table_mappings (index_id, table_id)
-            SELECT * FROM insert_df""",
-        )
+        self.catalog.insert_dataframe("index_table_mappings", insert_df)
 
         return Response(
             status=ResponseStatus.SUCCESS,
@@ -326,43 +311,21 @@ class IndexGenerator:
         )
 
     def __get_table_contexts(self, table_id: str) -> list[tuple[str, str]]:
-        table_id = table_id.replace("'", "''")
-        return self.connection.sql(
-            f"""SELECT id, context FROM table_contexts
-            WHERE table_id='{table_id}'"""
-        ).fetchall()
+        return self.catalog.get_contexts(table_id)
 
     def __merge_contexts(self, contexts: list[tuple[str, str]]) -> list[str]:
-        tokenizer = self.embedding_model.tokenizer
         table_contexts = [json.loads(context[1])["payload"] for context in contexts]
-        processed_contexts = []
-
-        context_idx = 0
-        while context_idx < len(table_contexts):
-            current_context = table_contexts[context_idx]
-            while (context_idx + 1) < len(table_contexts):
-                combined_context = (
-                    current_context + " | " + table_contexts[context_idx + 1]
-                )
-                if len(tokenizer.encode(combined_context)) < self.EMBEDDING_MAX_TOKENS:
-                    current_context = combined_context
-                    context_idx += 1
-                else:
-                    break
-
-            context_idx += 1
-            processed_contexts.append(current_context)
-
-        return processed_contexts
+        return merge_pieces(
+            self.embedding_model.tokenizer,
+            table_contexts,
+            " | ",
+            self.EMBEDDING_MAX_TOKENS,
+        )
 
     def __get_table_summaries(
         self, table_id: str, summary_type: SummaryType
     ) -> list[tuple[str, str]]:
-        table_id = table_id.replace("'", "''")
-        return self.connection.sql(
-            f"""SELECT id, summary FROM table_summaries
-            WHERE table_id='{table_id}' AND summary_type='{summary_type}'"""
-        ).fetchall()
+        return self.catalog.get_summaries(table_id, summary_type)
 
 
 if __name__ == "__main__":
@@ -9,6 +9,7 @@ from registration.registration import Registration
 from summarizer.summarizer import Summarizer
 from torch import bfloat16
 from utils.pipeline_initializer import initialize_pipeline
+from utils.replica_pool import ReplicaPool, get_replica_devices
 from utils.storage_config import get_storage_path
 
 
@@ -20,6 +21,17 @@ class Pneuma:
         llm_path: str = "Qwen/Qwen2.5-7B-Instruct",
         embed_path: str = "BAAI/bge-base-en-v1.5",
         max_llm_batch_size: int = 50,
+        max_batch_tokens: int = None,
+        llm_cache_size: int = 100_000,
+        narration_mode: str = "column",
+        column_context_tokens: int = 4096,
+        prefix_caching: bool = False,
+        max_tables_in_flight: int = 100,
+        llm_replicas: int = 1,
+        llm_devices: list | tuple = None,
+        distributed: bool = False,
+        lease_seconds: int = 600,
+        pipeline_queue_size: int = 1,
     ):
         os.makedirs(out_path, exist_ok=True)
         self.out_path = out_path
@@ -30,6 +42,17 @@ class Pneuma:
         self.llm_path = llm_path
         self.embed_path = embed_path
         self.max_llm_batch_size = max_llm_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.llm_cache_size = llm_cache_size
+        self.narration_mode = narration_mode
+        self.column_context_tokens = column_context_tokens
+        self.prefix_caching = prefix_caching
+        self.max_tables_in_flight = max_tables_in_flight
+        self.llm_replicas = llm_replicas
+        self.llm_devices = llm_devices
+        self.distributed = distributed
+        self.lease_seconds = lease_seconds
+        self.pipeline_queue_size = pipeline_queue_size
 
         self.__hf_login()
 
@@ -38,6 +61,7 @@ class Pneuma:
         self.index_generator = None
         self.query = None
         self.llm = None
+        self.replica_pool = None
         self.embed_model = None
 
     def __hf_login(self):
@@ -51,13 +75,27 @@ class Pneuma:
         self.registration = Registration(db_path=self.db_path)
 
     def __init_summarizer(self):
-        self.__init_llm()
+        if self.llm_replicas > 1 or self.llm_devices:
+            self.__init_replica_pool()
+            llm = self.replica_pool
+        else:
+            self.__init_llm()
+            llm = self.llm
         self.__init_embed_model()
         self.summarizer = Summarizer(
-            llm=self.llm,
+            llm=llm,
             embed_model=self.embed_model,
             db_path=self.db_path,
             max_llm_batch_size=self.max_llm_batch_size,
+            max_batch_tokens=self.max_batch_tokens,
+            llm_cache_size=self.llm_cache_size,
+            narration_mode=self.narration_mode,
+            column_context_tokens=self.column_context_tokens,
+            prefix_caching=self.prefix_caching,
+            max_tables_in_flight=self.max_tables_in_flight,
+            distributed=self.distributed,
+            lease_seconds=self.lease_seconds,
+            pipeline_queue_size=self.pipeline_queue_size,
         )
 
     def __init_index_generator(self):
@@ -81,18 +119,35 @@ class Pneuma:
     def __init_llm(self):
         if self.llm is None:
             self.llm = initialize_pipeline(
-                self.llm_path, bfloat16, context_length=32768,
+                self.llm_path,
+                bfloat16,
+                context_length=32768,
             )
             # Specific setting for batching
             self.llm.tokenizer.pad_token_id = self.llm.model.config.eos_token_id
             self.llm.tokenizer.padding_side = "left"
     
+    def __init_replica_pool(self):
+        if self.replica_pool is None:
+            if isinstance(self.llm_devices, str):
+                devices = [self.llm_devices]
+            elif self.llm_devices:
+                devices = list(self.llm_devices)
+            else:
+                devices = get_replica_devices(self.llm_replicas)
+            self.replica_pool = ReplicaPool(
+                self.llm_path, devices, bfloat16, context_length=32768
+            )
+
     def __init_embed_model(self):
         if self.embed_model is None:
             self.embed_model = SentenceTransformer(self.embed_path)
 
     def setup(self) -> str:
-        if self.registration is None:
+        # A distributed Summarizer closes storage.db after every unit of work (see
+        # StorageManager.release_writer), so the other writers connect again for
+        # every call.
+        if self.registration is None or self.distributed:
             self.__init_registration()
         return self.registration.setup()
 
@@ -105,8 +160,13 @@ class Pneuma:
         s3_access_key: str = None,
         s3_secret_access_key: str = None,
         accept_duplicates: bool = False,
+        num_workers: int = 1,
+        storage_mode: str = "table",
+        s3_endpoint: str = None,
+        s3_use_ssl: bool = True,
+        sample_size: int = 1000,
     ) -> str:
-        if self.registration is None:
+        if self.registration is None or self.distributed:
             self.__init_registration()
         return self.registration.add_tables(
             path,
@@ -116,6 +176,11 @@ class Pneuma:
             s3_access_key,
             s3_secret_access_key,
             accept_duplicates,
+            num_workers,
+            storage_mode,
+            s3_endpoint,
+            s3_use_ssl,
+            sample_size,
         )
 
     def add_metadata(
@@ -124,7 +189,7 @@ class Pneuma:
         metadata_type: str = "",
         table_id: str = "",
     ) -> str:
-        if self.registration is None:
+        if self.registration is None or self.distributed:
             self.__init_registration()
         return self.registration.add_metadata(metadata_path, metadata_type, table_id)
 
@@ -139,7 +204,7 @@ class Pneuma:
         return self.summarizer.purge_tables()
 
     def generate_index(self, index_name: str, table_ids: list | tuple = None) -> str:
-        if self.index_generator is None:
+        if self.index_generator is None or self.distributed:
             self.__init_index_generator()
         return self.index_generator.generate_index(index_name, table_ids)
 
@@ -4,7 +4,6 @@ from pathlib import Path
 
 import bm25s
 import chromadb
-import duckdb
 import fire
 import Stemmer
 import torch
@@ -32,7 +31,8 @@ class Query:
         self.pipe = llm
         self.embedding_model = embed_model
         self.db_path = db_path
-        self.connection = duckdb.connect(db_path)
+        # Queries only read the indexes, not storage.db, so they do not block
+        # (and are not blocked by) a process that summarizes or indexes.
         self.stemmer = Stemmer.Stemmer("english")
 
         if index_path is None:
@@ -2,6 +2,8 @@ import json
 import logging
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import duckdb
@@ -9,9 +11,13 @@ import fire
 import pandas as pd
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.catalog import Catalog, quote_identifier
+from utils.column_profile import compute_column_profiles
 from utils.logging_config import configure_logging
 from utils.response import Response, ResponseStatus
 from utils.storage_config import get_storage_path
+from utils.storage_manager import ConnectionRole, StorageManager
+from utils.storage_mode import StorageMode, drop_table_or_view
 from utils.summary_types import SummaryType
 from utils.table_status import TableStatus
 
@@ -23,7 +29,11 @@ class Registration:
     def __init__(self, db_path: str = os.path.join(get_storage_path(), "storage.db")):
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.db_path = db_path
-        self.connection = duckdb.connect(db_path)
+        self.storage_manager = StorageManager.get(db_path)
+        self.connection = self.storage_manager.connect(ConnectionRole.WRITER)
+        self.catalog = Catalog(self.connection)
+        # Registrations are committed in transactions of this many tables.
+        self.COMMIT_BATCH_SIZE = 100
 
     def setup(self) -> str:
         try:
@@ -105,6 +115,81 @@ class Registration:
             )
             logger.info("Query history table created.")
 
+            # Per-column statistics collected while a table is registered, so later
+            # stages do not have to scan the table again to learn its shape.
+            # top_values holds the approximate most frequent values as a JSON list.
+            self.connection.sql(
+                """CREATE TABLE IF NOT EXISTS column_profiles (
+                    table_id VARCHAR NOT NULL REFERENCES table_status(id),
+                    column_idx INTEGER NOT NULL,
+                    column_name VARCHAR NOT NULL,
+                    column_type VARCHAR NOT NULL,
+                    row_count BIGINT NOT NULL,
+                    null_fraction DOUBLE NOT NULL,
+                    approx_distinct BIGINT NOT NULL,
+                    min_value VARCHAR,
+                    max_value VARCHAR,
+                    top_values JSON NOT NULL,
+                    )
+                """
+            )
+            logger.info("Column profiles table created.")
+
+            # The manifest was added together with the current fingerprint, so a
+            # catalog without it was hashed by earlier versions. It is migrated
+            # before the manifest is created, so a failed migration is retried.
+            if not self.__table_exists("table_manifest"):
+                self.__fingerprint_legacy_tables()
+
+            # Size and modification time of every registered file, so unchanged
+            # files are skipped when a folder is registered again. table_id is
+            # NULL for files that were rejected as duplicates.
+            self.connection.sql(
+                """CREATE TABLE IF NOT EXISTS table_manifest (
+                    path VARCHAR PRIMARY KEY,
+                    table_id VARCHAR,
+                    size BIGINT NOT NULL,
+                    mtime_ns BIGINT NOT NULL,
+                    hash VARCHAR NOT NULL,
+                    time_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    )
+                """
+            )
+            logger.info("Table manifest table created.")
+
+            # Outputs of the LLM, keyed by model, generation parameters, and prompt,
+            # so the Summarizer does not generate the same output twice (see
+            # LLMCache).
+            self.connection.sql(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    model_path VARCHAR NOT NULL,
+                    generation_params VARCHAR NOT NULL,
+                    prompt_hash VARCHAR NOT NULL,
+                    output VARCHAR NOT NULL,
+                    time_last_used TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (model_path, generation_params, prompt_hash)
+                    )
+                """
+            )
+            logger.info("LLM cache table created.")
+
+            # Leases of distributed summarization workers on the tables they
+            # claimed (see TableLeases).
+            self.connection.sql(
+                """CREATE TABLE IF NOT EXISTS table_leases (
+                    table_id VARCHAR PRIMARY KEY,
+                    owner VARCHAR NOT NULL,
+                    lease_expiry TIMESTAMP NOT NULL,
+                    time_last_heartbeat TIMESTAMP NOT NULL
+                    )
+                """
+            )
+            logger.info("Table leases table created.")
+
+            # Readers in other processes open the snapshot, so it exists from the
+            # start (see StorageManager.connect).
+            self.storage_manager.publish_snapshot()
+
             return Response(
                 status=ResponseStatus.SUCCESS,
                 message="Database Initialized.",
@@ -124,98 +209,123 @@ class Registration:
         s3_access_key: str = None,
         s3_secret_access_key: str = None,
         accept_duplicates: bool = False,
+        num_workers: int = 1,
+        storage_mode: str = StorageMode.TABLE.value,
+        s3_endpoint: str = None,
+        s3_use_ssl: bool = True,
+        sample_size: int = 1000,
     ) -> str:
         if source not in ["file", "s3"]:
             return "Invalid source. Please use 'file' or 's3'."
 
+        if storage_mode not in [mode.value for mode in StorageMode]:
+            return Response(
+                status=ResponseStatus.ERROR,
+                message="Invalid storage mode. Please use 'table', 'view', or 'sample'.",
+            ).to_json()
+
+        storage_mode = StorageMode(storage_mode)
+        if source == "s3" and storage_mode == StorageMode.VIEW:
+            # A view reads the bucket whenever it is queried, but the secret only
+            # lasts for this session, so other processes could not read it.
+            return Response(
+                status=ResponseStatus.ERROR,
+                message="Views cannot be registered over S3 objects. "
+                "Please use the 'table' or 'sample' storage mode.",
+            ).to_json()
+
         if source == "s3":
-            self.connection.execute(
-                f"""
-            SET s3_region='{s3_region}';
-            SET s3_access_key_id='{s3_access_key}';
-            SET s3_secret_access_key='{s3_secret_access_key}';
-            """
+            self.__create_s3_secret(
+                s3_region, s3_access_key, s3_secret_access_key, s3_endpoint, s3_use_ssl
             )
+            response = self.__read_s3_path(
+                path, creator, accept_duplicates, storage_mode, num_workers, sample_size
+            )
+        elif os.path.isfile(path):
+            response = self.__read_table_file(
+                path, creator, accept_duplicates, storage_mode, sample_size
+            )
+        elif os.path.isdir(path):
+            response = self.__read_table_folder(
+                path, creator, accept_duplicates, storage_mode, num_workers, sample_size
+            )
+        else:
+            return Response(
+                status=ResponseStatus.ERROR,
+                message=f"Invalid path: {path}",
+            ).to_json()
 
-        if os.path.isfile(path):
-            return self.__read_table_file(path, creator, accept_duplicates).to_json()
-        if os.path.isdir(path):
-            return self.__read_table_folder(path, creator, accept_duplicates).to_json()
-
-        return Response(
-            status=ResponseStatus.ERROR,
-            message=f"Invalid path: {path}",
-        ).to_json()
+        # Let readers in other processes see the new tables.
+        self.storage_manager.publish_snapshot()
+        return response.to_json()
 
     def add_metadata(
         self, metadata_path: str, metadata_type: str = "", table_id: str = ""
     ) -> str:
         if os.path.isfile(metadata_path):
-            return self.__read_metadata_file(
-                metadata_path, metadata_type, table_id
-            ).to_json()
-        if os.path.isdir(metadata_path):
-            return self.__read_metadata_folder(
+            response = self.__read_metadata_file(metadata_path, metadata_type, table_id)
+        elif os.path.isdir(metadata_path):
+            response = self.__read_metadata_folder(
                 metadata_path, metadata_type, table_id
+            )
+        else:
+            return Response(
+                status=ResponseStatus.ERROR,
+                message=f"Invalid path: {metadata_path}",
             ).to_json()
 
-        return Response(
-            status=ResponseStatus.ERROR,
-            message=f"Invalid path: {metadata_path}",
-        ).to_json()
+        self.storage_manager.publish_snapshot()
+        return response.to_json()
 
     def __read_table_file(
         self,
         path: str,
         creator: str,
         accept_duplicates: bool = False,
+        storage_mode: StorageMode = StorageMode.TABLE,
+        sample_size: int = 1000,
     ) -> Response:
-        # Index -1 to get the file extension, then slice [1:] to remove the dot.
-        file_type = os.path.splitext(path)[-1][1:]
+        unchanged_response = self.__check_unchanged(path, self.__get_manifest(path))
+        if unchanged_response is not None:
+            return unchanged_response
 
-        if file_type not in ["csv", "parquet"]:
+        # The table and its catalog rows are committed together, so an interrupted
+        # registration leaves neither behind.
+        self.connection.begin()
+        try:
+            response = self.__load_table_file(
+                self.connection, path, storage_mode, sample_size
+            )
+            if response.status == ResponseStatus.SUCCESS:
+                pending = {
+                    "table_status": [],
+                    "table_manifest": [],
+                    "column_profiles": [],
+                }
+                response = self.__register_loaded_table(
+                    response, creator, accept_duplicates, pending, self.connection
+                )
+                self.__flush_pending_registrations(pending)
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
             return Response(
                 status=ResponseStatus.ERROR,
-                message="Invalid file type. Please use 'csv' or 'parquet'.",
+                message=f"Error registering {path}: {e}",
             )
+        return response
+
+    def __get_table_id_and_name(self, path: str) -> tuple[str, str]:
+        # Index -1 to get the file extension, then slice [1:] to remove the dot.
+        file_type = os.path.splitext(path)[-1][1:]
 
         # If the path contains single quotes, we need to escape them to avoid
         # breaking the SQL query.
         path = path.replace("'", "''")
         if file_type == "csv":
             name = path.split("/")[-1][:-4]
-            table = self.connection.sql(
-                f"""SELECT *
-                    FROM read_csv(
-                        '{path}',
-                        auto_detect=True,
-                        header=True,
-                        ignore_errors=True
-                    )"""
-            )
-            table_hash = self.connection.sql(
-                f"""SELECT md5(string_agg(tbl::text, ''))
-                FROM read_csv(
-                    '{path}',
-                    auto_detect=True,
-                    header=True,
-                    ignore_errors=True
-                ) AS tbl"""
-            ).fetchone()[0]
-        elif file_type == "parquet":
+        else:
             name = path.split("/")[-1][:-8]
-            table = self.connection.sql(
-                f"""SELECT *
-                FROM read_parquet(
-                    '{path}'
-                )"""
-            )
-            table_hash = self.connection.sql(
-                f"""SELECT md5(string_agg(tbl::text, ''))
-                FROM read_parquet(
-                    '{path}'
-                ) AS tbl"""
-            ).fetchone()[0]
 
         # For ease of keeping track of IDs, we replace backslashes (Windows) with
         # forward slashes (everything else) to make the path (therefore, ID) consistent.
@@ -223,25 +333,47 @@ class Registration:
 
         # We want to avoid double quotes on table names, so we change them to single quotes.
         path = path.replace('"', "''")
+        return path, name
 
-        if not accept_duplicates:
-            # Check if table with the same hash already exist
-            table_exist = self.connection.sql(
-                f"SELECT id FROM table_status WHERE hash = '{table_hash}'"
-            ).fetchone()
-            if table_exist:
-                return Response(
-                    status=ResponseStatus.ERROR,
-                    message=f"This table already exists in the database with id {table_exist}.",
-                )
+    def __load_table_file(
+        self,
+        connection: duckdb.DuckDBPyConnection,
+        path: str,
+        storage_mode: StorageMode = StorageMode.TABLE,
+        sample_size: int = 1000,
+    ) -> Response:
+        # Index -1 to get the file extension, then slice [1:] to remove the dot.
+        file_type = os.path.splitext(path)[-1][1:]
 
-        # Check if table with the same ID already exists.
-        # This means the same table with updated data is being registered.
-        if self.connection.sql(
-            f"SELECT * FROM table_status WHERE id = '{path}'"
-        ).fetchone():
-            # TODO Check if the table data has changed. Prompt the user to confirm if they want to update.
-            pass
+        if file_type not in ["csv", "parquet"]:
+            return Response(
+                status=ResponseStatus.ERROR,
+                message="Invalid file type. Please use 'csv' or 'parquet'.",
+            )
+
+        # Stat the file before reading it, so a file modified during the load
+        # is seen as modified again on the next registration. Objects in a bucket
+        # are not tracked by the manifest.
+        is_remote = "://" in path
+        file_stat = None if is_remote else os.stat(path)
+        table_id, name = self.__get_table_id_and_name(path)
+
+        # If the path contains single quotes, we need to escape them to avoid
+        # breaking the SQL query. A view resolves its path whenever it is queried,
+        # so it must not depend on the working directory of this process.
+        if storage_mode == StorageMode.VIEW and not is_remote:
+            read_path = os.path.abspath(path).replace("'", "''")
+        else:
+            read_path = path.replace("'", "''")
+        if file_type == "csv":
+            read_function = f"""read_csv(
+                '{read_path}',
+                auto_detect=True,
+                header=True,
+                ignore_errors=True
+            )"""
+        elif file_type == "parquet":
+            read_function = f"read_parquet('{read_path}')"
 
         # The double quote is necessary to consider the path, which may contain
         # full stop that may mess with schema as a single string. Having single quote
@@ -250,51 +382,513 @@ class Registration:
 
         # Because we are using double quotes for the table creation, we need to unescape
         # the single quote so the table name fits the ID that is stored in table_status.
-        create_path = path.replace("''", "'")
-        table.create(f'"{create_path}"')
+        create_path = table_id.replace("''", "'")
 
-        self.connection.sql(
-            f"""INSERT INTO table_status (id, table_name, status, creator, hash)
-            VALUES ('{path}', '{name}', '{TableStatus.REGISTERED}', '{creator}', '{table_hash}')"""
+        # A table with this ID may already exist, either because the file has been
+        # modified since it was registered or because a previous run was interrupted
+        # before it was recorded in table_status. Either way, replace it. It may also
+        # have been registered with the other storage mode, which cannot be replaced.
+        drop_table_or_view(connection, create_path)
+        if storage_mode == StorageMode.SAMPLE:
+            # The whole file is streamed for the fingerprint and the profiles
+            # (which include the row count; see compute_column_profiles), but only
+            # the sample is written to the database, so its size does not depend
+            # on the number of rows.
+            table_hash, column_profiles = compute_column_profiles(
+                connection, read_function
+            )
+            connection.sql(
+                f"""CREATE TABLE "{create_path}" AS
+                SELECT * FROM {read_function}
+                USING SAMPLE reservoir({int(sample_size)} ROWS) REPEATABLE (0)"""
+            )
+        else:
+            if storage_mode == StorageMode.VIEW:
+                # Nothing is materialized: DuckDB reads the original file whenever
+                # the view is queried and pushes projections and samples down to it.
+                connection.sql(
+                    f"""CREATE VIEW "{create_path}" AS
+                    SELECT * FROM {read_function}"""
+                )
+            else:
+                connection.sql(
+                    f"""CREATE TABLE "{create_path}" AS
+                    SELECT * FROM {read_function}"""
+                )
+
+            # The file is read only once for a table; the fingerprint and the column
+            # profiles are computed from the materialized table instead of scanning
+            # the file again. For a view, they are computed from the file.
+            table_hash, column_profiles = compute_column_profiles(
+                connection, f'"{create_path}"'
+            )
+
+        return Response(
+            status=ResponseStatus.SUCCESS,
+            message=f"Table {table_id} has been loaded.",
+            data={
+                "table_id": table_id,
+                "table_name": name,
+                "table_hash": table_hash,
+                "column_profiles": [
+                    {"table_id": create_path, **profile} for profile in column_profiles
+                ],
+                "manifest_entry": (
+                    None
+                    if is_remote
+                    else {
+                        "path": self.__get_manifest_path(path),
+                        "table_id": create_path,
+                        "size": file_stat.st_size,
+                        "mtime_ns": file_stat.st_mtime_ns,
+                        "hash": table_hash,
+                    }
+                ),
+            },
         )
+
+    def __drop_table(self, connection: duckdb.DuckDBPyConnection, table_id: str):
+        drop_table_or_view(connection, table_id.replace("''", "'"))
+
+    def __get_manifest_path(self, path: str) -> str:
+        return path.replace("\\", "/")
+
+    def __get_manifest(self, path: str) -> dict[str, tuple]:
+        # For a folder, the whole manifest is read once instead of once per file.
+        if os.path.isdir(path):
+            entries = self.catalog.get_manifest_entries()
+        else:
+            entries = self.catalog.get_manifest_entries(self.__get_manifest_path(path))
+        return {entry[0]: entry[1:] for entry in entries}
+
+    def __check_unchanged(self, path: str, manifest: dict[str, tuple]) -> Response:
+        entry = manifest.get(self.__get_manifest_path(path))
+        if entry is None:
+            return None
+
+        manifest_table_id, size, mtime_ns = entry
+        file_stat = os.stat(path)
+        if file_stat.st_size != size or file_stat.st_mtime_ns != mtime_ns:
+            return None
+
+        if manifest_table_id is None:
+            return Response(
+                status=ResponseStatus.ERROR,
+                message=f"File {path} is unchanged and was rejected as a duplicate before.",
+            )
+
+        table_id, name = self.__get_table_id_and_name(path)
         return Response(
             status=ResponseStatus.SUCCESS,
-            message=f"Table with ID: {path} has been added to the database.",
-            data={"table_id": path, "table_name": name},
+            message=f"Table with ID: {table_id} is unchanged and has been skipped.",
+            data={"table_id": table_id, "table_name": name, "action": "skipped"},
         )
 
     def __read_table_folder(
-        self, folder_path: str, creator: str, accept_duplicates: bool = False
+        self,
+        folder_path: str,
+        creator: str,
+        accept_duplicates: bool = False,
+        storage_mode: StorageMode = StorageMode.TABLE,
+        num_workers: int = 1,
+        sample_size: int = 1000,
+    ) -> Response:
+        logger.info("Reading folder %s with %d workers...", folder_path, num_workers)
+        return self.__read_table_paths(
+            folder_path,
+            self.__list_files(folder_path),
+            self.__get_manifest(folder_path),
+            creator,
+            accept_duplicates,
+            storage_mode,
+            num_workers,
+            sample_size,
+        )
+
+    def __read_table_paths(
+        self,
+        folder_path: str,
+        paths: list[str],
+        manifest: dict[str, tuple],
+        creator: str,
+        accept_duplicates: bool = False,
+        storage_mode: StorageMode = StorageMode.TABLE,
+        num_workers: int = 1,
+        sample_size: int = 1000,
     ) -> Response:
-        logger.info("Reading folder %s...", folder_path)
-        paths = [os.path.join(folder_path, f) for f in os.listdir(folder_path)]
+        unchanged_responses = {
+            path: self.__check_unchanged(path, manifest) for path in paths
+        }
+        load_paths = [path for path in paths if unchanged_responses[path] is None]
+
+        if num_workers > 1:
+            # Each worker thread parses, hashes, and creates its tables through its
+            # own cursor. DuckDB releases the GIL while executing, so the workers
+            # scale across cores. Only this (writer) thread touches table_status and
+            # table_manifest. The worker cursors commit their tables on their own, so
+            # tables rejected here are dropped through a cursor outside the writer's
+            # transaction, which cannot see tables created after it began.
+            executor = ThreadPoolExecutor(max_workers=num_workers)
+            worker_state = threading.local()
+
+            def load_table(path: str) -> Response:
+                if not hasattr(worker_state, "cursor"):
+                    worker_state.cursor = self.connection.cursor()
+                return self.__load_table_file(
+                    worker_state.cursor, path, storage_mode, sample_size
+                )
+
+            # Results come back in listing order, so duplicates are resolved exactly
+            # as in the sequential path (the first file wins).
+            loaded_responses = executor.map(load_table, load_paths)
+            drop_connection = self.connection.cursor()
+        else:
+            # Tables are loaded lazily by the writer itself, inside its transaction.
+            executor = None
+            loaded_responses = (
+                self.__load_table_file(self.connection, path, storage_mode, sample_size)
+                for path in load_paths
+            )
+            drop_connection = self.connection
+
+        # Tables are registered in transactions of COMMIT_BATCH_SIZE tables. If one
+        # fails, only the current batch is rolled back: the manifest of the earlier
+        # batches is committed, so registering the folder again resumes after them.
+        pending = {"table_status": [], "table_manifest": [], "column_profiles": []}
         data = []
-        for path in paths:
-            logger.info("Processing %s...", path)
+        batch_count = 0
+        committed_count = 0
+        self.connection.begin()
+        try:
+            for path in paths:
+                response = unchanged_responses[path]
+                if response is None:
+                    response = next(loaded_responses)
+                    if response.status == ResponseStatus.SUCCESS:
+                        response = self.__register_loaded_table(
+                            response,
+                            creator,
+                            accept_duplicates,
+                            pending,
+                            drop_connection,
+                        )
+                    batch_count += 1
+                logger.info(
+                    "Processing table %s %s: %s",
+                    path,
+                    response.status.value,
+                    response.message,
+                )
+                data.append(response.data)
 
-            # If the path is a folder, recursively read the folder.
-            if os.path.isdir(path):
-                response = self.__read_table_folder(path, creator, accept_duplicates)
-                logger.info(response.message)
-                data.extend(response.data["tables"])
-                continue
+                if batch_count >= self.COMMIT_BATCH_SIZE:
+                    self.__flush_pending_registrations(pending)
+                    self.connection.commit()
+                    committed_count = len(data)
+                    batch_count = 0
+                    self.connection.begin()
 
-            response = self.__read_table_file(path, creator, accept_duplicates)
-            logger.info(
-                "Processing table %s %s: %s",
-                path,
-                response.status.value,
-                response.message,
+            self.__flush_pending_registrations(pending)
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            logger.error("Rolled back the current batch of %s: %s", folder_path, e)
+            return Response(
+                status=ResponseStatus.ERROR,
+                message=f"Error registering {folder_path}: {e}. "
+                f"The first {committed_count} "
+                f"files in {folder_path} have been committed; registering it again "
+                "resumes from there.",
+                data={"committed_count": committed_count},
             )
-            data.append(response.data)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        return self.__get_folder_response(folder_path, data)
+
+    def __create_s3_secret(
+        self,
+        s3_region: str = None,
+        s3_access_key: str = None,
+        s3_secret_access_key: str = None,
+        s3_endpoint: str = None,
+        s3_use_ssl: bool = True,
+    ):
+        # A secret, unlike SET, is visible to every cursor of this database, so the
+        # worker threads can read from the bucket as well.
+        options = {
+            "REGION": s3_region,
+            "KEY_ID": s3_access_key,
+            "SECRET": s3_secret_access_key,
+            "ENDPOINT": s3_endpoint,
+        }
+        secret_options = [
+            "{} '{}'".format(option, value.replace("'", "''"))
+            for option, value in options.items()
+            if value
+        ]
+        if s3_endpoint:
+            # S3-compatible stores such as MinIO are addressed by path, not by
+            # virtual host.
+            secret_options.append("URL_STYLE 'path'")
+        secret_options.append(f"USE_SSL {str(bool(s3_use_ssl)).lower()}")
+
+        self.connection.sql(
+            f"""CREATE OR REPLACE SECRET pneuma_s3 (
+                TYPE S3,
+                {", ".join(secret_options)}
+            )"""
+        )
+
+    def __read_s3_path(
+        self,
+        path: str,
+        creator: str,
+        accept_duplicates: bool = False,
+        storage_mode: StorageMode = StorageMode.TABLE,
+        num_workers: int = 1,
+        sample_size: int = 1000,
+    ) -> Response:
+        if os.path.splitext(path)[-1][1:] in ["csv", "parquet"]:
+            paths = [path]
+        else:
+            # List the prefix through httpfs; "**" also matches nested prefixes.
+            paths = [
+                entry[0]
+                for entry in self.catalog.execute(
+                    "SELECT file FROM glob(?) ORDER BY file",
+                    [path.rstrip("/") + "/**"],
+                ).fetchall()
+            ]
+        logger.info(
+            "Reading %d objects from %s with %d workers...",
+            len(paths),
+            path,
+            num_workers,
+        )
+
+        # Objects are fetched and parsed concurrently by at most num_workers
+        # threads, exactly like the files of a local folder.
+        return self.__read_table_paths(
+            path,
+            paths,
+            {},
+            creator,
+            accept_duplicates,
+            storage_mode,
+            max(num_workers, 1),
+            sample_size,
+        )
 
+    def __get_folder_response(self, folder_path: str, data: list[dict]) -> Response:
         file_count = len(data)
+        action_counts = {
+            action: sum(1 for entry in data if entry and entry["action"] == action)
+            for action in ["added", "updated", "skipped"]
+        }
+        return Response(
+            status=ResponseStatus.SUCCESS,
+            message=f"{file_count} files in folder {folder_path} has been processed "
+            f"({action_counts['added']} added, {action_counts['updated']} updated, "
+            f"{action_counts['skipped']} skipped).",
+            data={
+                "file_count": file_count,
+                "added_count": action_counts["added"],
+                "updated_count": action_counts["updated"],
+                "skipped_count": action_counts["skipped"],
+                "tables": data,
+            },
+        )
+
+    def __register_loaded_table(
+        self,
+        response: Response,
+        creator: str,
+        accept_duplicates: bool,
+        pending: dict[str, list[dict]],
+        drop_connection: duckdb.DuckDBPyConnection,
+    ) -> Response:
+        table_id = response.data["table_id"]
+        name = response.data["table_name"]
+        table_hash = response.data["table_hash"]
+        manifest_entry = response.data["manifest_entry"]
+        # The catalog binds IDs as parameters, so they are passed unescaped.
+        stored_table_id = table_id.replace("''", "'")
+
+        # Check if table with the same ID already exists.
+        # This means the same table with updated data is being registered.
+        existing_table = self.catalog.get_table_state(stored_table_id)
+        if existing_table is not None:
+            if manifest_entry is not None:
+                pending["table_manifest"].append(manifest_entry)
+            existing_hash, existing_status = existing_table
+            if existing_hash == table_hash:
+                # Only the file metadata changed, e.g., the file was touched or copied.
+                if existing_status == str(TableStatus.DELETED):
+                    self.__drop_table(drop_connection, table_id)
+                return Response(
+                    status=ResponseStatus.SUCCESS,
+                    message=f"Table with ID: {table_id} is unchanged and has been skipped.",
+                    data={
+                        "table_id": table_id,
+                        "table_name": name,
+                        "action": "skipped",
+                    },
+                )
+
+            # The table keeps its ID, so it is not checked for duplicates again.
+            # Its generated summaries are outdated and will be regenerated.
+            self.catalog.update_table_status(
+                stored_table_id, TableStatus.REGISTERED, table_hash
+            )
+            self.catalog.delete_summaries(
+                stored_table_id, [SummaryType.NARRATION, SummaryType.ROW_SUMMARY]
+            )
+            self.catalog.delete_column_profiles(stored_table_id)
+            pending["column_profiles"].extend(response.data["column_profiles"])
+            return Response(
+                status=ResponseStatus.SUCCESS,
+                message=f"Table with ID: {table_id} has been updated in the database.",
+                data={"table_id": table_id, "table_name": name, "action": "updated"},
+            )
+
+        if not accept_duplicates:
+            # Check if table with the same hash already exist
+            table_exist = self.catalog.get_table_id_by_hash(table_hash)
+            if table_exist is None:
+                table_exist = next(
+                    (
+                        row["id"]
+                        for row in pending["table_status"]
+                        if row["hash"] == table_hash
+                    ),
+                    None,
+                )
+            if table_exist:
+                # The table has already been created, so drop it again.
+                self.__drop_table(drop_connection, table_id)
+                if manifest_entry is not None:
+                    pending["table_manifest"].append(
+                        {**manifest_entry, "table_id": None}
+                    )
+                return Response(
+                    status=ResponseStatus.ERROR,
+                    message=f"This table already exists in the database with id {table_exist}.",
+                )
+
+        pending["table_status"].append(
+            {
+                "id": stored_table_id,
+                "table_name": name.replace("''", "'"),
+                "status": str(TableStatus.REGISTERED),
+                "creator": creator,
+                "hash": table_hash,
+            }
+        )
+        pending["column_profiles"].extend(response.data["column_profiles"])
+        if manifest_entry is not None:
+            pending["table_manifest"].append(manifest_entry)
         return Response(
             status=ResponseStatus.SUCCESS,
-            message=f"{file_count} files in folder {folder_path} has been processed.",
-            data={"file_count": file_count, "tables": data},
+            message=f"Table with ID: {table_id} has been added to the database.",
+            data={"table_id": table_id, "table_name": name, "action": "added"},
+        )
+
+    def __flush_pending_registrations(self, pending: dict[str, list[dict]]):
+        if pending["table_status"]:
+            status_df = pd.DataFrame.from_records(
+                pending["table_status"],
+                columns=["id", "table_name", "status", "creator", "hash"],
+            )
+            self.catalog.insert_dataframe("table_status", status_df)
+            pending["table_status"] = []
+
+        # Profiles reference table_status, so they are inserted after it.
+        if pending["column_profiles"]:
+            profiles_df = pd.DataFrame.from_records(
+                pending["column_profiles"],
+                columns=[
+                    "table_id",
+                    "column_idx",
+                    "column_name",
+                    "column_type",
+                    "row_count",
+                    "null_fraction",
+                    "approx_distinct",
+                    "min_value",
+                    "max_value",
+                    "top_values",
+                ],
+            )
+            self.catalog.insert_dataframe("column_profiles", profiles_df)
+            pending["column_profiles"] = []
+
+        if pending["table_manifest"]:
+            manifest_df = pd.DataFrame.from_records(
+                pending["table_manifest"],
+                columns=["path", "table_id", "size", "mtime_ns", "hash"],
+            )
+            self.catalog.upsert_manifest_entries(manifest_df)
+            pending["table_manifest"] = []
+
+    def __table_exists(self, table: str) -> bool:
+        return (
+            self.catalog.execute(
+                "SELECT 1 FROM duckdb_tables() WHERE table_name = ?", [table]
+            ).fetchone()
+            is not None
         )
 
+    def __fingerprint_legacy_tables(self):
+        # Earlier versions hashed a table with md5(string_agg(...)), which
+        # compute_table_fingerprint does not reproduce, so every table would be
+        # taken as updated on its next registration and lose its summaries. They
+        # only stored whole tables, whose content is that of the file when it was
+        # registered, so the stored tables are fingerprinted (and profiled) once.
+        table_ids = [
+            entry[0]
+            for entry in self.catalog.execute(
+                """SELECT id FROM table_status
+                WHERE id IN (SELECT table_name FROM duckdb_tables())"""
+            ).fetchall()
+        ]
+        pending = {"table_status": [], "table_manifest": [], "column_profiles": []}
+        table_hashes = []
+        for table_id in table_ids:
+            table_hash, column_profiles = compute_column_profiles(
+                self.connection, quote_identifier(table_id)
+            )
+            table_hashes.append([table_hash, table_id])
+            pending["column_profiles"].extend(
+                {"table_id": table_id, **profile} for profile in column_profiles
+            )
+
+        self.connection.begin()
+        try:
+            self.catalog.executemany(
+                "UPDATE table_status SET hash = ? WHERE id = ?", table_hashes
+            )
+            for table_id in table_ids:
+                self.catalog.delete_column_profiles(table_id)
+            self.__flush_pending_registrations(pending)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        logger.info("Fingerprinted %d tables of an earlier version.", len(table_ids))
+
+    def __list_files(self, folder_path: str) -> list[str]:
+        # Same (depth-first) order in which __read_table_folder visits the files.
+        paths = []
+        for f in os.listdir(folder_path):
+            path = os.path.join(folder_path, f)
+            if os.path.isdir(path):
+                paths.extend(self.__list_files(path))
+            else:
+                paths.append(path)
+        return paths
+
     def __insert_metadata(
         self, metadata_type: str, metadata_content: str, table_id: str
     ) -> Response:
@@ -303,17 +897,11 @@ class Registration:
         }
 
         if metadata_type == "context":
-            metadata_id = self.connection.sql(
-                f"""INSERT INTO table_contexts (table_id, context)
-                VALUES ('{table_id}', '{json.dumps(payload)}')
-                RETURNING id"""
-            ).fetchone()[0]
+            metadata_id = self.catalog.insert_context(table_id, json.dumps(payload))
         elif metadata_type == "summary":
-            metadata_id = self.connection.sql(
-                f"""INSERT INTO table_summaries (table_id, summary, summary_type)
-                VALUES ('{table_id}', '{json.dumps(payload)}', '{SummaryType.USER_GENERATED}')
-                RETURNING id"""
-            ).fetchone()[0]
+            metadata_id = self.catalog.insert_summaries(
+                table_id, [json.dumps(payload)], SummaryType.USER_GENERATED
+            )[0]
 
         return Response(
             status=ResponseStatus.SUCCESS,
@@ -321,6 +909,57 @@ class Registration:
             data={"file_count": 1, "metadata_ids": [metadata_id]},
         )
 
+    def __bulk_insert_metadata(self, metadata_df: pd.DataFrame) -> Response:
+        invalid_types = set(metadata_df["metadata_type"]) - {"context", "summary"}
+        if invalid_types:
+            return Response(
+                status=ResponseStatus.ERROR,
+                message=f"Invalid metadata types: {sorted(invalid_types)}. "
+                "Please use 'context' or 'summary'.",
+                data={"file_count": 0, "metadata_ids": []},
+            )
+
+        payloads = [
+            json.dumps({"payload": str(value).strip()})
+            for value in metadata_df["value"]
+        ]
+        # The IDs are drawn from the sequence up front and assigned in row order,
+        # so every ID can be mapped back to its row of the metadata file.
+        metadata_ids = self.catalog.next_ids(len(metadata_df))
+        insert_df = pd.DataFrame(
+            {
+                "id": metadata_ids,
+                "table_id": metadata_df["table_id"].to_list(),
+                "payload": payloads,
+                "metadata_type": metadata_df["metadata_type"].to_list(),
+            }
+        )
+        is_context = insert_df["metadata_type"] == "context"
+        contexts_df = insert_df.loc[is_context, ["id", "table_id", "payload"]].rename(
+            columns={"payload": "context"}
+        )
+        summaries_df = insert_df.loc[~is_context, ["id", "table_id", "payload"]].rename(
+            columns={"payload": "summary"}
+        )
+        summaries_df["summary_type"] = str(SummaryType.USER_GENERATED)
+
+        # One set-based insert per metadata table instead of one per row, both
+        # committed together so a metadata file is never half loaded.
+        self.connection.begin()
+        try:
+            self.catalog.insert_dataframe("table_contexts", contexts_df)
+            self.catalog.insert_dataframe("table_summaries", summaries_df)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+        return Response(
+            status=ResponseStatus.SUCCESS,
+            message=f"{len(metadata_df)} metadata entries has been added.",
+            data={"file_count": len(metadata_ids), "metadata_ids": metadata_ids},
+        )
+
     def __read_metadata_file(
         self, metadata_path: str, metadata_type: str, table_id: str
     ) -> Response:
@@ -341,22 +980,7 @@ class Registration:
 
         if file_type == "csv":
             metadata_df = pd.read_csv(metadata_path)
-            data = []
-            for index, row in metadata_df.iterrows():
-                table_id = row["table_id"]
-                metadata_type = row["metadata_type"]
-                metadata_content = row["value"]
-                response = self.__insert_metadata(
-                    metadata_type, metadata_content, table_id
-                )
-                logger.info(response.message)
-                data.extend(response.data["metadata_ids"])
-
-            return Response(
-                status=ResponseStatus.SUCCESS,
-                message=f"{len(metadata_df)} metadata entries has been added.",
-                data={"file_count": len(data), "metadata_ids": data},
-            )
+            return self.__bulk_insert_metadata(metadata_df)
 
         return None
 
@@ -383,7 +1007,10 @@ class Registration:
                 response.status.value,
                 response.message,
             )
-            metadata_ids.extend(response.data["metadata_ids"])
+            # Files that could not be read (e.g., of an unknown type) are
+            # skipped, so the rest of the folder is still loaded.
+            if response.status == ResponseStatus.SUCCESS:
+                metadata_ids.extend(response.data["metadata_ids"])
 
         file_count = len(metadata_ids)
         return Response(
@@ -1,24 +1,51 @@
-import gc
-import json
+import copy
+import functools
 import logging
-import math
 import os
+import socket
 import sys
-from collections import defaultdict
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable
 
 import duckdb
 import fire
 import pandas as pd
-import torch
 from tqdm import tqdm
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.batch_calibration import BatchCalibration
+from utils.batch_scheduler import get_padding_waste, pack_batches
+from utils.catalog import Catalog, quote_identifier
+from utils.chunk_packer import merge_pieces
+from utils.column_window import (
+    format_column_window,
+    get_column_window,
+    split_column_windows,
+)
+from utils.llm_cache import LLMCache
 from utils.logging_config import configure_logging
-from utils.prompting_interface import prompt_pipeline, prompt_pipeline_robust
+from utils.narration_mode import (
+    NarrationMode,
+    get_table_narration_prompt,
+    parse_table_narration,
+)
+from utils.pipeline_executor import PipelineExecutor
+from utils.prompting_interface import (
+    get_saved_generations,
+    prompt_deduplicated,
+    prompt_pipeline_prefix_cached,
+    prompt_pipeline_robust,
+    reset_saved_generations,
+)
+from utils.replica_pool import ReplicaPool
 from utils.response import Response, ResponseStatus
+from utils.row_sample import sample_rows
 from utils.storage_config import get_storage_path
+from utils.storage_manager import ConnectionRole, StorageManager
 from utils.summary_types import SummaryType
+from utils.table_leases import LeaseHeartbeat, TableLeases
 from utils.table_status import TableStatus
 
 configure_logging()
@@ -29,259 +56,819 @@ class Summarizer:
     def __init__(
         self,
         llm,
-        embed_model,        
+        embed_model,
         db_path: str = os.path.join(get_storage_path(), "storage.db"),
         max_llm_batch_size: int = 50,
+        max_batch_tokens: int = None,
+        llm_cache_size: int = 100_000,
+        narration_mode: str = "column",
+        column_context_tokens: int = 4096,
+        prefix_caching: bool = False,
+        max_tables_in_flight: int = 100,
+        distributed: bool = False,
+        lease_seconds: int = 600,
+        pipeline_queue_size: int = 1,
     ):
         self.db_path = db_path
-        self.connection = duckdb.connect(db_path)
+        self.storage_manager = StorageManager.get(db_path)
+        # Distributed workers share storage.db with workers in other processes,
+        # so they only hold it for a unit of work (see __storage_session).
+        self.DISTRIBUTED = distributed
+        if distributed:
+            self.connection = self.storage_manager.acquire_writer()
+        else:
+            self.connection = self.storage_manager.connect(ConnectionRole.WRITER)
+        self.catalog = Catalog(self.connection)
+        self.table_leases = TableLeases(self.connection)
         self.pipe = llm
+        # The prompt stage of the pipeline (see __batch_summarize_tables)
+        # tokenizes prompts while the LLM generates, and a fast tokenizer must
+        # not be used by two threads at once, so the stage has its own copy.
+        self.prompt_tokenizer = copy.deepcopy(llm.tokenizer)
+        self.llm_cache = LLMCache(
+            self.connection.cursor(),
+            llm.model.name_or_path,
+            llm_cache_size,
+        )
+        if distributed:
+            self.storage_manager.release_writer()
+        self.WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+        # Leases of claimed tables expire unless renewed within this time.
+        self.LEASE_SECONDS = lease_seconds
+        self.leased_table_ids = []
         self.embedding_model = embed_model
         self.EMBEDDING_MAX_TOKENS = 512
+        self.ROW_SAMPLE_SIZE = 5
         self.MAX_LLM_BATCH_SIZE = max_llm_batch_size
+        # The maximum number of tokens of a batch, counting padding and the
+        # tokens to be generated. Unless it is given, it is calibrated for the
+        # model and hardware once and persisted next to the database.
+        self.batch_calibration = None
+        if max_batch_tokens is None:
+            self.batch_calibration = BatchCalibration(
+                os.path.join(
+                    os.path.dirname(os.path.abspath(db_path)), "batch_calibration.json"
+                ),
+                llm,
+            )
+            max_batch_tokens = self.batch_calibration.get_max_batch_tokens()
+        self.MAX_BATCH_TOKENS = max_batch_tokens
+        self.batch_stats = {
+            "batches": 0,
+            "prompt_tokens": 0,
+            "padded_tokens": 0,
+            "seconds": 0.0,
+        }
+        self.narration_mode = NarrationMode(narration_mode)
+        self.COLUMN_NARRATION_MAX_NEW_TOKENS = 400
+        self.TABLE_NARRATION_MAX_NEW_TOKENS = 4096
+        self.TABLE_NARRATION_MAX_COLUMNS = 50
+        # Prompts list at most this many tokens of column names, so the prompts
+        # of very wide tables do not grow with the number of columns.
+        self.COLUMN_CONTEXT_TOKENS = column_context_tokens
+        # Generate the column prompts of a table from one KV cache of their
+        # common prefix instead of batching them.
+        self.PREFIX_CACHING = prefix_caching
+        # Tables are summarized and committed in windows of this many tables.
+        self.MAX_TABLES_IN_FLIGHT = max_tables_in_flight
+        # Windows buffered between two stages of the pipeline; 0 summarizes
+        # one window after another without overlapping the stages.
+        self.PIPELINE_QUEUE_SIZE = pipeline_queue_size
+        self.pipeline_stats = {}
 
     def summarize(self, table_id: str = None) -> str:
-        if table_id is None or table_id == "":
-            logger.info("Generating summaries for all unsummarized tables...")
-            table_ids = [
-                entry[0].replace("'", "''")
-                for entry in self.connection.sql(
-                    f"""SELECT id FROM table_status
-                    WHERE status = '{TableStatus.REGISTERED}'"""
-                ).fetchall()
-            ]
-            logger.info("Found %d unsummarized tables.", len(table_ids))
-        else:
-            table_ids = [table_id.replace("'", "''")]
-
-        if len(table_ids) == 0:
-            return Response(
-                status=ResponseStatus.SUCCESS,
-                message="No unsummarized tables found.\n",
-                data={"table_ids": []},
-            ).to_json()
-        if len(table_ids) == 1:
-            all_summary_ids = self.__summarize_table_by_id(table_ids[0])
-        else:
-            all_summary_ids = self.__batch_summarize_tables(table_ids)
-
+        with self.__storage_session():
+            self.llm_cache.reset_stats()
+            reset_saved_generations()
+            for key in self.batch_stats:
+                self.batch_stats[key] = 0
+            self.pipeline_stats = {}
+
+            if (table_id is None or table_id == "") and self.DISTRIBUTED:
+                logger.info("Summarizing tables as worker %s...", self.WORKER_ID)
+                table_ids, all_summary_ids = self.__summarize_claimed_tables()
+            else:
+                if table_id is None or table_id == "":
+                    # Tables claimed by distributed workers that crashed are
+                    # registered again once their leases expire.
+                    expired_table_ids = self.table_leases.release_expired()
+                    if expired_table_ids:
+                        logger.info(
+                            "Released %d tables whose leases expired.",
+                            len(expired_table_ids),
+                        )
+                    logger.info("Generating summaries for all unsummarized tables...")
+                    table_ids = self.catalog.get_table_ids(TableStatus.REGISTERED)
+                    logger.info("Found %d unsummarized tables.", len(table_ids))
+                else:
+                    table_ids = [table_id]
+
+                if len(table_ids) == 1:
+                    all_summary_ids = self.__summarize_table_by_id(table_ids[0])
+                elif len(table_ids) > 1:
+                    all_summary_ids = self.__batch_summarize_tables(table_ids)
+
+            if len(table_ids) == 0:
+                return Response(
+                    status=ResponseStatus.SUCCESS,
+                    message="No unsummarized tables found.\n",
+                    data={"table_ids": []},
+                ).to_json()
+
+            # Let query processes see the new summaries.
+            self.storage_manager.publish_snapshot()
         return Response(
             status=ResponseStatus.SUCCESS,
             message=f"Total of {len(all_summary_ids)} summaries has been added "
             f"with IDs: {', '.join([str(summary_id) for summary_id in all_summary_ids])}.\n",
-            data={"table_ids": table_ids, "summary_ids": all_summary_ids},
+            data={
+                "table_ids": table_ids,
+                "summary_ids": all_summary_ids,
+                "llm_cache": self.llm_cache.get_stats(),
+                "saved_generations": get_saved_generations(),
+                "batching": self.__get_batch_stats(),
+                "pipeline": self.pipeline_stats,
+            },
         ).to_json()
 
     def purge_tables(self) -> str:
-        summarized_table_ids = [
-            entry[0]
-            for entry in self.connection.sql(
-                f"SELECT id FROM table_status WHERE status = '{TableStatus.SUMMARIZED}'"
-            ).fetchall()
-        ]
+        with self.__storage_session():
+            # Tables registered as views take no space in the database, so they
+            # are kept queryable.
+            summarized_table_ids = self.catalog.get_table_ids(
+                TableStatus.SUMMARIZED, include_views=False
+            )
 
-        for table_id in summarized_table_ids:
-            logger.info("Dropping table with ID: %s", table_id)
-            # Escape single quotes to avoid breaking the SQL query
-            table_id = table_id.replace("'", "''")
-            self.connection.sql(f'DROP TABLE "{table_id}"')
-            self.connection.sql(
-                f"""UPDATE table_status
-                SET status = '{TableStatus.DELETED}'
-                WHERE id = '{table_id}'"""
+            for table_id in summarized_table_ids:
+                logger.info("Dropping table with ID: %s", table_id)
+                self.connection.sql(f"DROP TABLE {quote_identifier(table_id)}")
+            self.catalog.update_table_statuses(
+                summarized_table_ids, TableStatus.DELETED
             )
 
+            self.storage_manager.publish_snapshot()
         return Response(
             status=ResponseStatus.SUCCESS,
             message=f"Total of {len(summarized_table_ids)} tables have been purged.\n",
         ).to_json()
 
+    @contextmanager
+    def __storage_session(self):
+        # A unit of work of a distributed worker: storage.db is opened (waiting
+        # for other workers to release it) and closed again afterwards. Without
+        # distribution, the connections stay open for the process's lifetime.
+        if not self.DISTRIBUTED:
+            yield
+            return
+        self.__connect(self.storage_manager.acquire_writer())
+        try:
+            yield
+        finally:
+            self.storage_manager.release_writer()
+
+    def __connect(self, connection):
+        self.connection = connection
+        self.catalog = Catalog(connection)
+        self.table_leases = TableLeases(connection)
+        self.llm_cache.connection = connection.cursor()
+
+    def __summarize_claimed_tables(self) -> tuple[list[str], list[int]]:
+        # Claims windows of up to MAX_TABLES_IN_FLIGHT tables that are registered
+        # or whose lease expired, until there are none left. Other workers
+        # claim tables of the same catalog concurrently.
+        table_ids = []
+        summary_ids = []
+        while True:
+            claimed_table_ids = self.table_leases.claim(
+                self.WORKER_ID, self.MAX_TABLES_IN_FLIGHT, self.LEASE_SECONDS
+            )
+            if set(claimed_table_ids) <= set(table_ids):
+                # Nothing left, or only tables this worker could not summarize.
+                self.__release_leases(claimed_table_ids)
+                return table_ids, summary_ids
+            logger.info("Claimed %d tables.", len(claimed_table_ids))
+
+            self.leased_table_ids = claimed_table_ids
+            try:
+                summary_ids += self.__summarize_window(
+                    claimed_table_ids, self.WORKER_ID
+                )
+            except Exception:
+                # The tables are handed back right away, so other workers do
+                # not have to wait for the leases to expire.
+                self.__release_leases(claimed_table_ids)
+                raise
+            finally:
+                self.leased_table_ids = []
+            table_ids += claimed_table_ids
+
+    def __release_leases(self, table_ids: list[str]):
+        self.connection.begin()
+        try:
+            self.table_leases.release(self.WORKER_ID, table_ids, TableStatus.REGISTERED)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            logger.warning("Could not hand back %d tables.", len(table_ids))
+
     def __summarize_table_by_id(self, table_id: str) -> list[str]:
         # TODO: Handle case if table_id is invalid so status is a NoneType.
-        status = self.connection.sql(
-            f"SELECT status FROM table_status WHERE id = '{table_id}'"
-        ).fetchone()[0]
+        status = self.catalog.get_table_state(table_id)[1]
         if status == str(TableStatus.SUMMARIZED) or status == str(TableStatus.DELETED):
             logger.warning("Table with ID %s has already been summarized.", table_id)
             return []
 
-        table_df = self.connection.sql(f"SELECT * FROM '{table_id}'").to_df()
-
-        narration_summaries = self.__generate_column_description(table_df)
-        row_summaries = self.__generate_row_summaries(table_df)
-
-        summary_ids = []
-
-        for narration_summary in narration_summaries:
-            narration_payload = json.dumps({"payload": narration_summary})
-            narration_payload = narration_payload.replace("'", "''")
-            summary_ids.append(
-                self.connection.sql(
-                    f"""INSERT INTO table_summaries (table_id, summary, summary_type)
-                    VALUES ('{table_id}', '{narration_payload}', '{SummaryType.NARRATION}')
-                    RETURNING id"""
-                ).fetchone()[0]
-            )
-
-        for row_summary in row_summaries:
-            row_payload = json.dumps({"payload": row_summary})
-            row_payload = row_payload.replace("'", "''")
-            summary_ids.append(
-                self.connection.sql(
-                    f"""INSERT INTO table_summaries (table_id, summary, summary_type)
-                    VALUES ('{table_id}', '{row_payload}', '{SummaryType.ROW_SUMMARY}')
-                    RETURNING id"""
-                ).fetchone()[0]
-            )
-
-        self.connection.sql(
-            f"""UPDATE table_status
-            SET status = '{TableStatus.SUMMARIZED}'
-            WHERE id = '{table_id}'"""
+        narration_summaries = self.__generate_column_description(
+            self.__get_column_names(self.catalog, table_id)
         )
+        row_summaries = self.__generate_row_summaries(table_id)
 
-        return summary_ids
+        # The summaries and the status change are committed together, so a table
+        # is either fully summarized or still waiting to be summarized.
+        return self.__write_summaries({table_id: (narration_summaries, row_summaries)})
 
     def __batch_summarize_tables(self, table_ids: list[str]) -> list[str]:
+        statuses = self.catalog.get_table_statuses(table_ids)
+        unsummarized_table_ids = []
         for table_id in table_ids:
-            status = self.connection.sql(
-                f"SELECT status FROM table_status WHERE id = '{table_id}'"
-            ).fetchone()[0]
+            status = statuses.get(table_id)
             if status == str(TableStatus.SUMMARIZED) or status == str(
                 TableStatus.DELETED
             ):
                 logger.warning(
                     "Table with ID %s has already been summarized.", table_id
                 )
-                table_ids.remove(table_id)
+            else:
+                unsummarized_table_ids.append(table_id)
+
+        # Tables are summarized in windows of MAX_TABLES_IN_FLIGHT tables, and
+        # every window is written (and its tables marked as summarized) in one
+        # transaction as soon as its narrations are generated. A crash loses at
+        # most the windows in flight; summarizing again resumes with the tables
+        # that are still registered.
+        windows = [
+            unsummarized_table_ids[
+                window_start : window_start + self.MAX_TABLES_IN_FLIGHT
+            ]
+            for window_start in range(
+                0, len(unsummarized_table_ids), self.MAX_TABLES_IN_FLIGHT
+            )
+        ]
 
-        all_narration_summaries = self.__batch_generate_column_description(table_ids)
+        # The windows go through a pipeline of stages that overlap: while the
+        # LLM generates the narrations of one window, the next windows are read
+        # from storage.db and their prompts built and tokenized, and the windows
+        # before it are written. Every stage takes one window at a time, in
+        # order, so the windows are still generated and written in order. The
+        # read stage has a cursor of its own, since a DuckDB connection is not
+        # to be used by several threads at once.
+        reader = self.connection.cursor()
+        executor = PipelineExecutor(
+            [
+                ("read", functools.partial(self.__read_window, connection=reader)),
+                ("prompt", self.__prepare_window),
+                ("generate", self.__generate_window),
+                ("write", self.__write_window),
+            ],
+            self.PIPELINE_QUEUE_SIZE,
+        )
         summary_ids = []
-
-        for table_id, narration_summaries in all_narration_summaries.items():
-            table_df = self.connection.sql(f"SELECT * FROM '{table_id}'").to_df()
-            row_summaries = self.__generate_row_summaries(table_df)
-
-            for narration_summary in narration_summaries:
-                narration_payload = json.dumps({"payload": narration_summary})
-                narration_payload = narration_payload.replace("'", "''")
-                summary_ids.append(
-                    self.connection.sql(
-                        f"""INSERT INTO table_summaries (table_id, summary, summary_type)
-                        VALUES ('{table_id}', '{narration_payload}', '{SummaryType.NARRATION}')
-                        RETURNING id"""
-                    ).fetchone()[0]
+        summarized_table_count = 0
+        try:
+            # The executor comes first, so it finishes before zip stops.
+            for window_summary_ids, window_table_ids in zip(
+                executor.run(windows), windows
+            ):
+                summary_ids += window_summary_ids
+                summarized_table_count += len(window_table_ids)
+                logger.info(
+                    "Summarized %d of %d tables.",
+                    summarized_table_count,
+                    len(unsummarized_table_ids),
                 )
+        except Exception:
+            logger.error(
+                "Rolled back the windows in flight; %d tables have been committed.",
+                summarized_table_count,
+            )
+            raise
+        finally:
+            reader.close()
+            self.pipeline_stats = executor.get_stats()
+            self.__log_pipeline_stats()
+
+        return summary_ids
 
-            for row_summary in row_summaries:
-                row_payload = json.dumps({"payload": row_summary})
-                row_payload = row_payload.replace("'", "''")
-                summary_ids.append(
-                    self.connection.sql(
-                        f"""INSERT INTO table_summaries (table_id, summary, summary_type)
-                        VALUES ('{table_id}', '{row_payload}', '{SummaryType.ROW_SUMMARY}')
-                        RETURNING id"""
-                    ).fetchone()[0]
+    def __summarize_window(
+        self, table_ids: list[str], lease_owner: str = None
+    ) -> list[int]:
+        # The stages of the pipeline (see __batch_summarize_tables), one after
+        # another.
+        window = self.__read_window(table_ids)
+        window = self.__generate_window(self.__prepare_window(window))
+        return self.__write_window(window, lease_owner)
+
+    def __read_window(
+        self, table_ids: list[str], connection: duckdb.DuckDBPyConnection = None
+    ) -> dict:
+        # The read stage: the column names and the sampled rows of every table.
+        connection = connection or self.connection
+        catalog = Catalog(connection)
+        return {
+            "table_columns": {
+                table_id: self.__get_column_names(catalog, table_id)
+                for table_id in table_ids
+            },
+            "row_samples": {
+                table_id: sample_rows(
+                    connection, quote_identifier(table_id), self.ROW_SAMPLE_SIZE
                 )
+                for table_id in table_ids
+            },
+        }
+
+    def __prepare_window(self, window: dict) -> dict:
+        # The prompt stage: the first narration prompts, built and tokenized.
+        window["narration_prompts"] = self.__prepare_narration_prompts(
+            window["table_columns"]
+        )
+        return window
 
-            self.connection.sql(
-                f"""UPDATE table_status
-                SET status = '{TableStatus.SUMMARIZED}'
-                WHERE id = '{table_id}'"""
+    def __generate_window(self, window: dict) -> dict:
+        # The generate stage: the narrations of every column.
+        window["narrations"] = self.__generate_narrations(
+            window.pop("narration_prompts")
+        )
+        return window
+
+    def __write_window(self, window: dict, lease_owner: str = None) -> list[int]:
+        # The write stage: the narrations and rows are merged into summaries
+        # and written. Tables without any column get no summaries, but they are
+        # still marked as summarized (and their leases released).
+        table_summaries = {
+            table_id: (
+                (
+                    self.__merge_column_descriptions(narrations),
+                    self.__format_row_summaries(window["row_samples"][table_id]),
+                )
+                if narrations
+                else ([], [])
+            )
+            for table_id, narrations in window["narrations"].items()
+        }
+        return self.__write_summaries(table_summaries, lease_owner)
+
+    def __log_pipeline_stats(self):
+        for name, stats in self.pipeline_stats["stages"].items():
+            logger.info(
+                "Stage %s: %d windows, busy %.1f s (%.0f%%), idle %.1f s, "
+                "blocked %.1f s.",
+                name,
+                stats["items"],
+                stats["busy_seconds"],
+                100 * stats["utilization"],
+                stats["idle_seconds"],
+                stats["blocked_seconds"],
+            )
+        if self.pipeline_stats["bottleneck"] is not None:
+            logger.info(
+                "The %s stage is the bottleneck.", self.pipeline_stats["bottleneck"]
             )
 
+    def __write_summaries(
+        self,
+        table_summaries: dict[str, tuple[list[str], list[str]]],
+        lease_owner: str = None,
+    ) -> list[int]:
+        # Writes the narrations and row summaries of every table with one bulk
+        # insert, and marks the tables as summarized with one update, in a
+        # single transaction. The IDs are returned table by table, narrations
+        # first, as they are inserted. With a lease_owner, only the tables the
+        # worker still owns are written, checked in the same transaction; the
+        # others have been taken over by another worker, which writes them.
+        self.connection.begin()
+        try:
+            if lease_owner is not None:
+                owned_table_ids = set(
+                    self.table_leases.get_owned_table_ids(
+                        lease_owner, list(table_summaries.keys())
+                    )
+                )
+                if len(owned_table_ids) < len(table_summaries):
+                    logger.warning(
+                        "Discarding the summaries of %d tables taken over by "
+                        "other workers.",
+                        len(table_summaries) - len(owned_table_ids),
+                    )
+                table_summaries = {
+                    table_id: summaries
+                    for table_id, summaries in table_summaries.items()
+                    if table_id in owned_table_ids
+                }
+
+            payloads_df = pd.DataFrame(
+                [
+                    (table_id, summary, str(summary_type))
+                    for table_id, (narration_summaries, row_summaries) in (
+                        table_summaries.items()
+                    )
+                    for summaries, summary_type in [
+                        (narration_summaries, SummaryType.NARRATION),
+                        (row_summaries, SummaryType.ROW_SUMMARY),
+                    ]
+                    for summary in summaries
+                ],
+                columns=["table_id", "payload", "summary_type"],
+            )
+            summary_ids = self.catalog.insert_summary_payloads(payloads_df)
+            if lease_owner is None:
+                self.catalog.update_table_statuses(
+                    list(table_summaries.keys()), TableStatus.SUMMARIZED
+                )
+            else:
+                self.table_leases.release(
+                    lease_owner, list(table_summaries.keys()), TableStatus.SUMMARIZED
+                )
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
         return summary_ids
 
-    def __generate_column_description(self, df: pd.DataFrame) -> list[str]:
+    def __get_column_names(self, catalog: Catalog, table_id: str) -> list[str]:
+        # The column profiles are collected at registration time, so the table
+        # itself does not have to be read to know its columns.
+        cols = catalog.get_column_names(table_id)
+        if not cols:
+            # Tables registered before profiling was introduced have no profile;
+            # binding the query reads only the schema, not the rows.
+            cols = catalog.connection.sql(
+                f"SELECT * FROM {quote_identifier(table_id)}"
+            ).columns
+        return cols
+
+    def __generate_column_description(self, cols: list[str]) -> list[str]:
         # Used for quick local testing
-        # return " description | ".join(df.columns).strip() + " description"
+        # return " description | ".join(cols).strip() + " description"
 
-        cols = df.columns
-        conversations = []
-        for col in cols:
-            prompt = self.__get_col_description_prompt(" | ".join(cols), col)
-            conversations.append([{"role": "user", "content": prompt}])
-
-        if len(conversations) > 0:
-            outputs = prompt_pipeline(
-                self.pipe,
-                conversations,
-                batch_size=2,
-                context_length=32768,
-                max_new_tokens=400,
-                temperature=None,
-                top_p=None,
-                top_k=None,
-            )
-
-            col_narrations: list[str] = []
-            for output_idx, output in enumerate(outputs):
-                col_narrations.append(
-                    f"{cols[output_idx]}: {output[-1]['content']}".strip()
-                )
+        col_narrations = self.__narrate_columns({"": cols})[""]
 
         merged_column_descriptions = self.__merge_column_descriptions(col_narrations)
         return merged_column_descriptions
 
-    def __batch_generate_column_description(
-        self, table_ids: list[str]
+    def __narrate_columns(
+        self, table_columns: dict[str, list[str]]
     ) -> dict[str, list[str]]:
-        summaries: dict[str, list[str]] = {}
+        return self.__generate_narrations(
+            self.__prepare_narration_prompts(table_columns)
+        )
+
+    def __prepare_narration_prompts(self, table_columns: dict[str, list[str]]) -> dict:
+        # Builds the prompts __generate_narrations starts with and counts their
+        # tokens: one prompt per table (or window of its columns) with
+        # NarrationMode.TABLE, otherwise one prompt per column. Tables whose
+        # column names exceed COLUMN_CONTEXT_TOKENS are described through
+        # windows of columns.
+        column_token_counts = {
+            table_id: self.__get_column_token_counts(cols)
+            for table_id, cols in table_columns.items()
+        }
+
+        if self.narration_mode == NarrationMode.TABLE:
+            conversations = []
+            conv_tables = []
+            conv_columns = []
+            for table_id, cols in table_columns.items():
+                for start, end in split_column_windows(
+                    column_token_counts[table_id],
+                    self.COLUMN_CONTEXT_TOKENS,
+                    self.TABLE_NARRATION_MAX_COLUMNS,
+                ):
+                    prompt = get_table_narration_prompt(
+                        format_column_window(cols, start, end), cols[start:end]
+                    )
+                    conversations.append([{"role": "user", "content": prompt}])
+                    conv_tables.append(table_id)
+                    conv_columns.append(cols[start:end])
+        else:
+            conversations, conv_tables, conv_columns = self.__get_column_prompts(
+                table_columns,
+                column_token_counts,
+                {table_id: {} for table_id in table_columns},
+            )
+
+        return {
+            "table_columns": table_columns,
+            "column_token_counts": column_token_counts,
+            "conversations": conversations,
+            "conv_tables": conv_tables,
+            # The window of columns of every table prompt, or the column of
+            # every column prompt.
+            "conv_columns": conv_columns,
+            # Prompts are not batched by their length with prefix caching.
+            "token_counts": (
+                {}
+                if self.PREFIX_CACHING
+                else self.__get_prompt_token_counts(
+                    conversations, self.prompt_tokenizer
+                )
+            ),
+        }
+
+    def __generate_narrations(self, prompts: dict) -> dict[str, list[str]]:
+        # Returns the narrations ("column: description") of every table, in
+        # column order. With NarrationMode.TABLE, every table is described by a
+        # single structured prompt first; only the columns missing from its
+        # answer (e.g., because the answer is not valid JSON) are prompted one
+        # by one, as in NarrationMode.COLUMN.
+        table_columns = prompts["table_columns"]
+        descriptions: dict[str, dict[str, str]] = {
+            table_id: {} for table_id in table_columns
+        }
+
+        if self.narration_mode == NarrationMode.TABLE:
+            outputs = self.__prompt_with_cache(
+                prompts["conversations"],
+                self.TABLE_NARRATION_MAX_NEW_TOKENS,
+                prompts["token_counts"],
+            )
+            for table_id, window, output in zip(
+                prompts["conv_tables"], prompts["conv_columns"], outputs
+            ):
+                descriptions[table_id].update(
+                    parse_table_narration(output[-1]["content"], window)
+                )
+
+            conversations, conv_tables, conv_cols = self.__get_column_prompts(
+                table_columns, prompts["column_token_counts"], descriptions
+            )
+            token_counts = {}
+            if conversations:
+                logger.info(
+                    "Describing %d columns missing from the table narrations one by one.",
+                    len(conversations),
+                )
+        else:
+            conversations = prompts["conversations"]
+            conv_tables = prompts["conv_tables"]
+            conv_cols = prompts["conv_columns"]
+            token_counts = prompts["token_counts"]
+
+        outputs = self.__prompt_with_cache(
+            conversations, self.COLUMN_NARRATION_MAX_NEW_TOKENS, token_counts
+        )
+        for table_id, col, output in zip(conv_tables, conv_cols, outputs):
+            descriptions[table_id][col] = output[-1]["content"]
+
+        return {
+            table_id: [f"{col}: {descriptions[table_id][col]}".strip() for col in cols]
+            for table_id, cols in table_columns.items()
+        }
+
+    def __get_column_prompts(
+        self,
+        table_columns: dict[str, list[str]],
+        column_token_counts: dict[str, list[int]],
+        descriptions: dict[str, dict[str, str]],
+    ) -> tuple[list[list[dict[str, str]]], list[str], list[str]]:
+        # One prompt per column that has no description yet, listing the
+        # columns around it.
         conversations = []
         conv_tables = []
         conv_cols = []
-
-        for table_id in table_ids:
-            table_df = self.connection.sql(f"SELECT * FROM '{table_id}'").to_df()
-            cols = table_df.columns
-            for col in cols:
-                prompt = self.__get_col_description_prompt(" | ".join(cols), col)
-                conversations.append([{"role": "user", "content": prompt}])
-                conv_tables.append(table_id)
-                conv_cols.append(col)
-
-        optimal_batch_size = self.__get_optimal_batch_size(conversations)
-        sorted_indices = self.__get_special_indices(conversations, optimal_batch_size)
-
-        conversations = [conversations[i] for i in sorted_indices]
-        conv_tables = [conv_tables[i] for i in sorted_indices]
-        conv_cols = [conv_cols[i] for i in sorted_indices]
-
-        if len(conversations) > 0:
-            outputs = []
-            max_batch_size = optimal_batch_size
-            same_batch_size_counter = 0
-            print(f"Optimal batch size: {optimal_batch_size}")
-            for i in tqdm(range(0, len(conversations), optimal_batch_size)):
-                llm_output = prompt_pipeline_robust(
-                    self.pipe,
-                    conversations[i : i + optimal_batch_size],
-                    batch_size=optimal_batch_size,
-                    context_length=32768,
-                    max_new_tokens=400,
-                    temperature=None,
-                    top_p=None,
+        for table_id, cols in table_columns.items():
+            for col_idx, col in enumerate(cols):
+                if col not in descriptions[table_id]:
+                    start, end = get_column_window(
+                        column_token_counts[table_id],
+                        col_idx,
+                        self.COLUMN_CONTEXT_TOKENS,
+                    )
+                    prompt = self.__get_col_description_prompt(
+                        format_column_window(cols, start, end), col
+                    )
+                    conversations.append([{"role": "user", "content": prompt}])
+                    conv_tables.append(table_id)
+                    conv_cols.append(col)
+        return conversations, conv_tables, conv_cols
+
+    def __get_column_token_counts(self, cols: list[str]) -> list[int]:
+        # Each column is counted with its " | " separator.
+        return [len(self.prompt_tokenizer.tokenize(f"{col} | ")) for col in cols]
+
+    def __get_prompt_token_counts(
+        self, conversations: list[list[dict[str, str]]], tokenizer
+    ) -> dict[tuple, int]:
+        # The tokens of every prompt, keyed by its messages (see
+        # __get_prompt_key), since the LLM cache only passes the prompts that
+        # miss it on to generation.
+        return {
+            self.__get_prompt_key(conversation): len(
+                tokenizer.apply_chat_template(
+                    conversation, tokenize=True, add_generation_prompt=True
                 )
-                outputs += llm_output[0]
+            )
+            for conversation in conversations
+        }
 
-                if llm_output[1] == optimal_batch_size:
-                    same_batch_size_counter += 1
-                    if same_batch_size_counter % 10 == 0:
-                        optimal_batch_size = min(optimal_batch_size + 2, max_batch_size)
-                else:
-                    optimal_batch_size = llm_output[1]
-                    same_batch_size_counter = 0
+    def __get_prompt_key(self, conversation: list[dict[str, str]]) -> tuple:
+        return tuple((message["role"], message["content"]) for message in conversation)
 
-            col_narrations: dict[str, list[str]] = defaultdict(list)
-            for output_idx, output in enumerate(outputs):
-                col_narrations[conv_tables[output_idx]] += [
-                    f"{conv_cols[output_idx]}: {output[-1]['content']}".strip()
-                ]
+    def __prompt_with_cache(
+        self,
+        conversations: list[list[dict[str, str]]],
+        max_new_tokens: int,
+        token_counts: dict[tuple, int] = None,
+    ) -> list[list[dict[str, str]]]:
+        if len(conversations) == 0:
+            return []
+
+        # Prompts that have been answered before, e.g., because another table
+        # has the same schema, are served from the cache.
+        generation_params = {
+            "context_length": 32768,
+            "max_new_tokens": max_new_tokens,
+            "temperature": None,
+            "top_p": None,
+        }
+        # Prefix caching batches the prompts of every prefix within the same
+        # limits as __prompt_in_batches. The limits are not part of the cache
+        # key, since they do not change the outputs.
+        batch_params = {
+            "batch_size": self.MAX_LLM_BATCH_SIZE,
+            "max_batch_tokens": self.MAX_BATCH_TOKENS,
+        }
+        if self.PREFIX_CACHING and isinstance(self.pipe, ReplicaPool):
+            generate = lambda conversations: self.pipe.prompt_prefix_cached(
+                conversations, **generation_params, **batch_params
+            )
+        elif self.PREFIX_CACHING:
+            generate = lambda conversations: prompt_pipeline_prefix_cached(
+                self.pipe, conversations, **generation_params, **batch_params
+            )
+        else:
+            generate = lambda conversations: self.__prompt_in_batches(
+                conversations, generation_params, token_counts
+            )
+        # Prompts that miss the cache are deduplicated before they are split
+        # into batches (or across replicas), so that identical prompts, e.g.,
+        # of tables with the same schema, are generated once.
+        generate = functools.partial(prompt_deduplicated, generate)
+        if self.DISTRIBUTED:
+            generate = functools.partial(self.__generate_without_storage, generate)
+        return self.llm_cache.prompt(conversations, generation_params, generate)
+
+    def __generate_without_storage(
+        self,
+        generate: Callable[[list[list[dict[str, str]]]], list[list[dict[str, str]]]],
+        conversations: list[list[dict[str, str]]],
+    ) -> list[list[dict[str, str]]]:
+        # storage.db is released while the LLM generates, so other workers can
+        # claim and write tables meanwhile, and the leases of the claimed
+        # tables are renewed in the background.
+        self.storage_manager.release_writer()
+        try:
+            with LeaseHeartbeat(
+                self.storage_manager,
+                self.WORKER_ID,
+                self.leased_table_ids,
+                self.LEASE_SECONDS,
+            ):
+                return generate(conversations)
+        finally:
+            self.__connect(self.storage_manager.acquire_writer())
 
-        for key, value in col_narrations.items():
-            summaries[key] = self.__merge_column_descriptions(value)
+    def __prompt_in_batches(
+        self,
+        conversations: list[list[dict[str, str]]],
+        generation_params: dict,
+        prompt_token_counts: dict[tuple, int] = None,
+    ) -> list[list[dict[str, str]]]:
+        # Every prompt is tokenized once (usually by the prompt stage already,
+        # see __prepare_narration_prompts), and batches are packed up to
+        # MAX_BATCH_TOKENS (see pack_batches) instead of probing batch sizes
+        # with real generations.
+        max_new_tokens = generation_params["max_new_tokens"]
+        max_prompt_tokens = generation_params["context_length"] - max_new_tokens
+        prompt_token_counts = dict(prompt_token_counts or {})
+        prompt_token_counts.update(
+            self.__get_prompt_token_counts(
+                [
+                    conversation
+                    for conversation in conversations
+                    if self.__get_prompt_key(conversation) not in prompt_token_counts
+                ],
+                self.pipe.tokenizer,
+            )
+        )
+        token_counts = [
+            min(
+                prompt_token_counts[self.__get_prompt_key(conversation)],
+                max_prompt_tokens,
+            )
+            for conversation in conversations
+        ]
 
-        return summaries
+        outputs = [None] * len(conversations)
+        remaining_indices = list(range(len(conversations)))
+        start = time.time()
+        with tqdm(total=len(conversations)) as progress:
+            while remaining_indices:
+                batches = [
+                    [remaining_indices[idx] for idx in batch]
+                    for batch in pack_batches(
+                        [token_counts[idx] for idx in remaining_indices],
+                        self.MAX_BATCH_TOKENS,
+                        self.MAX_LLM_BATCH_SIZE,
+                        max_new_tokens,
+                    )
+                ]
+                logger.info(
+                    "Packed %d prompts into %d batches (%.1f%% padding).",
+                    len(remaining_indices),
+                    len(batches),
+                    100 * get_padding_waste(token_counts, batches),
+                )
+                remaining_indices = []
+                max_batch_tokens = self.MAX_BATCH_TOKENS
+
+                if isinstance(self.pipe, ReplicaPool):
+                    # All batches are queued at once and prompted by the
+                    # replicas in parallel, longest first.
+                    batch_results = self.pipe.prompt_batches(
+                        [[conversations[idx] for idx in batch] for batch in batches],
+                        on_batch_done=lambda batch_idx: progress.update(
+                            len(batches[batch_idx])
+                        ),
+                        **generation_params,
+                    )
+                else:
+                    batch_results = (
+                        prompt_pipeline_robust(
+                            self.pipe,
+                            [conversations[idx] for idx in batch],
+                            batch_size=len(batch),
+                            **generation_params,
+                        )
+                        for batch in batches
+                    )
+
+                for batch_idx, (batch, (batch_outputs, batch_size)) in enumerate(
+                    zip(batches, batch_results)
+                ):
+                    for idx, output in zip(batch, batch_outputs):
+                        outputs[idx] = output
+                    self.batch_stats["batches"] += 1
+                    self.batch_stats["prompt_tokens"] += sum(
+                        token_counts[idx] for idx in batch
+                    )
+                    self.batch_stats["padded_tokens"] += len(batch) * max(
+                        token_counts[idx] for idx in batch
+                    )
+                    if not isinstance(self.pipe, ReplicaPool):
+                        progress.update(len(batch))
+
+                    reduced_max_batch_tokens = max(
+                        max_batch_tokens * batch_size // len(batch), 1
+                    )
+                    if reduced_max_batch_tokens < self.MAX_BATCH_TOKENS:
+                        # prompt_pipeline_robust ran out of memory and had to
+                        # split the batch, so the budget is shrunk by the same
+                        # factor and the remaining prompts are packed again.
+                        # Replicas report their batches together, so the
+                        # budget is only lowered once for the same factor.
+                        self.MAX_BATCH_TOKENS = reduced_max_batch_tokens
+                        logger.warning(
+                            "Reducing the token budget of a batch to %d.",
+                            self.MAX_BATCH_TOKENS,
+                        )
+                        if self.batch_calibration is not None:
+                            self.batch_calibration.record_oom(self.MAX_BATCH_TOKENS)
+                        if isinstance(self.pipe, ReplicaPool):
+                            # The replicas have prompted every batch already.
+                            continue
+                        remaining_indices = [
+                            idx
+                            for remaining_batch in batches[batch_idx + 1 :]
+                            for idx in remaining_batch
+                        ]
+                        break
+        self.batch_stats["seconds"] += time.time() - start
+        return outputs
+
+    def __get_batch_stats(self) -> dict[str, float]:
+        stats = self.batch_stats
+        return {
+            "batches": stats["batches"],
+            "padding_waste": (
+                1 - stats["prompt_tokens"] / stats["padded_tokens"]
+                if stats["padded_tokens"]
+                else 0.0
+            ),
+            "batches_per_second": (
+                stats["batches"] / stats["seconds"] if stats["seconds"] else 0.0
+            ),
+        }
 
     def __get_col_description_prompt(self, columns: str, column: str):
         return f"""A table has the following columns:
@@ -290,100 +877,24 @@ class Summarizer:
 */
 Describe briefly what the {column} column represents. If not possible, simply state "No description.\""""
 
-    def __get_optimal_batch_size(self, conversations: list[dict[str, str]]):
-        max_batch_size = self.MAX_LLM_BATCH_SIZE
-        min_batch_size = 1
-        while min_batch_size < max_batch_size:
-            mid_batch_size = (min_batch_size + max_batch_size) // 2
-            if self.__is_fit_in_memory(conversations, mid_batch_size):
-                min_batch_size = mid_batch_size + 1
-            else:
-                max_batch_size = mid_batch_size - 1
-        optimal_batch_size = min_batch_size
-        return optimal_batch_size
-
-    def __is_fit_in_memory(self, conversations: list[dict[str, str]], batch_size: int):
-        special_indices = self.__get_special_indices(conversations, batch_size)
-        adjusted_conversations = [conversations[i] for i in special_indices]
-
-        conv_low_idx = len(adjusted_conversations) // 2 - batch_size // 2
-        conv_high_dx = conv_low_idx + batch_size
-        output = prompt_pipeline(
-            self.pipe,
-            adjusted_conversations[conv_low_idx:conv_high_dx],
-            batch_size=batch_size,
-            context_length=32768,
-            max_new_tokens=1,
-            temperature=None,
-            top_p=None,
-            top_k=None,
+    def __merge_column_descriptions(self, column_narrations: list[str]) -> list[str]:
+        return merge_pieces(
+            self.embedding_model.tokenizer,
+            column_narrations,
+            " || ",
+            self.EMBEDDING_MAX_TOKENS,
         )
 
-        torch.cuda.empty_cache()
-        gc.collect()
-
-        if output[0][0]["content"] == "":
-            del output
-            return False
-        else:
-            del output
-            return True
-
-    def __get_special_indices(self, texts: list[str], batch_size: int):
-        # Step 1: Sort the conversations (indices) in decreasing order
-        sorted_indices = sorted(
-            range(len(texts)), key=lambda x: len(texts[x]), reverse=True
+    def __generate_row_summaries(self, table_id: str) -> list[str]:
+        # Only the sampled rows are read into pandas, so memory does not depend
+        # on the size of the table.
+        return self.__format_row_summaries(
+            sample_rows(
+                self.connection, quote_identifier(table_id), self.ROW_SAMPLE_SIZE
+            )
         )
 
-        # Step 2: Interleave the indices (longest, shortest, second longest, second shortest, ...)
-        final_indices = []
-        i, j = 0, len(sorted_indices) - 1
-
-        while i <= j:
-            if i == j:
-                final_indices.append(sorted_indices[i])
-                break
-
-            final_indices.append(sorted_indices[i])
-            i += 1
-
-            for _ in range(batch_size - 1):
-                if i <= j:
-                    final_indices.append(sorted_indices[j])
-                    j -= 1
-                else:
-                    break
-        return final_indices
-
-    def __merge_column_descriptions(self, column_narrations: list[str]) -> list[str]:
-        tokenizer = self.embedding_model.tokenizer
-        merged_column_descriptions = []
-
-        col_idx = 0
-        while col_idx < len(column_narrations):
-            current_description = column_narrations[col_idx]
-            while col_idx + 1 < len(column_narrations):
-                combined_description = (
-                    current_description + " || " + column_narrations[col_idx + 1]
-                )
-                if (
-                    len(tokenizer.encode(combined_description))
-                    < self.EMBEDDING_MAX_TOKENS
-                ):
-                    current_description = combined_description
-                    col_idx += 1
-                else:
-                    break
-
-            col_idx += 1
-            merged_column_descriptions.append(current_description)
-
-        return merged_column_descriptions
-
-    def __generate_row_summaries(self, df: pd.DataFrame) -> list[str]:
-        sample_size = math.ceil(min(len(df), 5))
-        selected_df = df.sample(n=sample_size, random_state=0).reset_index(drop=True)
-
+    def __format_row_summaries(self, selected_df: pd.DataFrame) -> list[str]:
         row_summaries = []
         for row_idx, row in selected_df.iterrows():
             formatted_row = " | ".join([f"{col}: {val}" for col, val in row.items()])
@@ -393,24 +904,12 @@ Describe briefly what the {column} column represents. If not possible, simply st
         return merged_row_summaries
 
     def __merge_row_summaries(self, row_summaries: list[str]) -> list[str]:
-        tokenizer = self.embedding_model.tokenizer
-        merged_row_summaries = []
-
-        row_idx = 0
-        while row_idx < len(row_summaries):
-            current_summary = row_summaries[row_idx]
-            while row_idx + 1 < len(row_summaries):
-                combined_summary = current_summary + " || " + row_summaries[row_idx + 1]
-                if len(tokenizer.encode(combined_summary)) < self.EMBEDDING_MAX_TOKENS:
-                    current_summary = combined_summary
-                    row_idx += 1
-                else:
-                    break
-
-            row_idx += 1
-            merged_row_summaries.append(current_summary)
-
-        return merged_row_summaries
+        return merge_pieces(
+            self.embedding_model.tokenizer,
+            row_summaries,
+            " || ",
+            self.EMBEDDING_MAX_TOKENS,
+        )
 
 
 if __name__ == "__main__":
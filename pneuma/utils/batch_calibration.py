@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+
+import torch
+
+logger = logging.getLogger("BatchCalibration")
+
+
+class BatchCalibration:
+    """
+    Persisted token budgets of LLM batches, one per model and hardware
+
+    The budget of a (model path, dtype, device, context length) is calibrated
+    once, from the free memory of the device and the size of the model's KV
+    cache per token, and stored in a JSON file next to storage.db. Later runs
+    reuse it. Every out-of-memory error lowers the stored budget; after
+    MAX_OOM_COUNT of them the budget is considered stale and calibrated again.
+    """
+
+    MAX_OOM_COUNT = 3
+    # Share of the free memory given to the KV cache; the rest is left for
+    # activations and fragmentation.
+    MEMORY_FRACTION = 0.5
+
+    def __init__(self, path: str, pipe, default_max_batch_tokens: int = 65_536):
+        self.path = path
+        self.pipe = pipe
+        self.default_max_batch_tokens = default_max_batch_tokens
+        self.key = self.__get_key()
+
+    def get_max_batch_tokens(self) -> int:
+        """
+        Get the calibrated token budget, calibrating it first if necessary
+
+        ### Returns:
+        - max_batch_tokens (int): The maximum number of tokens of a batch
+        """
+        entries = self.__read_entries()
+        entry = entries.get(self.key)
+        if entry is not None and entry["oom_count"] < self.MAX_OOM_COUNT:
+            return entry["max_batch_tokens"]
+
+        max_batch_tokens = self.__calibrate()
+        logger.info("Calibrated a token budget of %d per batch.", max_batch_tokens)
+        entries[self.key] = {"max_batch_tokens": max_batch_tokens, "oom_count": 0}
+        self.__write_entries(entries)
+        return max_batch_tokens
+
+    def record_oom(self, max_batch_tokens: int):
+        """
+        Store the token budget that was lowered after an out-of-memory error
+
+        ### Parameters:
+        - max_batch_tokens (int): The lowered maximum number of tokens of a batch
+        """
+        entries = self.__read_entries()
+        oom_count = entries.get(self.key, {}).get("oom_count", 0) + 1
+        entries[self.key] = {
+            "max_batch_tokens": max_batch_tokens,
+            "oom_count": oom_count,
+        }
+        self.__write_entries(entries)
+
+    def __get_key(self) -> str:
+        model = self.pipe.model
+        device = str(model.device)
+        if model.device.type == "cuda":
+            # The device index alone does not tell GPUs apart, so the name and
+            # total memory of the GPU are part of the key.
+            properties = torch.cuda.get_device_properties(model.device)
+            device += f" {properties.name} {properties.total_memory}"
+        return " | ".join(
+            [
+                model.name_or_path,
+                str(model.dtype),
+                device,
+                str(self.pipe.tokenizer.model_max_length),
+            ]
+        )
+
+    def __calibrate(self) -> int:
+        model = self.pipe.model
+        if model.device.type != "cuda":
+            return self.default_max_batch_tokens
+
+        config = model.config
+        head_dim = getattr(
+            config, "head_dim", config.hidden_size // config.num_attention_heads
+        )
+        num_key_value_heads = getattr(
+            config, "num_key_value_heads", config.num_attention_heads
+        )
+        # Keys and values of every layer, for every key-value head.
+        kv_bytes_per_token = (
+            2
+            * config.num_hidden_layers
+            * num_key_value_heads
+            * head_dim
+            * torch.tensor([], dtype=model.dtype).element_size()
+        )
+        free_memory, _ = torch.cuda.mem_get_info(model.device)
+        return max(int(free_memory * self.MEMORY_FRACTION / kv_bytes_per_token), 1)
+
+    def __read_entries(self) -> dict[str, dict[str, int]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except json.JSONDecodeError:
+            logger.warning("Ignoring the unreadable calibration file %s.", self.path)
+            return {}
+
+    def __write_entries(self, entries: dict[str, dict[str, int]]):
+        # Written to a temporary file first, so an interrupted run does not
+        # leave a truncated file behind.
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(entries, file, indent=4)
+        os.replace(temporary_path, self.path)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from types import SimpleNamespace
+
+    pipe = SimpleNamespace(
+        model=SimpleNamespace(
+            name_or_path="some/model",
+            dtype=torch.float32,
+            device=torch.device("cpu"),
+        ),
+        tokenizer=SimpleNamespace(model_max_length=8192),
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "batch_calibration.json")
+        calibration = BatchCalibration(path, pipe, default_max_batch_tokens=1000)
+        assert calibration.get_max_batch_tokens() == 1000
+
+        calibration.record_oom(500)
+        assert BatchCalibration(path, pipe).get_max_batch_tokens() == 500
+
+        for _ in range(BatchCalibration.MAX_OOM_COUNT - 1):
+            calibration.record_oom(100)
+        assert calibration.get_max_batch_tokens() == 1000
+
+        pipe.tokenizer.model_max_length = 32768
+        assert BatchCalibration(path, pipe, 2000).get_max_batch_tokens() == 2000
+        with open(path) as file:
+            assert len(json.load(file)) == 2
@@ -0,0 +1,77 @@
+def pack_batches(
+    token_counts: list[int],
+    max_batch_tokens: int,
+    max_batch_size: int,
+    max_new_tokens: int,
+) -> list[list[int]]:
+    """
+    Pack prompts into batches that fit in a token budget
+
+    Prompts are sorted by length, longest first, so every batch holds prompts
+    of similar lengths and little of it is padding; the longest (and most
+    memory-hungry) batches also run first. A batch of n prompts whose longest
+    prompt has L tokens costs n * (L + max_new_tokens) tokens, since every
+    sequence is padded to L and may grow by max_new_tokens.
+
+    ### Parameters:
+    - token_counts (list[int]): The number of tokens of every prompt
+    - max_batch_tokens (int): The maximum cost of a batch in tokens
+    - max_batch_size (int): The maximum number of prompts in a batch
+    - max_new_tokens (int): Max number of tokens generated for each prompt
+
+    ### Returns:
+    - batches (list[list[int]]): The indices of the prompts of every batch; a
+      prompt that exceeds the budget on its own is put in a batch by itself
+    """
+    sorted_indices = sorted(
+        range(len(token_counts)), key=lambda idx: token_counts[idx], reverse=True
+    )
+
+    batches: list[list[int]] = []
+    for idx in sorted_indices:
+        if batches:
+            batch = batches[-1]
+            # The first prompt of a batch is its longest one.
+            sequence_tokens = token_counts[batch[0]] + max_new_tokens
+            if (
+                len(batch) < max_batch_size
+                and (len(batch) + 1) * sequence_tokens <= max_batch_tokens
+            ):
+                batch.append(idx)
+                continue
+        batches.append([idx])
+    return batches
+
+
+def get_padding_waste(token_counts: list[int], batches: list[list[int]]) -> float:
+    """
+    Get the fraction of the prompt tokens of batches that are padding
+
+    ### Parameters:
+    - token_counts (list[int]): The number of tokens of every prompt
+    - batches (list[list[int]]): The indices of the prompts of every batch
+
+    ### Returns:
+    - padding_waste (float): The number of padding tokens divided by the number
+      of padded prompt tokens
+    """
+    padded_tokens = sum(
+        len(batch) * max(token_counts[idx] for idx in batch) for batch in batches
+    )
+    if padded_tokens == 0:
+        return 0.0
+    prompt_tokens = sum(token_counts[idx] for batch in batches for idx in batch)
+    return 1 - prompt_tokens / padded_tokens
+
+
+if __name__ == "__main__":
+    token_counts = [10, 100, 12, 98, 11, 500]
+    batches = pack_batches(
+        token_counts, max_batch_tokens=400, max_batch_size=2, max_new_tokens=100
+    )
+    assert batches == [[5], [1, 3], [2, 4], [0]]
+    assert sorted(idx for batch in batches for idx in batch) == list(range(6))
+    assert round(get_padding_waste(token_counts, batches), 3) == round(1 - 731 / 734, 3)
+
+    assert pack_batches([5] * 10, 100, 50, 5) == [list(range(10))]
+    assert get_padding_waste([], []) == 0.0
@@ -0,0 +1,265 @@
+import duckdb
+import pandas as pd
+
+from .summary_types import SummaryType
+from .table_status import TableStatus
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Quote a table or column name so it can be used in a statement
+
+    ### Parameters:
+    - name (str): The unescaped name, e.g., a table ID
+
+    ### Returns:
+    - identifier (str): The name in double quotes, with double quotes escaped
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Catalog:
+    """
+    Parameterized statements over the catalog tables of storage.db
+
+    Every value is bound as a parameter instead of being formatted into the
+    statement, so table IDs are passed unescaped (as stored in table_status) and
+    DuckDB can reuse the prepared statement. Methods that write many rows either
+    use executemany, which prepares the statement once, or insert a DataFrame in
+    one set-based statement.
+    """
+
+    def __init__(self, connection: duckdb.DuckDBPyConnection):
+        self.connection = connection
+
+    def execute(self, statement: str, parameters: list = None):
+        return self.connection.execute(statement, parameters or [])
+
+    def executemany(self, statement: str, parameter_rows: list[list]):
+        # DuckDB rejects executemany without any parameter set.
+        if parameter_rows:
+            self.connection.executemany(statement, parameter_rows)
+
+    def insert_dataframe(self, table: str, records_df: pd.DataFrame):
+        # Bulk variant: the DataFrame columns name the target columns.
+        columns = ", ".join(quote_identifier(column) for column in records_df.columns)
+        self.connection.execute(
+            f"INSERT INTO {quote_identifier(table)} ({columns}) SELECT * FROM records_df"
+        )
+
+    def next_ids(self, count: int) -> list[int]:
+        # IDs are drawn up front, in order, so rows inserted in bulk can still be
+        # mapped back to their IDs. DuckDB treats a prepared SELECT as read-only,
+        # which nextval is not, so this statement is not parameterized.
+        return [
+            entry[0]
+            for entry in self.connection.sql(
+                f"SELECT nextval('id_seq') FROM range({int(count)}) ORDER BY 1"
+            ).fetchall()
+        ]
+
+    def get_table_ids(
+        self, status: TableStatus = None, include_views: bool = True
+    ) -> list[str]:
+        statement = "SELECT id FROM table_status WHERE (? IS NULL OR status = ?)"
+        if not include_views:
+            statement += " AND id NOT IN (SELECT view_name FROM duckdb_views())"
+        status = None if status is None else str(status)
+        return [
+            entry[0] for entry in self.execute(statement, [status, status]).fetchall()
+        ]
+
+    def get_table_state(self, table_id: str) -> tuple[str, str]:
+        return self.execute(
+            "SELECT hash, status FROM table_status WHERE id = ?", [table_id]
+        ).fetchone()
+
+    def get_table_id_by_hash(self, table_hash: str) -> str:
+        entry = self.execute(
+            "SELECT id FROM table_status WHERE hash = ?", [table_hash]
+        ).fetchone()
+        return None if entry is None else entry[0]
+
+    def update_table_status(
+        self, table_id: str, status: TableStatus, table_hash: str = None
+    ):
+        self.execute(
+            """UPDATE table_status
+            SET status = ?, hash = coalesce(?, hash)
+            WHERE id = ?""",
+            [str(status), table_hash, table_id],
+        )
+
+    def get_table_statuses(self, table_ids: list[str]) -> dict[str, str]:
+        return dict(
+            self.execute(
+                """SELECT id, status FROM table_status
+                WHERE id IN (SELECT unnest(?::VARCHAR[]))""",
+                [table_ids],
+            ).fetchall()
+        )
+
+    def update_table_statuses(self, table_ids: list[str], status: TableStatus):
+        # One set-based statement, however many tables there are.
+        self.execute(
+            """UPDATE table_status SET status = ?
+            WHERE id IN (SELECT unnest(?::VARCHAR[]))""",
+            [str(status), table_ids],
+        )
+
+    def get_manifest_entries(self, path: str = None) -> list[tuple]:
+        return self.execute(
+            """SELECT path, table_id, size, mtime_ns FROM table_manifest
+            WHERE ? IS NULL OR path = ?""",
+            [path, path],
+        ).fetchall()
+
+    def upsert_manifest_entries(self, manifest_df: pd.DataFrame):
+        self.connection.execute(
+            """INSERT OR REPLACE INTO table_manifest
+            (path, table_id, size, mtime_ns, hash, time_updated)
+            SELECT *, CURRENT_TIMESTAMP FROM manifest_df"""
+        )
+
+    def get_column_names(self, table_id: str) -> list[str]:
+        return [
+            entry[0]
+            for entry in self.execute(
+                """SELECT column_name FROM column_profiles
+                WHERE table_id = ?
+                ORDER BY column_idx""",
+                [table_id],
+            ).fetchall()
+        ]
+
+    def delete_column_profiles(self, table_id: str):
+        self.execute("DELETE FROM column_profiles WHERE table_id = ?", [table_id])
+
+    def insert_context(self, table_id: str, context: str) -> int:
+        return self.execute(
+            """INSERT INTO table_contexts (table_id, context)
+            VALUES (?, ?)
+            RETURNING id""",
+            [table_id, context],
+        ).fetchone()[0]
+
+    def insert_summaries(
+        self, table_id: str, summaries: list[str], summary_type: SummaryType
+    ) -> list[int]:
+        summary_ids = self.next_ids(len(summaries))
+        self.executemany(
+            """INSERT INTO table_summaries (id, table_id, summary, summary_type)
+            VALUES (?, ?, ?, ?)""",
+            [
+                [summary_id, table_id, summary, str(summary_type)]
+                for summary_id, summary in zip(summary_ids, summaries)
+            ],
+        )
+        return summary_ids
+
+    def insert_summary_payloads(self, payloads_df: pd.DataFrame) -> list[int]:
+        # Bulk variant of insert_summaries for the summaries of many tables:
+        # payloads_df has the columns table_id, payload, and summary_type, and
+        # DuckDB wraps every payload into its {"payload": ...} JSON document.
+        summary_ids = self.next_ids(len(payloads_df))
+        summaries_df = payloads_df.assign(id=summary_ids)
+        self.connection.execute(
+            """INSERT INTO table_summaries (id, table_id, summary, summary_type)
+            SELECT id, table_id, json_object('payload', payload), summary_type
+            FROM summaries_df"""
+        )
+        return summary_ids
+
+    def delete_summaries(self, table_id: str, summary_types: list[SummaryType]):
+        self.execute(
+            """DELETE FROM table_summaries
+            WHERE table_id = ? AND list_contains(?, summary_type)""",
+            [table_id, [str(summary_type) for summary_type in summary_types]],
+        )
+
+    def get_contexts(self, table_id: str) -> list[tuple[int, str]]:
+        return self.execute(
+            "SELECT id, context FROM table_contexts WHERE table_id = ?", [table_id]
+        ).fetchall()
+
+    def get_summaries(
+        self, table_id: str, summary_type: SummaryType
+    ) -> list[tuple[int, str]]:
+        return self.execute(
+            """SELECT id, summary FROM table_summaries
+            WHERE table_id = ? AND summary_type = ?""",
+            [table_id, str(summary_type)],
+        ).fetchall()
+
+    def insert_index(self, name: str, location: str) -> int:
+        return self.execute(
+            "INSERT INTO indexes (name, location) VALUES (?, ?) RETURNING id",
+            [name, location],
+        ).fetchone()[0]
+
+    def get_index_name(self, index_id: int) -> str:
+        return self.execute(
+            "SELECT name FROM indexes WHERE id = ?", [index_id]
+        ).fetchone()[0]
+
+
+if __name__ == "__main__":
+    connection = duckdb.connect()
+    connection.sql("CREATE SEQUENCE id_seq START 1")
+    connection.sql(
+        """CREATE TABLE table_status (
+            id VARCHAR PRIMARY KEY, status VARCHAR NOT NULL, hash VARCHAR NOT NULL
+        )"""
+    )
+    connection.sql(
+        """CREATE TABLE table_summaries (
+            id INTEGER DEFAULT nextval('id_seq') PRIMARY KEY,
+            table_id VARCHAR NOT NULL REFERENCES table_status(id),
+            summary JSON NOT NULL,
+            summary_type VARCHAR NOT NULL
+        )"""
+    )
+    catalog = Catalog(connection)
+    catalog.insert_dataframe(
+        "table_status",
+        pd.DataFrame(
+            {
+                "id": ["it's.csv", 'a "b".csv'],
+                "status": str(TableStatus.REGISTERED),
+                "hash": ["h1", "h2"],
+            }
+        ),
+    )
+    summary_ids = catalog.insert_summaries(
+        "it's.csv", ['{"payload": "x"}', '{"payload": "y"}'], SummaryType.NARRATION
+    )
+    assert summary_ids == [1, 2]
+    assert [
+        entry[0] for entry in catalog.get_summaries("it's.csv", SummaryType.NARRATION)
+    ] == summary_ids
+
+    payloads_df = pd.DataFrame(
+        {
+            "table_id": ["it's.csv", 'a "b".csv'],
+            "payload": ['say "hi"', "x"],
+            "summary_type": str(SummaryType.ROW_SUMMARY),
+        }
+    )
+    assert catalog.insert_summary_payloads(payloads_df) == [3, 4]
+    assert catalog.get_summaries('a "b".csv', SummaryType.ROW_SUMMARY) == [
+        (4, '{"payload":"x"}')
+    ]
+    assert catalog.insert_summary_payloads(payloads_df.iloc[:0]) == []
+
+    catalog.update_table_statuses(["it's.csv"], TableStatus.SUMMARIZED)
+    assert catalog.get_table_statuses(["it's.csv", "missing.csv"]) == {
+        "it's.csv": str(TableStatus.SUMMARIZED)
+    }
+    assert catalog.get_table_ids(TableStatus.REGISTERED) == ['a "b".csv']
+    assert catalog.get_table_id_by_hash("h1") == "it's.csv"
+
+    catalog.delete_summaries(
+        "it's.csv", [SummaryType.NARRATION, SummaryType.ROW_SUMMARY]
+    )
+    assert catalog.get_summaries("it's.csv", SummaryType.NARRATION) == []
+    assert quote_identifier('a "b".csv') == '"a ""b"".csv"'
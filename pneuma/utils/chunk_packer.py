@@ -0,0 +1,134 @@
+from transformers.tokenization_utils_base import PreTrainedTokenizerBase
+
+# Pre-tokenizers that split on whitespace before anything else. With them, the
+# tokens of a + " | " + b are the tokens of a, of " | ", and of b, so the token
+# count of a chunk is the sum of the counts of its pieces and separators.
+WHITESPACE_PRE_TOKENIZERS = {"BertPreTokenizer", "Whitespace", "WhitespaceSplit"}
+
+
+def is_token_count_additive(tokenizer: PreTrainedTokenizerBase) -> bool:
+    """
+    Check whether a tokenizer tokenizes whitespace-separated pieces independently
+
+    ### Parameters:
+    - tokenizer (PreTrainedTokenizerBase): A tokenizer from HuggingFace
+
+    ### Returns:
+    - is_additive (bool): Whether token counts can be summed across pieces
+    """
+    backend_tokenizer = getattr(tokenizer, "backend_tokenizer", None)
+    if backend_tokenizer is None or backend_tokenizer.pre_tokenizer is None:
+        return False
+    return type(backend_tokenizer.pre_tokenizer).__name__ in WHITESPACE_PRE_TOKENIZERS
+
+
+def pack_chunks(
+    tokenizer: PreTrainedTokenizerBase,
+    pieces: list[str],
+    separator: str,
+    max_tokens: int,
+) -> list[list[int]]:
+    """
+    Pack consecutive pieces into chunks of fewer than max_tokens tokens
+
+    Pieces are appended greedily to the current chunk, separated by separator,
+    for as long as the encoded chunk (including special tokens) stays below
+    max_tokens; a piece that exceeds max_tokens on its own forms its own chunk.
+    With a fast tokenizer that splits on whitespace (see
+    is_token_count_additive), all pieces are tokenized once in a batch and the
+    chunk sizes are summed; otherwise every candidate chunk is encoded, as
+    before. Both give the same chunks. The separator must start and end with
+    whitespace, e.g., " | ".
+
+    ### Parameters:
+    - tokenizer (PreTrainedTokenizerBase): The tokenizer of the embedding model
+    - pieces (list[str]): The pieces to be packed, in order
+    - separator (str): The string put between the pieces of a chunk
+    - max_tokens (int): The exclusive upper bound of the tokens of a chunk
+
+    ### Returns:
+    - chunks (list[list[int]]): The indices of the pieces of every chunk
+    """
+    if not pieces:
+        return []
+
+    if not is_token_count_additive(tokenizer):
+        chunks = [[0]]
+        current_chunk = pieces[0]
+        for piece_idx in range(1, len(pieces)):
+            combined_chunk = current_chunk + separator + pieces[piece_idx]
+            if len(tokenizer.encode(combined_chunk)) < max_tokens:
+                current_chunk = combined_chunk
+                chunks[-1].append(piece_idx)
+            else:
+                current_chunk = pieces[piece_idx]
+                chunks.append([piece_idx])
+        return chunks
+
+    special_token_count = len(tokenizer.encode(""))
+    separator_token_count = len(tokenizer.encode(separator, add_special_tokens=False))
+    piece_token_counts = [
+        len(input_ids)
+        for input_ids in tokenizer(pieces, add_special_tokens=False)["input_ids"]
+    ]
+
+    chunks = [[0]]
+    current_token_count = special_token_count + piece_token_counts[0]
+    for piece_idx in range(1, len(pieces)):
+        combined_token_count = (
+            current_token_count + separator_token_count + piece_token_counts[piece_idx]
+        )
+        if combined_token_count < max_tokens:
+            current_token_count = combined_token_count
+            chunks[-1].append(piece_idx)
+        else:
+            current_token_count = special_token_count + piece_token_counts[piece_idx]
+            chunks.append([piece_idx])
+    return chunks
+
+
+def merge_pieces(
+    tokenizer: PreTrainedTokenizerBase,
+    pieces: list[str],
+    separator: str,
+    max_tokens: int,
+) -> list[str]:
+    """
+    Merge consecutive pieces into strings of fewer than max_tokens tokens
+
+    ### Parameters:
+    - tokenizer (PreTrainedTokenizerBase): The tokenizer of the embedding model
+    - pieces (list[str]): The pieces to be merged, in order
+    - separator (str): The string put between merged pieces
+    - max_tokens (int): The exclusive upper bound of the tokens of a merged string
+
+    ### Returns:
+    - merged_pieces (list[str]): The merged strings (see pack_chunks)
+    """
+    return [
+        separator.join(pieces[piece_idx] for piece_idx in chunk)
+        for chunk in pack_chunks(tokenizer, pieces, separator, max_tokens)
+    ]
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained("BAAI/bge-base-en-v1.5")
+    assert is_token_count_additive(tokenizer)
+    pieces = [
+        f"column_{idx}: The {idx}-th column, e.g., 'a|b' or São Paulo." * (idx % 7)
+        for idx in range(200)
+    ]
+    for separator in [" | ", " || "]:
+        reference_chunks = [[0]]
+        current_chunk = pieces[0]
+        for piece_idx in range(1, len(pieces)):
+            combined_chunk = current_chunk + separator + pieces[piece_idx]
+            if len(tokenizer.encode(combined_chunk)) < 64:
+                current_chunk = combined_chunk
+                reference_chunks[-1].append(piece_idx)
+            else:
+                current_chunk = pieces[piece_idx]
+                reference_chunks.append([piece_idx])
+        assert pack_chunks(tokenizer, pieces, separator, 64) == reference_chunks
@@ -0,0 +1,108 @@
+import json
+
+import duckdb
+
+from .table_fingerprint import compute_table_fingerprint
+
+
+# Columns profiled per SELECT. DuckDB 1.1 crashes the process (SIGFPE) on a
+# SELECT with about 6,000 aggregates, i.e., a table of about 1,200 columns.
+MAX_PROFILED_COLUMNS = 200
+
+
+def compute_column_profiles(
+    connection: duckdb.DuckDBPyConnection, relation: str, top_k: int = 5
+) -> tuple[str, list[dict]]:
+    """
+    Profile every column of a relation and fingerprint it
+
+    The fingerprint is computed by compute_table_fingerprint, and the columns
+    are profiled in chunks of MAX_PROFILED_COLUMNS columns, each with the
+    aggregates of one SELECT, so a relation is scanned once per chunk. Distinct
+    counts and top-k values are approximate (HyperLogLog and Filtered
+    Space-Saving), which keeps the memory of a pass bounded.
+
+    ### Parameters:
+    - connection (DuckDBPyConnection): A connection (or cursor) to DuckDB
+    - relation (str): A FROM-clause expression, e.g., a quoted table name
+    - top_k (int): The number of most frequent values to keep per column
+
+    ### Returns:
+    - fingerprint (str): The fingerprint of the relation, as computed by
+      compute_table_fingerprint
+    - profiles (list[dict]): One profile per column, in column order
+    """
+    schema = connection.sql(f"SELECT * FROM {relation}")
+    columns = schema.columns
+    column_types = [str(column_type) for column_type in schema.types]
+    fingerprint = compute_table_fingerprint(connection, relation)
+
+    profiles = []
+    for chunk_start in range(0, len(columns), MAX_PROFILED_COLUMNS):
+        chunk_columns = columns[chunk_start : chunk_start + MAX_PROFILED_COLUMNS]
+        aggregates = ["count(*)"]
+        for column in chunk_columns:
+            quoted_column = '"' + column.replace('"', '""') + '"'
+            aggregates += [
+                f"count({quoted_column})",
+                f"approx_count_distinct({quoted_column})",
+                f"min({quoted_column})::VARCHAR",
+                f"max({quoted_column})::VARCHAR",
+                f"approx_top_k({quoted_column}, {top_k})::VARCHAR[]",
+            ]
+        result = connection.sql(
+            f"SELECT {', '.join(aggregates)} FROM {relation}"
+        ).fetchone()
+
+        row_count = result[0]
+        for chunk_idx, column in enumerate(chunk_columns):
+            non_null_count, approx_distinct, min_value, max_value, top_values = result[
+                1 + chunk_idx * 5 : 1 + (chunk_idx + 1) * 5
+            ]
+            column_idx = chunk_start + chunk_idx
+            profiles.append(
+                {
+                    "column_idx": column_idx,
+                    "column_name": column,
+                    "column_type": column_types[column_idx],
+                    "row_count": row_count,
+                    "null_fraction": (
+                        (row_count - non_null_count) / row_count if row_count else 0.0
+                    ),
+                    "approx_distinct": approx_distinct,
+                    "min_value": min_value,
+                    "max_value": max_value,
+                    "top_values": json.dumps(top_values),
+                }
+            )
+    return fingerprint, profiles
+
+
+if __name__ == "__main__":
+    connection = duckdb.connect()
+    connection.sql(
+        """CREATE TABLE t AS
+        SELECT range AS "id", CASE WHEN range % 4 = 0 THEN NULL ELSE range % 3 END AS "my col"
+        FROM range(1000)"""
+    )
+    fingerprint, profiles = compute_column_profiles(connection, "t", top_k=2)
+
+    assert fingerprint == compute_table_fingerprint(connection, "t")
+    assert [profile["column_name"] for profile in profiles] == ["id", "my col"]
+    assert profiles[0]["null_fraction"] == 0.0
+    assert profiles[1]["null_fraction"] == 0.25
+    assert profiles[0]["min_value"] == "0" and profiles[0]["max_value"] == "999"
+    assert len(json.loads(profiles[1]["top_values"])) == 2
+
+    # Tables wider than one chunk, up to widths that crash a single SELECT.
+    columns = ", ".join(
+        f"CASE WHEN range % 2 = 0 THEN NULL ELSE range + {idx} END AS c{idx}"
+        for idx in range(1600)
+    )
+    connection.sql(f"CREATE TABLE wide AS SELECT {columns} FROM range(10)")
+    fingerprint, profiles = compute_column_profiles(connection, "wide")
+    assert fingerprint == compute_table_fingerprint(connection, "wide")
+    assert [profile["column_idx"] for profile in profiles] == list(range(1600))
+    assert profiles[1599]["column_name"] == "c1599"
+    assert profiles[1599]["min_value"] == "1600"
+    assert all(profile["null_fraction"] == 0.5 for profile in profiles)
@@ -0,0 +1,105 @@
+def get_column_window(
+    column_token_counts: list[int], column_idx: int, token_budget: int
+) -> tuple[int, int]:
+    """
+    Get the neighbourhood of a column whose names fit in a token budget
+
+    The window grows alternately to the left and to the right of the column, so
+    the column stays in its middle unless it is close to either end of the table.
+
+    ### Parameters:
+    - column_token_counts (list[int]): The number of tokens of every column name
+    - column_idx (int): The index of the column the window is built around
+    - token_budget (int): The maximum number of tokens of the column names in the window
+
+    ### Returns:
+    - window (tuple[int, int]): The start (inclusive) and end (exclusive) indices
+      of the window; it always contains column_idx
+    """
+    start, end = column_idx, column_idx + 1
+    used_tokens = column_token_counts[column_idx]
+    grown = True
+    while grown:
+        grown = False
+        if start > 0 and used_tokens + column_token_counts[start - 1] <= token_budget:
+            start -= 1
+            used_tokens += column_token_counts[start]
+            grown = True
+        if (
+            end < len(column_token_counts)
+            and used_tokens + column_token_counts[end] <= token_budget
+        ):
+            used_tokens += column_token_counts[end]
+            end += 1
+            grown = True
+    return start, end
+
+
+def split_column_windows(
+    column_token_counts: list[int], token_budget: int, max_columns: int
+) -> list[tuple[int, int]]:
+    """
+    Split the columns of a table into consecutive windows that fit in a token budget
+
+    ### Parameters:
+    - column_token_counts (list[int]): The number of tokens of every column name
+    - token_budget (int): The maximum number of tokens of the column names in a window
+    - max_columns (int): The maximum number of columns in a window
+
+    ### Returns:
+    - windows (list[tuple[int, int]]): The start (inclusive) and end (exclusive)
+      indices of the windows; every window has at least one column
+    """
+    windows = []
+    start = 0
+    while start < len(column_token_counts):
+        end = start + 1
+        used_tokens = column_token_counts[start]
+        while (
+            end < len(column_token_counts)
+            and end - start < max_columns
+            and used_tokens + column_token_counts[end] <= token_budget
+        ):
+            used_tokens += column_token_counts[end]
+            end += 1
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+def format_column_window(columns: list[str], start: int, end: int) -> str:
+    """
+    Format a window of columns the way prompts list columns
+
+    ### Parameters:
+    - columns (list[str]): All columns of the table
+    - start (int): The start index (inclusive) of the window
+    - end (int): The end index (exclusive) of the window
+
+    ### Returns:
+    - columns (str): The columns of the window separated by " | ", with "..."
+      marking the columns left out on either side
+    """
+    window = columns[start:end]
+    if start > 0:
+        window = ["..."] + window
+    if end < len(columns):
+        window = window + ["..."]
+    return " | ".join(window)
+
+
+if __name__ == "__main__":
+    counts = [2] * 10
+    assert get_column_window(counts, 5, 100) == (0, 10)
+    assert get_column_window(counts, 5, 6) == (4, 7)
+    assert get_column_window(counts, 0, 6) == (0, 3)
+    assert get_column_window(counts, 9, 1) == (9, 10)
+    assert get_column_window([1, 50, 1, 1], 2, 5) == (2, 4)
+
+    assert split_column_windows(counts, 100, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert split_column_windows([3, 1, 9, 1], 4, 10) == [(0, 2), (2, 3), (3, 4)]
+    assert split_column_windows([], 4, 10) == []
+
+    columns = ["a", "b", "c", "d"]
+    assert format_column_window(columns, 0, 4) == "a | b | c | d"
+    assert format_column_window(columns, 1, 3) == "... | b | c | ..."
@@ -0,0 +1,217 @@
+import copy
+import hashlib
+import json
+from typing import Callable
+
+import duckdb
+import pandas as pd
+
+
+class LLMCache:
+    """
+    Persistent cache of LLM outputs, stored in storage.db
+
+    An entry is keyed by the model path, the generation parameters, and a hash of
+    the prompt (the whole conversation), so an output is only reused for exactly
+    the same generation. Generation is greedy and seeded in Pneuma, which is what
+    makes the outputs reusable. The cache holds at most max_entries entries; the
+    least recently used ones are evicted first.
+    """
+
+    def __init__(
+        self,
+        connection: duckdb.DuckDBPyConnection,
+        model_path: str,
+        max_entries: int = 100_000,
+    ):
+        self.connection = connection
+        self.model_path = model_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(
+        self, conversations: list[list[dict[str, str]]], generation_params: dict
+    ) -> list[list[dict[str, str]]]:
+        """
+        Look up the outputs of conversations
+
+        ### Parameters:
+        - conversations (list[list[dict[str, str]]]): The conversations to be prompted
+        - generation_params (dict): The parameters the conversations are prompted with
+
+        ### Returns:
+        - outputs (list[list[dict[str, str]]]): For every conversation, the
+          conversation appended with the cached output, or None on a miss
+        """
+        if self.max_entries <= 0 or not conversations:
+            return [None] * len(conversations)
+
+        params_key = self.__get_params_key(generation_params)
+        prompt_hashes = [self.__get_prompt_hash(conv) for conv in conversations]
+        hashes_df = pd.DataFrame({"prompt_hash": prompt_hashes})
+        cached_outputs = dict(
+            self.connection.execute(
+                """SELECT prompt_hash, output FROM llm_cache
+                WHERE model_path = ? AND generation_params = ?
+                AND prompt_hash IN (SELECT prompt_hash FROM hashes_df)""",
+                [self.model_path, params_key],
+            ).fetchall()
+        )
+
+        # Touch the entries that were used, so they are evicted last.
+        self.connection.execute(
+            """UPDATE llm_cache SET time_last_used = CURRENT_TIMESTAMP
+            WHERE model_path = ? AND generation_params = ?
+            AND prompt_hash IN (SELECT prompt_hash FROM hashes_df)""",
+            [self.model_path, params_key],
+        )
+
+        outputs = []
+        for conversation, prompt_hash in zip(conversations, prompt_hashes):
+            if prompt_hash in cached_outputs:
+                self.hits += 1
+                outputs.append(
+                    conversation
+                    + [{"role": "assistant", "content": cached_outputs[prompt_hash]}]
+                )
+            else:
+                self.misses += 1
+                outputs.append(None)
+        return outputs
+
+    def store(
+        self,
+        conversations: list[list[dict[str, str]]],
+        outputs: list[list[dict[str, str]]],
+        generation_params: dict,
+    ):
+        """
+        Store the outputs of conversations, then evict entries above max_entries
+
+        ### Parameters:
+        - conversations (list[list[dict[str, str]]]): The prompted conversations
+        - outputs (list[list[dict[str, str]]]): The conversations appended with
+          the model's outputs
+        - generation_params (dict): The parameters the conversations were prompted with
+        """
+        if self.max_entries <= 0:
+            return
+
+        params_key = self.__get_params_key(generation_params)
+        entries = {
+            self.__get_prompt_hash(conversation): output[-1]["content"]
+            for conversation, output in zip(conversations, outputs)
+            if output and output[-1]["role"] == "assistant"
+        }
+        if not entries:
+            return
+
+        entries_df = pd.DataFrame(
+            {"prompt_hash": list(entries.keys()), "output": list(entries.values())}
+        )
+        self.connection.execute(
+            """INSERT OR IGNORE INTO llm_cache
+            (model_path, generation_params, prompt_hash, output)
+            SELECT ?, ?, prompt_hash, output FROM entries_df""",
+            [self.model_path, params_key],
+        )
+        self.connection.execute(
+            """DELETE FROM llm_cache WHERE rowid IN (
+                SELECT rowid FROM llm_cache
+                ORDER BY time_last_used DESC
+                OFFSET ?
+            )""",
+            [self.max_entries],
+        )
+
+    def prompt(
+        self,
+        conversations: list[list[dict[str, str]]],
+        generation_params: dict,
+        generate: Callable[[list[list[dict[str, str]]]], list[list[dict[str, str]]]],
+    ) -> list[list[dict[str, str]]]:
+        """
+        Prompt conversations, generating only the outputs that are not cached yet
+
+        ### Parameters:
+        - conversations (list[list[dict[str, str]]]): The conversations to be prompted
+        - generation_params (dict): The parameters generate prompts with
+        - generate (Callable): Prompts a list of conversations and returns them
+          appended with the model's outputs, in the same order
+
+        ### Returns:
+        - conversations (list[list[dict[str, str]]]): The conversations appended
+          with the model's outputs
+        """
+        outputs = self.lookup(conversations, generation_params)
+        miss_indices = [idx for idx, output in enumerate(outputs) if output is None]
+        if not miss_indices:
+            return outputs
+
+        # The prompting interface truncates conversations in place, so the model
+        # gets copies and the cache is keyed by the original conversations.
+        miss_conversations = [conversations[idx] for idx in miss_indices]
+        miss_outputs = generate(copy.deepcopy(miss_conversations))
+        self.store(miss_conversations, miss_outputs, generation_params)
+        for idx, output in zip(miss_indices, miss_outputs):
+            outputs[idx] = output
+        return outputs
+
+    def get_stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __get_params_key(self, generation_params: dict) -> str:
+        return json.dumps(generation_params, sort_keys=True)
+
+    def __get_prompt_hash(self, conversation: list[dict[str, str]]) -> str:
+        return hashlib.sha256(
+            json.dumps(conversation, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+
+if __name__ == "__main__":
+    connection = duckdb.connect()
+    # Created by Registration.setup in storage.db.
+    connection.sql(
+        """CREATE TABLE llm_cache (
+            model_path VARCHAR NOT NULL,
+            generation_params VARCHAR NOT NULL,
+            prompt_hash VARCHAR NOT NULL,
+            output VARCHAR NOT NULL,
+            time_last_used TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (model_path, generation_params, prompt_hash)
+            )
+        """
+    )
+    cache = LLMCache(connection, "some/model", max_entries=2)
+    params = {"max_new_tokens": 400, "temperature": None}
+    conversations = [
+        [{"role": "user", "content": f"Describe column {column}"}]
+        for column in ["a", "b", "c"]
+    ]
+    assert cache.lookup(conversations, params) == [None, None, None]
+
+    outputs = [
+        conversation + [{"role": "assistant", "content": f"output {idx}"}]
+        for idx, conversation in enumerate(conversations)
+    ]
+    cache.store(conversations[:2], outputs[:2], params)
+    assert cache.lookup(conversations[:2], params) == outputs[:2]
+    assert cache.lookup(conversations[:1], {**params, "max_new_tokens": 1}) == [None]
+    assert LLMCache(connection, "other/model").lookup(conversations[:1], params) == [
+        None
+    ]
+
+    cache.store(conversations[2:], outputs[2:], params)
+    assert connection.sql("SELECT count(*) FROM llm_cache").fetchone()[0] == 2
+    assert cache.get_stats()["hits"] == 2
@@ -0,0 +1,78 @@
+import json
+import re
+from enum import Enum
+
+
+class NarrationMode(Enum):
+    # One prompt per column (the default).
+    COLUMN = "column"
+    # One structured prompt per table, describing all of its columns at once.
+    TABLE = "table"
+
+
+def get_table_narration_prompt(columns: str, target_columns: list[str]) -> str:
+    """
+    Build a prompt that asks for the descriptions of several columns as one JSON object
+
+    ### Parameters:
+    - columns (str): The columns of the table given as context, separated by " | "
+    - target_columns (list[str]): The columns to be described
+
+    ### Returns:
+    - prompt (str): The prompt
+    """
+    return f"""A table has the following columns:
+/*
+{columns}
+*/
+Describe briefly what each of the following columns represents:
+{json.dumps(target_columns)}
+Answer with a JSON object that maps every one of these column names to its description. If a description is not possible, use "No description." as the description."""
+
+
+def parse_table_narration(output: str, target_columns: list[str]) -> dict[str, str]:
+    """
+    Parse the column descriptions out of the answer to a table narration prompt
+
+    ### Parameters:
+    - output (str): The model's answer
+    - target_columns (list[str]): The columns that were to be described
+
+    ### Returns:
+    - descriptions (dict[str, str]): The description of every target column that
+      could be parsed; columns that are missing from the answer are left out
+    """
+    # Models often wrap the object in a Markdown code block or add a sentence
+    # around it, so only the outermost braces are parsed.
+    match = re.search(r"\{.*\}", output, re.DOTALL)
+    if match is None:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+
+    descriptions = {}
+    for column in target_columns:
+        description = parsed.get(column)
+        if isinstance(description, str) and description.strip():
+            descriptions[column] = description.strip()
+    return descriptions
+
+
+if __name__ == "__main__":
+    columns = ["id", "name", 'say "hi"']
+    prompt = get_table_narration_prompt(" | ".join(columns), columns[1:])
+    assert '["name", "say \\"hi\\""]' in prompt
+
+    output = """```json
+{"name": "The name of a person.", "say \\"hi\\"": " A greeting. "}
+```"""
+    assert parse_table_narration(output, columns[1:]) == {
+        "name": "The name of a person.",
+        'say "hi"': "A greeting.",
+    }
+    assert parse_table_narration('{"name": "Truncated', columns) == {}
+    assert parse_table_narration('{"name": 1, "id": "Key."}', columns) == {"id": "Key."}
@@ -0,0 +1,255 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+# Put after the last item into a queue, and returned to stages that stop early.
+END_OF_ITEMS = object()
+
+
+class PipelineExecutor:
+    """
+    Run items through a sequence of stages that overlap, one thread per stage
+
+    Every stage takes the outputs of the previous stage one at a time, in
+    order, and passes its own outputs on through a bounded queue. A stage works
+    on the next item while the stages after it still work on the previous ones,
+    and blocks once queue_size of its outputs wait for the next stage, so the
+    items buffered between two stages are bounded. The stages only overlap
+    while they release the GIL, as DuckDB, tokenizers, and torch do for their
+    work. If a stage fails, the others stop after their current item and the
+    error is raised in the calling thread.
+
+    For every stage, the executor measures the time it is busy, idle (waiting
+    for the stage before it), and blocked (waiting for the stage after it). The
+    stage that is busy the longest is the bottleneck of the pipeline. With
+    queue_size 0, the stages run one after another in the calling thread.
+    """
+
+    def __init__(
+        self, stages: list[tuple[str, Callable[[Any], Any]]], queue_size: int = 1
+    ):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.seconds = 0.0
+        self.stage_stats = {}
+        self.reset_stats()
+
+    def run(self, items: Iterable) -> Iterator:
+        """
+        Run items through the stages
+
+        ### Parameters:
+        - items (Iterable): The inputs of the first stage
+
+        ### Returns:
+        - outputs (Iterator): The outputs of the last stage, in the order of
+          the items, yielded as soon as they are done
+        """
+        start = time.time()
+        if self.queue_size <= 0:
+            try:
+                for item in items:
+                    for name, function in self.stages:
+                        item = self.__call_stage(name, function, item)
+                    yield item
+            finally:
+                self.seconds += time.time() - start
+            return
+
+        input_queue = queue.Queue()
+        for item in items:
+            input_queue.put(item)
+        input_queue.put(END_OF_ITEMS)
+        # The outputs of the last stage are taken by the caller, so their queue
+        # does not need a bound.
+        queues = (
+            [input_queue]
+            + [queue.Queue(self.queue_size) for _ in self.stages[1:]]
+            + [queue.Queue()]
+        )
+
+        stopped = threading.Event()
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.__run_stage,
+                args=(
+                    stage_idx,
+                    queues[stage_idx],
+                    queues[stage_idx + 1],
+                    stopped,
+                    errors,
+                ),
+                daemon=True,
+            )
+            for stage_idx in range(len(self.stages))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                output = self.__get(queues[-1], stopped)
+                if output is END_OF_ITEMS:
+                    break
+                yield output
+        finally:
+            # Also stops the stages if the caller does not consume every output.
+            stopped.set()
+            for thread in threads:
+                thread.join()
+            self.seconds += time.time() - start
+        if errors:
+            # The items the last stage finished before the failure (e.g., written
+            # windows) are still returned first.
+            while not queues[-1].empty():
+                output = queues[-1].get_nowait()
+                if output is not END_OF_ITEMS:
+                    yield output
+            raise errors[0]
+
+    def get_stats(self) -> dict:
+        """
+        Get the time every stage spent busy, idle, and blocked since the last reset
+
+        ### Returns:
+        - stats (dict): The wall time of the runs, the bottleneck stage, and for
+          every stage, the items it processed, its busy, idle, and blocked
+          seconds, its throughput (items per busy second), and its utilization
+          (the fraction of the wall time it was busy)
+        """
+        stages = {
+            name: {
+                **stats,
+                "items_per_second": (
+                    stats["items"] / stats["busy_seconds"]
+                    if stats["busy_seconds"]
+                    else 0.0
+                ),
+                "utilization": (
+                    stats["busy_seconds"] / self.seconds if self.seconds else 0.0
+                ),
+            }
+            for name, stats in self.stage_stats.items()
+        }
+        return {
+            "seconds": self.seconds,
+            "bottleneck": max(
+                stages, key=lambda name: stages[name]["busy_seconds"], default=None
+            ),
+            "stages": stages,
+        }
+
+    def reset_stats(self):
+        self.seconds = 0.0
+        self.stage_stats = {
+            name: {
+                "items": 0,
+                "busy_seconds": 0.0,
+                "idle_seconds": 0.0,
+                "blocked_seconds": 0.0,
+            }
+            for name, _ in self.stages
+        }
+
+    def __run_stage(
+        self,
+        stage_idx: int,
+        input_queue: queue.Queue,
+        output_queue: queue.Queue,
+        stopped: threading.Event,
+        errors: list[Exception],
+    ):
+        name, function = self.stages[stage_idx]
+        stats = self.stage_stats[name]
+        try:
+            while True:
+                wait_start = time.time()
+                item = self.__get(input_queue, stopped)
+                stats["idle_seconds"] += time.time() - wait_start
+                if item is END_OF_ITEMS:
+                    break
+                output = self.__call_stage(name, function, item)
+                wait_start = time.time()
+                if not self.__put(output_queue, output, stopped):
+                    return
+                stats["blocked_seconds"] += time.time() - wait_start
+            self.__put(output_queue, END_OF_ITEMS, stopped)
+        except Exception as error:
+            errors.append(error)
+            stopped.set()
+
+    def __call_stage(self, name: str, function: Callable[[Any], Any], item: Any):
+        stats = self.stage_stats[name]
+        start = time.time()
+        output = function(item)
+        stats["busy_seconds"] += time.time() - start
+        stats["items"] += 1
+        return output
+
+    def __get(self, input_queue: queue.Queue, stopped: threading.Event) -> Any:
+        # Waits in short intervals, so a stage notices when another one failed.
+        while not stopped.is_set():
+            try:
+                return input_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return END_OF_ITEMS
+
+    def __put(
+        self, output_queue: queue.Queue, item: Any, stopped: threading.Event
+    ) -> bool:
+        while True:
+            try:
+                output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if stopped.is_set():
+                    return False
+
+
+if __name__ == "__main__":
+
+    def read(item: int) -> int:
+        time.sleep(0.02)
+        return item
+
+    def generate(item: int) -> int:
+        time.sleep(0.05)
+        return item * 2
+
+    def write(item: int) -> int:
+        time.sleep(0.02)
+        return item + 1
+
+    stages = [("read", read), ("generate", generate), ("write", write)]
+    sequential = PipelineExecutor(stages, queue_size=0)
+    assert list(sequential.run(range(20))) == [item * 2 + 1 for item in range(20)]
+    pipelined = PipelineExecutor(stages, queue_size=2)
+    assert list(pipelined.run(range(20))) == [item * 2 + 1 for item in range(20)]
+
+    # The stages overlap, so the pipeline takes about as long as its slowest
+    # stage, which waits for neither of the others.
+    stats = pipelined.get_stats()
+    assert stats["bottleneck"] == "generate"
+    assert stats["seconds"] < 0.8 * sequential.get_stats()["seconds"]
+    assert stats["stages"]["generate"]["utilization"] > 0.8
+    assert stats["stages"]["write"]["idle_seconds"] > 0.4
+    assert all(stage["items"] == 20 for stage in stats["stages"].values())
+
+    # A bounded queue makes a fast stage wait for a slow one.
+    assert stats["stages"]["read"]["blocked_seconds"] > 0.4
+
+    def fail(item: int) -> int:
+        if item == 3:
+            raise ValueError("Item 3 failed.")
+        time.sleep(0.05)
+        return item
+
+    outputs = []
+    try:
+        for output in PipelineExecutor([("read", read), ("fail", fail)]).run(range(20)):
+            outputs.append(output)
+        assert False
+    except ValueError:
+        assert outputs == [0, 1, 2]
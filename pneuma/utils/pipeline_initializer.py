@@ -3,7 +3,11 @@ from transformers import pipeline
 
 
 def initialize_pipeline(
-    model_path: str, torch_dtype: dtype, context_length=8192, hf_token=""
+    model_path: str,
+    torch_dtype: dtype,
+    context_length=8192,
+    hf_token="",
+    device_map="auto",
 ):
     """
     Initialize a text generation pipeline
@@ -13,6 +17,8 @@ def initialize_pipeline(
     - torch_dtype (dtype): The data type of the model
     - context_length (int): The context length of the model
     - hf_token (str): HuggingFace token to access gated model
+    - device_map (str): Where to place the model, e.g., "cuda:1"; by default,
+      it is spread over all available devices
 
     ### Returns:
     - pipe (TextGenerationPipeline): The pipeline for text generation
@@ -32,7 +38,7 @@ def initialize_pipeline(
     pipe = pipeline(
         "text-generation",
         model=model_path,
-        device_map="auto",
+        device_map=device_map,
         torch_dtype=torch_dtype,
     )
 
@@ -1,14 +1,23 @@
+import copy
+import json
 import logging
+from typing import Callable
 
 import torch
 from torch.cuda import OutOfMemoryError
-from transformers import set_seed
+from transformers import DynamicCache, set_seed
 from transformers.pipelines.text_generation import TextGenerationPipeline
 from transformers.tokenization_utils_base import PreTrainedTokenizerBase
 
+from .batch_scheduler import pack_batches
+
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger("prompting_interface.py")
 
+# Number of generations skipped because a conversation was identical to another
+# one in the same call.
+saved_generations = 0
+
 
 def truncate_conversation_if_necessary(
     tokenizer: PreTrainedTokenizerBase,
@@ -38,6 +47,98 @@ def truncate_conversation_if_necessary(
     return conversation
 
 
+def deduplicate_conversations(
+    conversations: list[list[dict[str, str]]],
+) -> tuple[list[list[dict[str, str]]], list[int]]:
+    """
+    Deduplicate identical conversations, keeping the first occurrence of each
+
+    ### Parameters:
+    - conversations (list[list[dict[str, str]]]): The conversations to be prompted
+
+    ### Returns:
+    - unique_conversations (list[list[dict[str, str]]]): The distinct conversations
+    - inverse_indices (list[int]): For every conversation, the index of its
+      conversation in unique_conversations
+    """
+    global saved_generations
+    unique_conversations: list[list[dict[str, str]]] = []
+    unique_indices: dict[str, int] = {}
+    inverse_indices: list[int] = []
+    for conversation in conversations:
+        key = json.dumps(conversation, sort_keys=True)
+        if key not in unique_indices:
+            unique_indices[key] = len(unique_conversations)
+            unique_conversations.append(conversation)
+        inverse_indices.append(unique_indices[key])
+    saved_generations += len(conversations) - len(unique_conversations)
+    return unique_conversations, inverse_indices
+
+
+def expand_outputs(
+    outputs: list[list[dict[str, str]]], inverse_indices: list[int]
+) -> list[list[dict[str, str]]]:
+    """
+    Fan the outputs of deduplicated conversations back out in the original order
+
+    ### Parameters:
+    - outputs (list[list[dict[str, str]]]): The outputs of the distinct conversations
+    - inverse_indices (list[int]): As returned by deduplicate_conversations
+
+    ### Returns:
+    - outputs (list[list[dict[str, str]]]): One output per original conversation;
+      repeated outputs are copies, so they can be modified independently
+    """
+    expanded_outputs: list[list[dict[str, str]]] = []
+    used = [False] * len(outputs)
+    for unique_idx in inverse_indices:
+        if used[unique_idx]:
+            expanded_outputs.append(copy.deepcopy(outputs[unique_idx]))
+        else:
+            expanded_outputs.append(outputs[unique_idx])
+            used[unique_idx] = True
+    return expanded_outputs
+
+
+def prompt_deduplicated(
+    generate: Callable[[list[list[dict[str, str]]]], list[list[dict[str, str]]]],
+    conversations: list[list[dict[str, str]]],
+) -> list[list[dict[str, str]]]:
+    """
+    Prompt conversations with generate, generating each distinct conversation once
+
+    The prompting functions only merge identical conversations within one call,
+    so this is to be used when generate splits the conversations, e.g., into
+    batches or across replicas, where identical ones could land apart.
+
+    ### Parameters:
+    - generate (Callable): Prompts a list of conversations and returns them
+      appended with the model's outputs, in the same order
+    - conversations (list[list[dict[str, str]]]): The conversations to be prompted
+
+    ### Returns:
+    - conversations (list[list[dict[str, str]]]): The conversations appended
+      with the model's outputs
+    """
+    unique_conversations, inverse_indices = deduplicate_conversations(conversations)
+    return expand_outputs(generate(unique_conversations), inverse_indices)
+
+
+def get_saved_generations() -> int:
+    return saved_generations
+
+
+def reset_saved_generations():
+    global saved_generations
+    saved_generations = 0
+
+
+def add_saved_generations(count: int):
+    # Generations saved in other processes, e.g., by the replicas of a ReplicaPool.
+    global saved_generations
+    saved_generations += count
+
+
 def remove_unset_generation_configs(generation_configs: dict[str, any]):
     """
     Check whether a conversation is within context_length
@@ -70,6 +171,8 @@ def prompt_pipeline(
     """
     Prompt the pipeline with a conversation
 
+    Identical conversations are generated once and their outputs are repeated.
+
     ### Parameters:
     - pipe (TextGenerationPipeline): An initialized pipeline.
     - conversations (list[list[dict[str, str]]]): The data type of the model
@@ -95,6 +198,7 @@ def prompt_pipeline(
         "pad_token_id": pipe.tokenizer.eos_token_id,
     }
     remove_unset_generation_configs(generation_configs)
+    conversations, inverse_indices = deduplicate_conversations(conversations)
     try:
         for i in range(len(conversations)):
             conversations[i] = truncate_conversation_if_necessary(
@@ -109,7 +213,7 @@ def prompt_pipeline(
             answers = [answers]
         for answer in answers:
             results.append(answer[0]["generated_text"])
-        return results
+        return expand_outputs(results, inverse_indices)
     except Exception as error:
         logger.warning(error)
         torch.cuda.empty_cache()
@@ -131,6 +235,8 @@ def prompt_pipeline_robust(
     """
     Prompt the pipeline with a conversation in a robust manner (re-try with lower batch size)
 
+    Identical conversations are generated once and their outputs are repeated.
+
     ### Parameters:
     - pipe (TextGenerationPipeline): An initialized pipeline.
     - conversations (list[list[dict[str, str]]]): The data type of the model
@@ -156,6 +262,7 @@ def prompt_pipeline_robust(
         "pad_token_id": pipe.tokenizer.eos_token_id,
     }
     remove_unset_generation_configs(generation_configs)
+    conversations, inverse_indices = deduplicate_conversations(conversations)
     batch_size_1_counter = 0
     while True:
         try:
@@ -175,7 +282,7 @@ def prompt_pipeline_robust(
                 answers = [answers]
             for answer in answers:
                 results.append(answer[0]["generated_text"])
-            return (results, batch_size)
+            return (expand_outputs(results, inverse_indices), batch_size)
         except OutOfMemoryError:
             batch_size = max(batch_size - 10, 1)
             if batch_size == 1:
@@ -188,18 +295,226 @@ def prompt_pipeline_robust(
             logger.warning(f"Reducing batch size to {batch_size}")
 
 
+def get_common_prefix_length(token_ids_a: list[int], token_ids_b: list[int]) -> int:
+    prefix_length = 0
+    for token_a, token_b in zip(token_ids_a, token_ids_b):
+        if token_a != token_b:
+            break
+        prefix_length += 1
+    return prefix_length
+
+
+def group_by_common_prefix(
+    token_ids: list[list[int]], min_prefix_tokens: int
+) -> list[tuple[int, list[int]]]:
+    """
+    Group tokenized prompts that share a common prefix
+
+    Prompts are sorted so that prompts with long common prefixes are adjacent,
+    then grouped greedily. A prompt joins the current group as long as the
+    group's common prefix stays at least min_prefix_tokens long and keeps at
+    least half of its length, so a short prefix shared by unrelated groups (e.g.,
+    the chat template) does not merge them.
+
+    ### Parameters:
+    - token_ids (list[list[int]]): The token IDs of every prompt
+    - min_prefix_tokens (int): The minimum length of a prefix worth caching
+
+    ### Returns:
+    - groups (list[tuple[int, list[int]]]): The length of the common prefix and
+      the indices of the prompts of every group
+    """
+    groups: list[tuple[int, list[int]]] = []
+    for idx in sorted(range(len(token_ids)), key=lambda idx: token_ids[idx]):
+        if groups:
+            prefix_length, indices = groups[-1]
+            common_length = get_common_prefix_length(
+                token_ids[indices[0]][:prefix_length], token_ids[idx]
+            )
+            if common_length >= max(min_prefix_tokens, prefix_length / 2):
+                groups[-1] = (common_length, indices + [idx])
+                continue
+        groups.append((len(token_ids[idx]), [idx]))
+    return groups
+
+
+def prompt_pipeline_prefix_cached(
+    pipe: TextGenerationPipeline,
+    conversations: list[list[dict[str, str]]],
+    batch_size=2,
+    max_batch_tokens=None,
+    context_length=8192,
+    max_new_tokens=512,
+    do_sample=False,
+    top_k=0,
+    top_p=1.0,
+    penalty_alpha=0.0,
+    temperature=0.0,
+    min_prefix_tokens=32,
+):
+    """
+    Prompt the pipeline with conversations in batches, computing the KV cache of a common prefix once
+
+    Conversations are grouped by their common token prefix (see
+    group_by_common_prefix). The KV cache of each group's prefix is computed
+    once; the conversations of the group are packed into batches (see
+    pack_batches) and every batch is generated from a copy of the cache,
+    expanded to the batch size, so only the conversations' own suffixes are
+    encoded. The suffixes of a batch are left-padded up to the prefix, and the
+    padding is masked. This works on CPU as well as on GPU. Identical
+    conversations are generated once and their outputs are repeated.
+
+    ### Parameters:
+    - pipe (TextGenerationPipeline): An initialized pipeline.
+    - conversations (list[list[dict[str, str]]]): The data type of the model
+    - batch_size (int): The maximum number of conversations in a batch
+    - max_batch_tokens (int): The maximum cost of a batch in tokens, counting
+      padding and the tokens to be generated, or None for no limit
+    - context_length (int): The LLM's context length
+    - max_new_tokens (int): Max number of tokens generated for each prompt
+    - do_sample (bool): Perform sampling or not
+    - top_k (int): The number of tokens to consider when sampling
+    - top_p (float): Minimum cumulative probability of tokens being considered
+    - penalty_alpha (float): The amount of focus being put to ensure non-repetitiveness
+    - temperature (float): Control how sharp the distribution (smaller means sharper)
+    - min_prefix_tokens (int): The minimum length of a prefix worth caching
+
+    ### Returns:
+    - conversations (list[list[dict[str, str]]]): The conversations appended with the model's outputs
+    """
+    generation_configs = {
+        "max_new_tokens": max_new_tokens,
+        "top_k": top_k,
+        "top_p": top_p,
+        "do_sample": do_sample,
+        "penalty_alpha": penalty_alpha,
+        "temperature": temperature,
+        "pad_token_id": pipe.tokenizer.eos_token_id,
+    }
+    remove_unset_generation_configs(generation_configs)
+    conversations, inverse_indices = deduplicate_conversations(conversations)
+
+    token_ids = []
+    for i in range(len(conversations)):
+        conversations[i] = truncate_conversation_if_necessary(
+            pipe.tokenizer, conversations[i], context_length, max_new_tokens
+        )
+        token_ids.append(
+            pipe.tokenizer.apply_chat_template(
+                conversations[i], tokenize=True, add_generation_prompt=True
+            )
+        )
+
+    results: list[list[dict[str, str]]] = [None] * len(conversations)
+    set_seed(42, deterministic=True)
+    for prefix_length, indices in group_by_common_prefix(token_ids, min_prefix_tokens):
+        # Every conversation needs at least one token of its own to be encoded.
+        prefix_length = min(
+            [prefix_length] + [len(token_ids[idx]) - 1 for idx in indices]
+        )
+        prefix_cache = None
+        if len(indices) > 1 and prefix_length >= min_prefix_tokens:
+            prefix = torch.tensor(
+                [token_ids[indices[0]][:prefix_length]], device=pipe.model.device
+            )
+            with torch.no_grad():
+                prefix_cache = pipe.model(
+                    prefix, past_key_values=DynamicCache(), use_cache=True
+                ).past_key_values
+        else:
+            prefix_length = 0
+
+        for batch in pack_batches(
+            [len(token_ids[idx]) for idx in indices],
+            max_batch_tokens or float("inf"),
+            batch_size,
+            max_new_tokens,
+        ):
+            batch = [indices[batch_idx] for batch_idx in batch]
+            suffixes = [token_ids[idx][prefix_length:] for idx in batch]
+            padding_lengths = [
+                max(len(suffix) for suffix in suffixes) - len(suffix)
+                for suffix in suffixes
+            ]
+            input_ids = torch.tensor(
+                [
+                    token_ids[idx][:prefix_length]
+                    + [pipe.tokenizer.eos_token_id] * padding_length
+                    + suffix
+                    for idx, suffix, padding_length in zip(
+                        batch, suffixes, padding_lengths
+                    )
+                ],
+                device=pipe.model.device,
+            )
+            attention_mask = torch.tensor(
+                [
+                    [1] * prefix_length + [0] * padding_length + [1] * len(suffix)
+                    for suffix, padding_length in zip(suffixes, padding_lengths)
+                ],
+                device=pipe.model.device,
+            )
+            past_key_values = None
+            if prefix_cache is not None:
+                past_key_values = copy.deepcopy(prefix_cache)
+                past_key_values.batch_repeat_interleave(len(batch))
+            with torch.no_grad():
+                output_ids = pipe.model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    past_key_values=past_key_values,
+                    **generation_configs,
+                )
+            for row_idx, idx in enumerate(batch):
+                answer = pipe.tokenizer.decode(
+                    output_ids[row_idx, input_ids.shape[1] :], skip_special_tokens=True
+                )
+                results[idx] = conversations[idx] + [
+                    {"role": "assistant", "content": answer}
+                ]
+    return expand_outputs(results, inverse_indices)
+
+
 if __name__ == "__main__":
     import os
 
     import torch
 
+    # Identical tables (here, 6 tables of 3 columns with the same schema) cost
+    # one generation per distinct prompt, even if generate splits them into
+    # batches of 2.
+    generated_batches = []
+
+    def generate_in_batches(conversations):
+        outputs = []
+        for batch_start in range(0, len(conversations), 2):
+            batch = conversations[batch_start : batch_start + 2]
+            generated_batches.append(batch)
+            outputs += [
+                conversation + [{"role": "assistant", "content": "A column."}]
+                for conversation in batch
+            ]
+        return outputs
+
+    table_conversations = [
+        [{"role": "user", "content": f"Describe the column {column}."}]
+        for _ in range(6)
+        for column in ["a", "b", "c"]
+    ]
+    reset_saved_generations()
+    outputs = prompt_deduplicated(generate_in_batches, table_conversations)
+    assert sum(len(batch) for batch in generated_batches) == 3
+    assert get_saved_generations() == 15
+    assert [output[:-1] for output in outputs] == table_conversations
+    assert outputs[0] is not outputs[3]
+
     os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:8"
     os.environ["CUDA_VISIBLE_DEVICES"] = "0"
     import setproctitle
 
     setproctitle.setproctitle("python")
 
-    from pipeline_initializer import initialize_pipeline
+    from .pipeline_initializer import initialize_pipeline
 
     pipe = initialize_pipeline("meta-llama/Meta-Llama-3-8B-Instruct", torch.bfloat16)
     conversations = [[{"role": "user", "content": "Tell me about Illinois!"}]]
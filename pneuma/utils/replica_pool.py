@@ -0,0 +1,340 @@
+import multiprocessing
+import os
+import queue
+import traceback
+from types import SimpleNamespace
+from typing import Callable
+
+import torch
+from transformers import AutoConfig, AutoTokenizer
+
+from .pipeline_initializer import initialize_pipeline
+from .prompting_interface import (
+    add_saved_generations,
+    get_saved_generations,
+    prompt_pipeline_prefix_cached,
+    prompt_pipeline_robust,
+    reset_saved_generations,
+)
+
+# The prompting functions a replica runs, by the name sent through the queue.
+PROMPT_FUNCTIONS = {
+    "prompt_pipeline_robust": prompt_pipeline_robust,
+    "prompt_pipeline_prefix_cached": prompt_pipeline_prefix_cached,
+}
+
+
+def parse_device(device: str) -> tuple[str, list[int] | None]:
+    """
+    Parse the device of a replica, e.g., "cuda:1", "cpu", or "cpu:0-3,8"
+
+    ### Parameters:
+    - device (str): A torch device, optionally followed by the CPU cores the
+      replica is pinned to
+
+    ### Returns:
+    - device (str): The torch device
+    - core_set (list[int] | None): The CPU cores, or None if not pinned
+    """
+    if not device.startswith("cpu:"):
+        return device, None
+    core_set = []
+    for core_range in device.removeprefix("cpu:").split(","):
+        first, _, last = core_range.partition("-")
+        core_set += range(int(first), int(last or first) + 1)
+    return "cpu", core_set
+
+
+def get_replica_devices(num_replicas: int) -> list[str]:
+    """
+    Assign a device to every replica: one GPU each if there are enough GPUs,
+    otherwise an equal share of the CPU cores
+
+    ### Parameters:
+    - num_replicas (int): The number of replicas
+
+    ### Returns:
+    - devices (list[str]): The device of every replica (see parse_device)
+    """
+    if torch.cuda.device_count() >= num_replicas:
+        return [f"cuda:{idx}" for idx in range(num_replicas)]
+
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < num_replicas:
+        return ["cpu"] * num_replicas
+    return [
+        "cpu:"
+        + ",".join(
+            str(core)
+            for core in cores[
+                len(cores)
+                * idx
+                // num_replicas : len(cores)
+                * (idx + 1)
+                // num_replicas
+            ]
+        )
+        for idx in range(num_replicas)
+    ]
+
+
+def run_replica(
+    model_path: str,
+    torch_dtype: torch.dtype,
+    context_length: int,
+    device: str,
+    task_queue: multiprocessing.Queue,
+    result_queue: multiprocessing.Queue,
+):
+    # The entry point of a replica process: loads the model on its device and
+    # prompts tasks from the queue until it receives None.
+    device, core_set = parse_device(device)
+    if core_set is not None:
+        os.sched_setaffinity(0, core_set)
+        torch.set_num_threads(len(core_set))
+    pipe = initialize_pipeline(
+        model_path, torch_dtype, context_length=context_length, device_map=device
+    )
+    pipe.tokenizer.pad_token_id = pipe.model.config.eos_token_id
+    pipe.tokenizer.padding_side = "left"
+    result_queue.put((None, None, 0, None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        task_idx, function_name, conversations, params = task
+        reset_saved_generations()
+        try:
+            result = PROMPT_FUNCTIONS[function_name](pipe, conversations, **params)
+            result_queue.put((task_idx, result, get_saved_generations(), None))
+        except Exception:
+            result_queue.put((task_idx, None, 0, traceback.format_exc()))
+
+
+class ReplicaPool:
+    """
+    Replicas of an LLM in separate processes, prompted in parallel
+
+    Every replica loads the model on its own device (a GPU, or a set of CPU
+    cores it is pinned to). Prompts are sent to the replicas through one work
+    queue, so a replica takes the next task as soon as it is done with its
+    current one, and the results are returned in the order of the tasks.
+
+    The pool can be used in place of a TextGenerationPipeline by the Summarizer:
+    tokenizer is the model's tokenizer and model describes the model (its path,
+    config, dtype, and the device of the first replica) without loading it in
+    the calling process.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        devices: list[str],
+        torch_dtype: torch.dtype = torch.bfloat16,
+        context_length: int = 32768,
+    ):
+        context = multiprocessing.get_context("spawn")
+        self.task_queue = context.Queue()
+        self.result_queue = context.Queue()
+        self.processes = [
+            context.Process(
+                target=run_replica,
+                args=(
+                    model_path,
+                    torch_dtype,
+                    context_length,
+                    device,
+                    self.task_queue,
+                    self.result_queue,
+                ),
+                daemon=True,
+            )
+            for device in devices
+        ]
+        for process in self.processes:
+            process.start()
+
+        config = AutoConfig.from_pretrained(model_path)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.tokenizer.model_max_length = context_length
+        self.tokenizer.pad_token_id = config.eos_token_id
+        self.tokenizer.padding_side = "left"
+        self.model = SimpleNamespace(
+            name_or_path=model_path,
+            config=config,
+            dtype=torch_dtype,
+            device=torch.device(parse_device(devices[0])[0]),
+        )
+
+        # The models are loaded before anything is measured or prompted, e.g.,
+        # the free memory the batch token budget is calibrated from.
+        for _ in self.processes:
+            self.__get_result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Stop the replicas after their current tasks
+        """
+        for _ in self.processes:
+            self.task_queue.put(None)
+        for process in self.processes:
+            process.join()
+
+    def prompt_batches(
+        self,
+        batches: list[list[list[dict[str, str]]]],
+        on_batch_done: Callable[[int], None] = None,
+        **generation_params,
+    ) -> list[tuple[list[list[dict[str, str]]], int]]:
+        """
+        Prompt every batch of conversations with prompt_pipeline_robust on any replica
+
+        ### Parameters:
+        - batches (list[list[list[dict[str, str]]]]): The batches of conversations
+        - on_batch_done (Callable[[int], None]): Called with the index of every
+          batch that is done, in the order they are done
+        - generation_params: The parameters of prompt_pipeline_robust
+
+        ### Returns:
+        - results (list[tuple[list[list[dict[str, str]]], int]]): For every batch,
+          the conversations appended with the model's outputs and the batch size
+          they were generated with
+        """
+        return self.__run(
+            "prompt_pipeline_robust",
+            [
+                (batch, {**generation_params, "batch_size": len(batch)})
+                for batch in batches
+            ],
+            on_batch_done,
+        )
+
+    def prompt_prefix_cached(
+        self, conversations: list[list[dict[str, str]]], **generation_params
+    ) -> list[list[dict[str, str]]]:
+        """
+        Prompt conversations with prompt_pipeline_prefix_cached, split across the replicas
+
+        The conversations are split into one contiguous shard per replica, so
+        prompts sharing a prefix (e.g., those of one table) mostly stay together.
+
+        ### Parameters:
+        - conversations (list[list[dict[str, str]]]): The conversations to be prompted
+        - generation_params: The parameters of prompt_pipeline_prefix_cached
+
+        ### Returns:
+        - conversations (list[list[dict[str, str]]]): The conversations appended
+          with the model's outputs
+        """
+        num_shards = len(self.processes)
+        shards = [
+            conversations[
+                len(conversations)
+                * idx
+                // num_shards : len(conversations)
+                * (idx + 1)
+                // num_shards
+            ]
+            for idx in range(num_shards)
+        ]
+        results = self.__run(
+            "prompt_pipeline_prefix_cached",
+            [(shard, generation_params) for shard in shards if shard],
+        )
+        return [output for shard_outputs in results for output in shard_outputs]
+
+    def __run(
+        self,
+        function_name: str,
+        tasks: list[tuple[list[list[dict[str, str]]], dict]],
+        on_task_done: Callable[[int], None] = None,
+    ) -> list:
+        for task_idx, (conversations, params) in enumerate(tasks):
+            self.task_queue.put((task_idx, function_name, conversations, params))
+
+        # Every result is collected even if a task failed, so no result of this
+        # call is left in the queue for the next one.
+        results = [None] * len(tasks)
+        errors = []
+        for _ in tasks:
+            task_idx, result, saved_generations, error = self.__get_result()
+            if error is not None:
+                errors.append(error)
+                continue
+            results[task_idx] = result
+            add_saved_generations(saved_generations)
+            if on_task_done is not None:
+                on_task_done(task_idx)
+        if errors:
+            raise RuntimeError(f"A replica failed to prompt a batch:\n{errors[0]}")
+        return results
+
+    def __get_result(self) -> tuple[int, object, int, str | None]:
+        while True:
+            try:
+                task_idx, result, saved_generations, error = self.result_queue.get(
+                    timeout=1
+                )
+                return task_idx, result, saved_generations, error
+            except queue.Empty:
+                # A replica that died (e.g., killed while loading its model)
+                # never answers, so the pool fails instead of waiting forever.
+                for process in self.processes:
+                    if process.exitcode is not None:
+                        raise RuntimeError(
+                            f"A replica exited with code {process.exitcode}."
+                        )
+
+
+if __name__ == "__main__":
+    import copy
+
+    assert parse_device("cuda:1") == ("cuda:1", None)
+    assert parse_device("cpu:0-2,5") == ("cpu", [0, 1, 2, 5])
+
+    model_path = "HuggingFaceTB/SmolLM2-135M-Instruct"
+    generation_params = {
+        "context_length": 2048,
+        "max_new_tokens": 16,
+        "temperature": None,
+        "top_p": None,
+    }
+    conversations = [
+        [
+            {
+                "role": "user",
+                "content": f"Describe briefly what the column_{idx} column represents.",
+            }
+        ]
+        for idx in range(8)
+    ]
+
+    pipe = initialize_pipeline(model_path, torch.float32, 2048, device_map="cpu")
+    pipe.tokenizer.pad_token_id = pipe.model.config.eos_token_id
+    pipe.tokenizer.padding_side = "left"
+    expected_outputs = [
+        prompt_pipeline_robust(
+            pipe, copy.deepcopy([conversation]), batch_size=1, **generation_params
+        )[0][0]
+        for conversation in conversations
+    ]
+
+    with ReplicaPool(
+        model_path, get_replica_devices(2), torch.float32, 2048
+    ) as replica_pool:
+        results = replica_pool.prompt_batches(
+            [[conversation] for conversation in conversations], **generation_params
+        )
+        assert [outputs[0] for outputs, _ in results] == expected_outputs
+
+        outputs = replica_pool.prompt_prefix_cached(
+            copy.deepcopy(conversations), **generation_params
+        )
+        assert [output[:-1] for output in outputs] == conversations
@@ -0,0 +1,47 @@
+import duckdb
+import pandas as pd
+
+
+def sample_rows(
+    connection: duckdb.DuckDBPyConnection, relation: str, sample_size: int
+) -> pd.DataFrame:
+    """
+    Sample rows of a relation without reading it into pandas
+
+    The rows with the smallest hashes are kept. DuckDB computes this as a
+    streaming top-N, so memory does not depend on the size of the relation, and
+    unlike USING SAMPLE ... REPEATABLE, whose reservoir is only repeatable with a
+    single thread, the sample is the same for any number of threads and any
+    scan order.
+
+    ### Parameters:
+    - connection (DuckDBPyConnection): A connection (or cursor) to DuckDB
+    - relation (str): A FROM-clause expression, e.g., a quoted table name
+    - sample_size (int): The number of rows to sample; all rows of smaller
+      relations are returned
+
+    ### Returns:
+    - sample_df (DataFrame): The sampled rows, in the order of their hashes
+    """
+    return connection.sql(
+        f"""SELECT * EXCLUDE (__pneuma_row_hash)
+        FROM (SELECT *, hash(tbl) AS __pneuma_row_hash FROM {relation} AS tbl)
+        ORDER BY __pneuma_row_hash
+        LIMIT {int(sample_size)}"""
+    ).to_df()
+
+
+if __name__ == "__main__":
+    connection = duckdb.connect()
+    connection.sql(
+        "CREATE TABLE a AS SELECT range AS x, 'v' || range AS y FROM range(100000)"
+    )
+    connection.sql("CREATE TABLE b AS SELECT * FROM a ORDER BY x DESC")
+    sample_df = sample_rows(connection, "a", 5)
+    assert list(sample_df.columns) == ["x", "y"]
+    assert len(sample_df) == 5
+    assert sample_df.equals(sample_rows(connection, "b", 5))
+
+    connection.sql("SET threads = 4")
+    assert sample_df.equals(sample_rows(connection, "a", 5))
+    assert len(sample_rows(connection, "(SELECT * FROM a LIMIT 3)", 5)) == 3
@@ -0,0 +1,235 @@
+import logging
+import os
+import threading
+import time
+from enum import Enum
+
+import duckdb
+
+from .catalog import quote_identifier
+
+logger = logging.getLogger("StorageManager")
+
+
+class ConnectionRole(Enum):
+    # Registration, summarization, and indexing; one writing process at a time.
+    WRITER = "writer"
+    # Query-side reads; any number of processes, concurrently with the writer.
+    READER = "reader"
+
+
+class StorageManager:
+    """
+    Hand out connections to storage.db by role
+
+    DuckDB lets a database file be opened by a single read-write process or by
+    any number of read-only processes, but not both at once. Writers therefore
+    share one read-write instance per process (each component works on its own
+    cursor, so their transactions stay separate), and publish a snapshot of the
+    catalog tables when they finish a unit of work. Readers in other processes
+    open that snapshot read-only, so a query server keeps serving while another
+    process summarizes or indexes.
+    """
+
+    _managers: dict[str, "StorageManager"] = {}
+    _managers_lock = threading.Lock()
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        root, extension = os.path.splitext(db_path)
+        self.snapshot_path = f"{root}_snapshot{extension}"
+        self.writer_connection = None
+        self.writer_sessions = 0
+        self.writer_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, db_path: str) -> "StorageManager":
+        """
+        Get the storage manager of a database, shared by all components of a process
+
+        ### Parameters:
+        - db_path (str): The path to storage.db
+
+        ### Returns:
+        - storage_manager (StorageManager): The storage manager of db_path
+        """
+        db_path = os.path.abspath(db_path)
+        with cls._managers_lock:
+            if db_path not in cls._managers:
+                cls._managers[db_path] = StorageManager(db_path)
+            return cls._managers[db_path]
+
+    def connect(self, role: ConnectionRole) -> duckdb.DuckDBPyConnection:
+        """
+        Open a connection to the database for the given role
+
+        ### Parameters:
+        - role (ConnectionRole): WRITER for a read-write cursor on the shared
+          instance of this process, READER for a read-only connection
+
+        ### Returns:
+        - connection (DuckDBPyConnection): A connection (or cursor) to DuckDB;
+          a writer is closed when the last session of acquire_writer in this
+          process is released, so components that run next to such sessions
+          connect again after them
+        """
+        if role == ConnectionRole.WRITER:
+            with self.writer_lock:
+                if self.writer_connection is None:
+                    self.writer_connection = duckdb.connect(self.db_path)
+                return self.writer_connection.cursor()
+
+        # A process that already writes reads through its own instance; DuckDB
+        # does not allow a second, read-only instance of the same file.
+        if self.writer_connection is not None:
+            return self.writer_connection.cursor()
+        # Every writer publishes a snapshot when it finishes (starting with
+        # Registration.setup), so storage.db itself is only opened for databases
+        # that no writer of this version has finished with yet. This fails
+        # while another process writes.
+        if os.path.exists(self.snapshot_path):
+            return duckdb.connect(self.snapshot_path, read_only=True)
+        return duckdb.connect(self.db_path, read_only=True)
+
+    def acquire_writer(self, timeout: float = 600) -> duckdb.DuckDBPyConnection:
+        """
+        Open the read-write instance for a unit of work, waiting for other processes
+
+        Used by processes that share storage.db as writers, such as distributed
+        summarization workers: each holds the file only for a unit of work and
+        releases it (see release_writer) so the others can take their turn.
+        Sessions of the threads of a process share one instance.
+
+        ### Parameters:
+        - timeout (float): How many seconds to wait for other processes to
+          release the file
+
+        ### Returns:
+        - connection (DuckDBPyConnection): A read-write cursor, valid until the
+          session is released
+        """
+        with self.writer_lock:
+            if self.writer_connection is None:
+                deadline = time.time() + timeout
+                delay = 0.01
+                while True:
+                    try:
+                        self.writer_connection = duckdb.connect(self.db_path)
+                        break
+                    except duckdb.IOException as error:
+                        # Another process holds the lock on the file.
+                        if "lock" not in str(error) or time.time() > deadline:
+                            raise
+                        time.sleep(delay)
+                        delay = min(delay * 2, 1.0)
+            self.writer_sessions += 1
+            return self.writer_connection.cursor()
+
+    def release_writer(self):
+        """
+        End a session of acquire_writer; the last one closes the instance, so
+        other processes can open the file
+
+        The instance is closed even if components of this process got writers
+        from connect, since the workers of other processes would otherwise wait
+        for it until this process ends. Such components connect again before
+        their next use.
+        """
+        with self.writer_lock:
+            self.writer_sessions -= 1
+            if self.writer_sessions == 0:
+                self.writer_connection.close()
+                self.writer_connection = None
+
+    def publish_snapshot(self):
+        """
+        Copy the catalog tables into a new snapshot and atomically replace the old one
+
+        Registered tables and the LLM output cache are not copied; readers only
+        need the catalog. Readers
+        that still have the previous snapshot open keep reading it until they
+        reconnect.
+        """
+        if self.writer_connection is None:
+            return
+
+        connection = self.writer_connection.cursor()
+        database = connection.sql("SELECT current_database()").fetchone()[0]
+        catalog_tables = [
+            entry[0]
+            for entry in connection.sql(
+                """SELECT table_name FROM duckdb_tables()
+                WHERE database_name = current_database()
+                AND schema_name = 'main'
+                AND table_name <> 'llm_cache'
+                AND table_name NOT IN (SELECT id FROM table_status)"""
+            ).fetchall()
+        ]
+
+        temporary_path = f"{self.snapshot_path}.tmp"
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        # ATTACH cannot be prepared, so the path is escaped instead.
+        escaped_path = temporary_path.replace("'", "''")
+        connection.sql(f"ATTACH '{escaped_path}' AS pneuma_snapshot")
+        try:
+            for table in catalog_tables:
+                connection.sql(
+                    f"""CREATE TABLE pneuma_snapshot.{quote_identifier(table)} AS
+                    SELECT * FROM {quote_identifier(database)}.main.{quote_identifier(table)}"""
+                )
+        finally:
+            connection.sql("DETACH pneuma_snapshot")
+            connection.close()
+
+        try:
+            os.replace(temporary_path, self.snapshot_path)
+        except PermissionError:
+            # Windows does not replace a file that a reader still has open.
+            logger.warning(
+                "Snapshot %s is in use and has not been replaced.", self.snapshot_path
+            )
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "storage.db")
+        storage_manager = StorageManager.get(db_path)
+        assert StorageManager.get(db_path) is storage_manager
+
+        writer = storage_manager.connect(ConnectionRole.WRITER)
+        writer.sql("CREATE TABLE table_status (id VARCHAR PRIMARY KEY)")
+        writer.sql("CREATE TABLE table_summaries (table_id VARCHAR, summary JSON)")
+        writer.sql('CREATE TABLE "data.csv" AS SELECT 1 AS x')
+        writer.sql("INSERT INTO table_status VALUES ('data.csv')")
+        writer.sql("INSERT INTO table_summaries VALUES ('data.csv', '{}')")
+        storage_manager.publish_snapshot()
+
+        reader = duckdb.connect(storage_manager.snapshot_path, read_only=True)
+        assert reader.sql("SELECT count(*) FROM table_summaries").fetchone()[0] == 1
+        assert (
+            reader.sql(
+                "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'data.csv'"
+            ).fetchone()[0]
+            == 0
+        )
+
+        writer.sql("INSERT INTO table_summaries VALUES ('data.csv', '{}')")
+        storage_manager.publish_snapshot()
+        assert reader.sql("SELECT count(*) FROM table_summaries").fetchone()[0] == 1
+        reader.close()
+
+        reader = duckdb.connect(storage_manager.snapshot_path, read_only=True)
+        assert reader.sql("SELECT count(*) FROM table_summaries").fetchone()[0] == 2
+        reader.close()
+
+        # The last session closes the instance even though a writer was handed
+        # out by connect, so other processes can open the file.
+        storage_manager.acquire_writer()
+        storage_manager.release_writer()
+        assert storage_manager.writer_connection is None
+        reader = storage_manager.connect(ConnectionRole.READER)
+        assert reader.sql("SELECT count(*) FROM table_summaries").fetchone()[0] == 2
+        reader.close()
@@ -0,0 +1,35 @@
+from enum import Enum
+
+import duckdb
+
+
+class StorageMode(Enum):
+    # Copy the file into the database (the default).
+    TABLE = "table"
+    # Register a view over the original file; nothing is copied.
+    VIEW = "view"
+    # Store only a reservoir sample of the rows; the schema, row count, and
+    # fingerprint still describe the whole file.
+    SAMPLE = "sample"
+
+
+def drop_table_or_view(connection: duckdb.DuckDBPyConnection, name: str):
+    """
+    Drop a registered table regardless of whether it is stored as a table or a view
+
+    ### Parameters:
+    - connection (DuckDBPyConnection): A connection (or cursor) to DuckDB
+    - name (str): The unescaped name of the table or view
+    """
+    relation_type = connection.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_name = ?",
+        [name],
+    ).fetchone()
+    if relation_type is None:
+        return
+
+    escaped_name = name.replace('"', '""')
+    if relation_type[0] == "VIEW":
+        connection.sql(f'DROP VIEW "{escaped_name}"')
+    else:
+        connection.sql(f'DROP TABLE "{escaped_name}"')
@@ -0,0 +1,55 @@
+import duckdb
+
+
+# Every row is hashed on its own (md5 of its text representation, which also
+# contains the column names) and the 128-bit row hashes are summed per half.
+ROW_HASH_EXPRESSION = "md5_number(tbl::text)"
+FINGERPRINT_AGGREGATE = """md5(concat_ws(':',
+    count(*),
+    sum(__pneuma_row_hash >> 64),
+    sum(__pneuma_row_hash & 18446744073709551615)
+))"""
+
+
+def compute_table_fingerprint(
+    connection: duckdb.DuckDBPyConnection, relation: str
+) -> str:
+    """
+    Compute a content fingerprint of a relation in one streaming pass
+
+    Unlike md5(string_agg(...)), no string proportional to the table is ever
+    built, so memory stays bounded by DuckDB's vector size regardless of the
+    table size, and the result does not depend on the scan order of DuckDB's
+    parallel aggregation.
+
+    ### Parameters:
+    - connection (DuckDBPyConnection): A connection (or cursor) to DuckDB
+    - relation (str): A FROM-clause expression, e.g., a quoted table name
+      or a table function such as read_parquet('...')
+
+    ### Returns:
+    - fingerprint (str): The hex md5 fingerprint of the relation
+    """
+    return connection.sql(
+        f"""SELECT {FINGERPRINT_AGGREGATE}
+        FROM (
+            SELECT {ROW_HASH_EXPRESSION} AS __pneuma_row_hash
+            FROM {relation} AS tbl
+        )"""
+    ).fetchone()[0]
+
+
+if __name__ == "__main__":
+    connection = duckdb.connect()
+    connection.sql("CREATE TABLE a AS SELECT range AS x FROM range(10000)")
+    connection.sql("CREATE TABLE b AS SELECT range AS x FROM range(10000) ORDER BY -x")
+    connection.sql("CREATE TABLE c AS SELECT range AS y FROM range(10000)")
+    connection.sql("CREATE TABLE d AS SELECT 1 AS x FROM range(2)")
+    connection.sql("CREATE TABLE e AS SELECT 1 AS x FROM range(4)")
+
+    fingerprint_a = compute_table_fingerprint(connection, "a")
+    assert fingerprint_a == compute_table_fingerprint(connection, "b")
+    assert fingerprint_a != compute_table_fingerprint(connection, "c")
+    assert compute_table_fingerprint(connection, "d") != compute_table_fingerprint(
+        connection, "e"
+    )
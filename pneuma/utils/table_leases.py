@@ -0,0 +1,353 @@
+import logging
+import threading
+
+import duckdb
+
+from .storage_manager import StorageManager
+from .table_status import TableStatus
+
+logger = logging.getLogger("TableLeases")
+
+
+class TableLeases:
+    """
+    Leases of summarization workers on the tables they summarize, stored in storage.db
+
+    A worker claims a batch of tables by marking them IN_PROGRESS and recording
+    a lease: its owner ID and the time the lease expires. While it works on the
+    tables, it renews the lease (a heartbeat). Tables whose lease expired, e.g.,
+    because their worker crashed, can be claimed by another worker. A worker
+    only writes the summaries of the tables it still owns, checked in the same
+    transaction as the write, so a table taken over by another worker is not
+    summarized twice. Expiry times come from the clock of each worker, so the
+    clocks of the machines are assumed to be roughly in sync compared to the
+    lease length.
+    """
+
+    def __init__(self, connection: duckdb.DuckDBPyConnection):
+        self.connection = connection
+
+    def claim(self, owner: str, count: int, lease_seconds: float) -> list[str]:
+        """
+        Claim up to count registered tables, or tables whose lease expired, in one transaction
+
+        ### Parameters:
+        - owner (str): The ID of the claiming worker
+        - count (int): The maximum number of tables to claim
+        - lease_seconds (float): How long the lease lasts without a heartbeat
+
+        ### Returns:
+        - table_ids (list[str]): The IDs of the claimed tables
+        """
+        self.connection.begin()
+        try:
+            table_ids = [
+                entry[0]
+                for entry in self.connection.execute(
+                    """SELECT id FROM table_status
+                    WHERE status = ?
+                    OR (status = ? AND id NOT IN (
+                        SELECT table_id FROM table_leases WHERE lease_expiry >= now()
+                    ))
+                    ORDER BY id
+                    LIMIT ?""",
+                    [
+                        str(TableStatus.REGISTERED),
+                        str(TableStatus.IN_PROGRESS),
+                        count,
+                    ],
+                ).fetchall()
+            ]
+            self.connection.execute(
+                """UPDATE table_status SET status = ?
+                WHERE id IN (SELECT unnest(?::VARCHAR[]))""",
+                [str(TableStatus.IN_PROGRESS), table_ids],
+            )
+            # Expired leases of other workers are replaced.
+            self.connection.execute(
+                """INSERT OR REPLACE INTO table_leases
+                SELECT unnest(?::VARCHAR[]), ?, now() + to_seconds(?), now()""",
+                [table_ids, owner, lease_seconds],
+            )
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return table_ids
+
+    def renew(
+        self, owner: str, table_ids: list[str], lease_seconds: float
+    ) -> list[str]:
+        """
+        Extend the leases of a worker on tables it still owns
+
+        ### Parameters:
+        - owner (str): The ID of the worker
+        - table_ids (list[str]): The IDs of the tables to renew the leases of
+        - lease_seconds (float): How long the leases last from now on
+
+        ### Returns:
+        - table_ids (list[str]): The IDs of the tables the worker still owns
+        """
+        self.connection.execute(
+            """UPDATE table_leases
+            SET lease_expiry = now() + to_seconds(?), time_last_heartbeat = now()
+            WHERE owner = ? AND table_id IN (SELECT unnest(?::VARCHAR[]))""",
+            [lease_seconds, owner, table_ids],
+        )
+        return self.get_owned_table_ids(owner, table_ids)
+
+    def get_owned_table_ids(self, owner: str, table_ids: list[str]) -> list[str]:
+        """
+        Get the tables a worker still owns, i.e., that no other worker took over
+
+        A lease that expired is still owned until another worker claims the table.
+
+        ### Parameters:
+        - owner (str): The ID of the worker
+        - table_ids (list[str]): The IDs of the tables the worker claimed
+
+        ### Returns:
+        - table_ids (list[str]): The IDs of the tables the worker still owns
+        """
+        return [
+            entry[0]
+            for entry in self.connection.execute(
+                """SELECT table_id FROM table_leases
+                WHERE owner = ? AND table_id IN (SELECT unnest(?::VARCHAR[]))
+                AND table_id IN (SELECT id FROM table_status WHERE status = ?)""",
+                [owner, table_ids, str(TableStatus.IN_PROGRESS)],
+            ).fetchall()
+        ]
+
+    def release(self, owner: str, table_ids: list[str], status: TableStatus):
+        """
+        Drop the leases of a worker and give its tables a new status
+
+        Only tables the worker owns are changed. To be run in the transaction
+        that writes the tables' summaries, with status SUMMARIZED, or with
+        status REGISTERED to hand the tables back to other workers.
+
+        ### Parameters:
+        - owner (str): The ID of the worker
+        - table_ids (list[str]): The IDs of the tables to release
+        - status (TableStatus): The new status of the tables
+        """
+        table_ids = self.get_owned_table_ids(owner, table_ids)
+        self.connection.execute(
+            """UPDATE table_status SET status = ?
+            WHERE id IN (SELECT unnest(?::VARCHAR[]))""",
+            [str(status), table_ids],
+        )
+        self.connection.execute(
+            """DELETE FROM table_leases
+            WHERE table_id IN (SELECT unnest(?::VARCHAR[]))""",
+            [table_ids],
+        )
+
+    def release_expired(self) -> list[str]:
+        """
+        Register the tables whose lease expired again, e.g., those of crashed workers
+
+        Used where tables are not claimed, i.e., by summarization without
+        distribution, which otherwise would never summarize these tables.
+        Their former owners can no longer write them (see get_owned_table_ids).
+
+        ### Returns:
+        - table_ids (list[str]): The IDs of the released tables
+        """
+        self.connection.begin()
+        try:
+            table_ids = [
+                entry[0]
+                for entry in self.connection.execute(
+                    """SELECT id FROM table_status
+                    WHERE status = ? AND id NOT IN (
+                        SELECT table_id FROM table_leases WHERE lease_expiry >= now()
+                    )""",
+                    [str(TableStatus.IN_PROGRESS)],
+                ).fetchall()
+            ]
+            self.connection.execute(
+                """UPDATE table_status SET status = ?
+                WHERE id IN (SELECT unnest(?::VARCHAR[]))""",
+                [str(TableStatus.REGISTERED), table_ids],
+            )
+            self.connection.execute(
+                """DELETE FROM table_leases
+                WHERE table_id IN (SELECT unnest(?::VARCHAR[]))""",
+                [table_ids],
+            )
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return table_ids
+
+
+class LeaseHeartbeat:
+    """
+    Renew the leases of a worker in the background, e.g., while its LLM generates
+
+    Every interval, the heartbeat opens storage.db (see
+    StorageManager.acquire_writer), renews the leases, and releases it again.
+    """
+
+    def __init__(
+        self,
+        storage_manager: StorageManager,
+        owner: str,
+        table_ids: list[str],
+        lease_seconds: float,
+    ):
+        self.storage_manager = storage_manager
+        self.owner = owner
+        self.table_ids = table_ids
+        self.lease_seconds = lease_seconds
+        # Renewed three times per lease, so one late heartbeat does not lose it.
+        self.interval = lease_seconds / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            connection = self.storage_manager.acquire_writer()
+            try:
+                owned_table_ids = TableLeases(connection).renew(
+                    self.owner, self.table_ids, self.lease_seconds
+                )
+            except duckdb.TransactionException as error:
+                logger.warning("Could not renew the leases: %s", error)
+                continue
+            finally:
+                self.storage_manager.release_writer()
+            if len(owned_table_ids) < len(self.table_ids):
+                logger.warning(
+                    "%d tables have been taken over by other workers.",
+                    len(self.table_ids) - len(owned_table_ids),
+                )
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    import os
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "storage.db")
+        connection = duckdb.connect(db_path)
+        connection.sql(
+            "CREATE TABLE table_status (id VARCHAR PRIMARY KEY, status VARCHAR)"
+        )
+        connection.sql("CREATE TABLE table_summaries (table_id VARCHAR, owner VARCHAR)")
+        # Created by Registration.setup in storage.db.
+        connection.sql(
+            """CREATE TABLE table_leases (
+                table_id VARCHAR PRIMARY KEY,
+                owner VARCHAR NOT NULL,
+                lease_expiry TIMESTAMP NOT NULL,
+                time_last_heartbeat TIMESTAMP NOT NULL
+                )
+            """
+        )
+        connection.execute(
+            "INSERT INTO table_status SELECT 't' || range, ? FROM range(60)",
+            [str(TableStatus.REGISTERED)],
+        )
+        leases = TableLeases(connection)
+
+        # A worker that crashed: its lease expires right away and its tables
+        # are taken over; it can no longer write them afterwards.
+        crashed_table_ids = leases.claim("crashed", 5, 0)
+        assert len(crashed_table_ids) == 5
+        assert (
+            sorted(leases.renew("crashed", crashed_table_ids, 0)) == crashed_table_ids
+        )
+        connection.close()
+
+        def run_worker(owner: str):
+            # Workers in separate processes take turns on the database file and
+            # release it while they "generate". Leases are short, so some tables
+            # are taken over by other workers while they wait for the file.
+            storage_manager = StorageManager.get(db_path)
+            while True:
+                connection = storage_manager.acquire_writer()
+                try:
+                    table_ids = TableLeases(connection).claim(owner, 4, 0.9)
+                finally:
+                    storage_manager.release_writer()
+                if not table_ids:
+                    return
+
+                with LeaseHeartbeat(storage_manager, owner, table_ids, 0.9):
+                    time.sleep(0.4)
+
+                connection = storage_manager.acquire_writer()
+                try:
+                    connection.begin()
+                    leases = TableLeases(connection)
+                    owned_table_ids = leases.get_owned_table_ids(owner, table_ids)
+                    connection.execute(
+                        "INSERT INTO table_summaries SELECT unnest(?::VARCHAR[]), ?",
+                        [owned_table_ids, owner],
+                    )
+                    leases.release(owner, owned_table_ids, TableStatus.SUMMARIZED)
+                    connection.commit()
+                finally:
+                    storage_manager.release_writer()
+
+        # Forked, so the workers can be defined here; no database is open.
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=run_worker, args=(f"worker-{idx}",))
+            for idx in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+        connection = duckdb.connect(db_path)
+        assert (
+            connection.sql(
+                """SELECT count(DISTINCT table_id), count(*), count(DISTINCT owner)
+            FROM table_summaries"""
+            ).fetchone()
+            == (60, 60, 3)
+        )
+        assert connection.execute(
+            "SELECT count(*) FROM table_status WHERE status = ?",
+            [str(TableStatus.SUMMARIZED)],
+        ).fetchone() == (60,)
+        assert connection.sql("SELECT count(*) FROM table_leases").fetchone() == (0,)
+
+        leases = TableLeases(connection)
+        assert leases.get_owned_table_ids("crashed", crashed_table_ids) == []
+        assert leases.claim("late", 5, 60) == []
+
+        # Without distribution, tables are not claimed, so the tables of expired
+        # leases are registered again instead; live leases are kept.
+        connection.execute(
+            "INSERT INTO table_status VALUES ('t60', ?), ('t61', ?)",
+            [str(TableStatus.REGISTERED), str(TableStatus.REGISTERED)],
+        )
+        live_table_ids = leases.claim("live", 1, 60)
+        expired_table_ids = leases.claim("crashed", 1, 0)
+        assert leases.release_expired() == expired_table_ids
+        assert leases.get_owned_table_ids("crashed", expired_table_ids) == []
+        assert leases.get_owned_table_ids("live", live_table_ids) == live_table_ids
+        assert connection.execute(
+            "SELECT count(*) FROM table_status WHERE status = ?",
+            [str(TableStatus.REGISTERED)],
+        ).fetchone() == (1,)
+        connection.close()
@@ -5,3 +5,5 @@ class TableStatus(Enum):
     REGISTERED = 1
     SUMMARIZED = 2
     DELETED = 3
+    # Claimed by a summarization worker that holds a lease on it (see TableLeases).
+    IN_PROGRESS = 4